@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Check that the configured ITEM_PIPELINES keep datoscif and infobel companies
+
+Runs the test_pipeline spider (its items are built in the spider, no request
+leaves the machine) through the project's ITEM_PIPELINES and checks the
+exported items: names stripped, the duplicate dropped, typed columns derived
+for datoscif companies and the infobel company, stored under `name`, kept.
+Exits with status 1 when a check fails.
+
+Example:
+    python check_pipelines.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SCRAPY_PROJECT_DIR = 'infobelscrapping'
+
+SETTINGS = [
+    'PHONE_ENRICHMENT_ENABLED=0',
+    'STATS_FLUSH_INTERVAL=0',
+    'STATS_TIMELINE_FILE=',
+    'CHECKPOINT_ENABLED=0',
+]
+
+
+def crawl_test_items(tmp):
+    output_file = os.path.join(tmp, 'items.jl')
+    command = ['scrapy', 'crawl', 'test_pipeline', '-O', f'{output_file}:jsonlines', '-L', 'WARNING',
+               '-s', f"STATS_FILE={os.path.join(tmp, 'stats.json')}"]
+    for setting in SETTINGS:
+        command += ['-s', setting]
+    subprocess.run(command, cwd=SCRAPY_PROJECT_DIR, check=True)
+    with open(output_file, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        items = crawl_test_items(tmp)
+
+    names = [item.get('company_name') or item.get('name') for item in items]
+    infobel = [item for item in items if 'name' in item]
+    datoscif = [item for item in items if 'company_name' in item]
+    checks = [
+        ("datoscif names are stripped", 'TECH SOLUTIONS BARCELONA SL' in names),
+        ("the duplicate company is dropped", names.count('MADRID CONSULTING GROUP SL') == 1),
+        ("datoscif companies get typed columns",
+         bool(datoscif) and all(item.get('social_capital_eur') for item in datoscif)),
+        ("the infobel company is kept", [item['name'] for item in infobel] == ['Bar Pepe']),
+        ("the infobel company keeps its phone and link",
+         bool(infobel) and infobel[0].get('phone') == '+34915555123' and infobel[0].get('link', '').startswith('https://')),
+    ]
+
+    failed = 0
+    for description, ok in checks:
+        print(f"{'✓' if ok else '✗'} {description}")
+        failed += not ok
+    print(f"{len(items)} items exported: {names}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Local read API over the enriched company dataset
+
+The records are loaded once into an indexed SQLite file. The HTTP server
+answers filtered, paginated queries from that file, so it starts instantly
+and never holds the dataset in memory.
+
+Endpoints:
+    GET /companies?province=Madrid&municipality=&has_phone=1&cnae=56&from=2025-05-01&to=2025-05-31&limit=50&cursor=...
+    GET /companies/by-url?url=https://www.datoscif.es/empresa/...
+    GET /health
+
+Pages are ordered by row id (by start date when a date range is given), and
+`next_cursor` is an opaque token to pass back as `cursor`. Every response
+carries an ETag derived from the dataset version and the query, and a
+matching If-None-Match gets a 304 without touching the database.
+
+Examples:
+    python company_api.py build companies_with_phones_enhanced.json
+    python company_api.py serve --port 8080
+    python company_api.py loadtest --requests 5000 --concurrency 8
+"""
+
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from export_companies import has_phone
+from infobelscrapping.infobelscrapping.normalization import normalize_company
+from record_io import iter_records
+
+DEFAULT_DB_FILE = 'companies.sqlite'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    id INTEGER PRIMARY KEY,
+    url TEXT UNIQUE NOT NULL,
+    province TEXT,
+    municipality TEXT,
+    has_phone INTEGER NOT NULL,
+    start_date_iso TEXT,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS company_cnae (
+    company_id INTEGER NOT NULL,
+    code TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS companies_province ON companies (province, id);
+CREATE INDEX IF NOT EXISTS companies_municipality ON companies (municipality, id);
+CREATE INDEX IF NOT EXISTS companies_has_phone ON companies (has_phone, id);
+CREATE INDEX IF NOT EXISTS companies_start_date ON companies (start_date_iso, id);
+CREATE INDEX IF NOT EXISTS company_cnae_code ON company_cnae (code, company_id);
+CREATE INDEX IF NOT EXISTS company_cnae_company ON company_cnae (company_id);
+"""
+
+
+def filter_key(value: Optional[str]) -> Optional[str]:
+    """Case-insensitive lookup key for province and municipality filters"""
+    return value.strip().lower() if value else None
+
+
+def load_records(db_path: str, records: Iterable[Dict]) -> Dict:
+    """Insert or update records by url and bump the dataset version"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    counts = {'loaded': 0, 'skipped': 0}
+    with conn:
+        for record in records:
+            url = record.get('url')
+            if not url:
+                counts['skipped'] += 1
+                continue
+            typed = record if 'start_date_iso' in record else {**record, **normalize_company(record)}
+            row = conn.execute(
+                """INSERT INTO companies (url, province, municipality, has_phone, start_date_iso, record)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET
+                       province = excluded.province, municipality = excluded.municipality,
+                       has_phone = excluded.has_phone, start_date_iso = excluded.start_date_iso,
+                       record = excluded.record
+                   RETURNING id""",
+                (url, filter_key(record.get('province')), filter_key(record.get('municipality')),
+                 int(has_phone(record)), typed['start_date_iso'], json.dumps(typed, ensure_ascii=False))
+            ).fetchone()
+            company_id = row[0]
+            conn.execute("DELETE FROM company_cnae WHERE company_id = ?", (company_id,))
+            codes = [typed['cnae_primary']] + typed['cnae_secondary'] if typed['cnae_primary'] else []
+            conn.executemany("INSERT INTO company_cnae (company_id, code) VALUES (?, ?)",
+                             [(company_id, code) for code in codes])
+            counts['loaded'] += 1
+        # A new version invalidates every ETag handed out so far
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (uuid.uuid4().hex,))
+    conn.execute("ANALYZE")
+    conn.close()
+    return counts
+
+
+def encode_cursor(sort_key: List) -> str:
+    """Opaque token holding the sort key of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(sort_key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> List:
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("cursor")
+    if not isinstance(sort_key, list):
+        raise ValueError("cursor")
+    return sort_key
+
+
+def check_cursor(sort_key: List, order: List[str]):
+    """Reject cursors whose values do not match the page order (start date string, integer id)"""
+    if len(sort_key) != len(order):
+        raise ValueError("cursor")
+    for column, value in zip(order, sort_key):
+        expected = int if column == 'id' else str
+        # bool is an int subclass; true/false are not ids
+        if type(value) is not expected:
+            raise ValueError("cursor")
+
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+class CompanyDatabase:
+    """Read-only queries over the SQLite file, one connection per thread"""
+
+    def __init__(self, db_path: str):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"{db_path} not found, run 'company_api.py build' first")
+        self.db_path = db_path
+        self.local = threading.local()
+        self.file_state = None
+        self.cached_version = None
+        # Read once here so a file without a version fails at startup
+        self.version
+
+    @property
+    def version(self) -> str:
+        """Dataset version, re-read whenever a build has changed the database file"""
+        stat = os.stat(self.db_path)
+        file_state = (stat.st_mtime_ns, stat.st_size)
+        if file_state != self.file_state:
+            self.cached_version = self.connection().execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            self.file_state = file_state
+        return self.cached_version
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+            self.local.conn = conn
+        return conn
+
+    def etag(self, path: str, query: str) -> str:
+        digest = hashlib.sha1(f'{self.version}|{path}|{query}'.encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    def query(self, params: Dict[str, str]) -> Dict:
+        clauses: List[str] = []
+        args: List = []
+        if params.get('province'):
+            clauses.append("province = ?")
+            args.append(filter_key(params['province']))
+        if params.get('municipality'):
+            clauses.append("municipality = ?")
+            args.append(filter_key(params['municipality']))
+        if params.get('has_phone') in ('1', 'true'):
+            clauses.append("has_phone = 1")
+        elif params.get('has_phone') in ('0', 'false'):
+            clauses.append("has_phone = 0")
+        if params.get('cnae'):
+            # Prefix match as a range scan of the code index; an EXISTS per row would
+            # scan the whole table for rare codes
+            prefix = params['cnae']
+            clauses.append("id IN (SELECT company_id FROM company_cnae WHERE code >= ? AND code < ?)")
+            args += [prefix, prefix + '\uffff']
+        if params.get('from'):
+            clauses.append("start_date_iso >= ?")
+            args.append(params['from'])
+        if params.get('to'):
+            clauses.append("start_date_iso <= ?")
+            args.append(params['to'])
+        # Date-filtered pages follow the start date index, so SQLite never has to sort the range
+        order = ['start_date_iso', 'id'] if params.get('from') or params.get('to') else ['id']
+        if params.get('cursor'):
+            sort_key = decode_cursor(params['cursor'])
+            check_cursor(sort_key, order)
+            clauses.append(f"({', '.join(order)}) > ({', '.join('?' * len(order))})")
+            args += sort_key
+
+        limit = parse_limit(params.get('limit'))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.connection().execute(
+            f"SELECT {', '.join(order)}, record FROM companies {where} ORDER BY {', '.join(order)} LIMIT ?",
+            args + [limit + 1]
+        ).fetchall()
+
+        next_cursor = encode_cursor(list(rows[limit - 1][:-1])) if len(rows) > limit else None
+        # The records are stored as JSON already, so they are spliced in without re-encoding
+        items = ','.join(row[-1] for row in rows[:limit])
+        return {'items_json': f'[{items}]', 'count': min(len(rows), limit), 'next_cursor': next_cursor}
+
+    def by_url(self, url: str) -> Optional[str]:
+        row = self.connection().execute("SELECT record FROM companies WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def count(self) -> int:
+        return self.connection().execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+
+
+class CompanyAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; Nagle plus delayed ACKs would add ~40 ms to each
+    disable_nagle_algorithm = True
+    database: CompanyDatabase = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: str, etag: Optional[str] = None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_body(status, json.dumps({'error': message}))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+
+        if parts.path == '/health':
+            self.send_body(200, json.dumps({'status': 'ok', 'companies': self.database.count(),
+                                            'version': self.database.version}))
+            return
+        if parts.path not in ('/companies', '/companies/by-url'):
+            self.send_error_json(404, f"Unknown path {parts.path}")
+            return
+
+        etag = self.database.etag(parts.path, parts.query)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if parts.path == '/companies/by-url':
+            record = self.database.by_url(params.get('url', ''))
+            if record is None:
+                self.send_error_json(404, "Company not found")
+            else:
+                self.send_body(200, record, etag)
+            return
+
+        try:
+            page = self.database.query(params)
+        except ValueError as e:
+            self.send_error_json(400, f"Invalid parameter: {e}")
+            return
+        except sqlite3.Error as e:
+            self.send_error_json(500, f"Database error: {e}")
+            return
+        body = (f'{{"count": {page["count"]}, "next_cursor": {json.dumps(page["next_cursor"])}, '
+                f'"items": {page["items_json"]}}}')
+        self.send_body(200, body, etag)
+
+
+def make_server(db_path: str, host: str = '127.0.0.1', port: int = 8080) -> ThreadingHTTPServer:
+    handler = type('Handler', (CompanyAPIHandler,), {'database': CompanyDatabase(db_path)})
+    # The default listen backlog of 5 drops connections from bursts of clients
+    server_class = type('CompanyAPIServer', (ThreadingHTTPServer,), {'request_queue_size': 128})
+    server = server_class((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# Query mix of the load test: filtered first pages, followed by one cursor page each
+LOADTEST_QUERIES = [
+    {},
+    {'has_phone': '1'},
+    {'province': 'Madrid'},
+    {'province': 'Barcelona', 'has_phone': '1'},
+    {'cnae': '56'},
+    {'cnae': '7020'},
+    {'from': '2025-05-01', 'to': '2025-05-31'},
+    {'municipality': 'Valencia', 'limit': '20'},
+]
+
+
+def run_loadtest(host: str, port: int, requests: int, concurrency: int) -> Dict:
+    """Fire the query mix from several keep-alive clients and collect latencies"""
+    latencies: List[float] = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+    statuses: Dict[int, int] = {}
+
+    def fetch(conn: http.client.HTTPConnection, path: str, headers: Dict) -> Tuple[int, bytes, Dict]:
+        start = time.perf_counter()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        return response.status, body, dict(response.getheaders())
+
+    def worker():
+        conn = http.client.HTTPConnection(host, port)
+        etags = {}
+        while True:
+            with lock:
+                n = next(counter, None)
+            if n is None:
+                break
+            params = LOADTEST_QUERIES[n % len(LOADTEST_QUERIES)]
+            path = f"/companies?{urlencode(params)}"
+            # Every third request revalidates a page it has seen before
+            headers = {'If-None-Match': etags[path]} if n % 3 == 0 and path in etags else {}
+            status, body, response_headers = fetch(conn, path, headers)
+            if status == 200:
+                etags[path] = response_headers.get('ETag')
+                cursor = json.loads(body)['next_cursor']
+                if cursor and n % 2:
+                    fetch(conn, f"/companies?{urlencode({**params, 'cursor': cursor})}", {})
+        conn.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'requests_per_sec': len(latencies) / wall_time,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed read API over the enriched company dataset")
+    parser.add_argument('--db', default=DEFAULT_DB_FILE, help="SQLite file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Load or update companies from JSON/JSONL files")
+    build.add_argument('inputs', nargs='+')
+
+    serve = subparsers.add_parser('serve', help="Run the HTTP API")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+
+    loadtest = subparsers.add_parser('loadtest', help="Measure latency percentiles against a server")
+    loadtest.add_argument('--host', default='127.0.0.1')
+    loadtest.add_argument('--port', type=int, default=0,
+                          help="Port of a running server (default: start one in-process)")
+    loadtest.add_argument('--requests', type=int, default=2000)
+    loadtest.add_argument('--concurrency', type=int, default=8)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for path in args.inputs:
+            counts = load_records(args.db, iter_records(path))
+            print(f"{path}: {counts['loaded']} companies loaded, {counts['skipped']} without url")
+        print(f"✓ {args.db} ready")
+        return
+
+    if args.command == 'serve':
+        server = make_server(args.db, args.host, args.port)
+        print(f"Serving {args.db} on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    server = None
+    port = args.port
+    if not port:
+        server = make_server(args.db, args.host, 0)
+        port = server.server_address[1]
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        result = run_loadtest(args.host, port, args.requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print(f"Requests: {result['requests']} ({result['statuses']})")
+    print(f"Throughput: {result['requests_per_sec']:.0f} req/s with {args.concurrency} clients")
+    print(f"Latency: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+          f"p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-import json
-import csv
 import os
 
+from export_companies import CSV_COLUMNS, CsvExporter, RecordFilter, export_records
+from record_io import iter_records
+
 def create_companies_with_phones_csv():
     """Create CSV file with only companies that have phone numbers"""
     
@@ -24,57 +25,27 @@ def create_companies_with_phones_csv():
     
     print(f"Loading data from: {input_file}")
     
-    # Load the data
-    with open(input_file, 'r', encoding='utf-8') as f:
-        companies_data = json.load(f)
-    
-    # Filter companies with phone numbers
-    companies_with_phones = []
-    for company in companies_data:
-        phone = company.get('phone')
-        if phone and phone.strip() and phone != 'Not found':
-            companies_with_phones.append(company)
-    
-    if not companies_with_phones:
+    # Stream the data into a temporary CSV, keeping only companies with phone
+    # numbers; it replaces the previous export only once it has some
+    output_file = 'companies_with_phones.csv'
+    tmp_file = f'{output_file}.tmp'
+    exporter = CsvExporter(tmp_file, columns=CSV_COLUMNS)
+    try:
+        counts = export_records(iter_records(input_file), [exporter], RecordFilter(has_phone=True))
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+    
+    if not counts['matched']:
+        os.remove(tmp_file)
         print("No companies with phone numbers found in the data.")
         return
-    
-    # Define CSV columns
-    csv_columns = [
-        'company_name',
-        'phone',
-        'address',
-        'postal_code',
-        'municipality',
-        'province',
-        'business_purpose',
-        'social_capital',
-        'start_date',
-        'coordinates',
-        'url'
-    ]
-    
-    # Create CSV file
-    output_file = 'companies_with_phones.csv'
-    
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=csv_columns)
-        
-        # Write header
-        writer.writeheader()
-        
-        # Write data
-        for company in companies_with_phones:
-            # Create row with only the columns we want
-            row = {}
-            for col in csv_columns:
-                row[col] = company.get(col, '')
-            writer.writerow(row)
+    os.replace(tmp_file, output_file)
     
     print(f"✓ Created {output_file}")
-    print(f"✓ Total companies with phones: {len(companies_with_phones)}")
-    print(f"✓ Out of {len(companies_data)} total companies")
-    print(f"✓ Success rate: {len(companies_with_phones)/len(companies_data)*100:.1f}%")
+    print(f"✓ Total companies with phones: {counts['matched']}")
+    print(f"✓ Out of {counts['seen']} total companies")
+    print(f"✓ Success rate: {counts['matched']/counts['seen']*100:.1f}%")
 
 if __name__ == "__main__":
-    create_companies_with_phones_csv()
\ No newline at end of file
+    create_companies_with_phones_csv()
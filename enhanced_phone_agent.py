@@ -1,12 +1,23 @@
+import argparse
+import contextlib
 import json
 import re
 import time
-import requests
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 import logging
 from urllib.parse import quote_plus
 import os
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from company_store import CompanyStore
+from egress_pool import EgressPool
+from infobelscrapping.infobelscrapping.event_log import EventLog, setup_event_log
+from record_index import IndexedJsonl, has_index, parse_split
+from record_io import iter_records
+from search_archive import SearchArchive, reextract
 
 @dataclass
 class SearchResult:
@@ -16,12 +27,26 @@ class SearchResult:
     phone_found: Optional[str] = None
 
 class EnhancedPhoneSearchAgent:
-    def __init__(self, search_delay: float = 1.0):
+    def __init__(self, search_delay: float = 1.0, egress_pool: Optional[EgressPool] = None,
+                 shared_limiter=None, archive=None):
         self.search_delay = search_delay
-        self.session = requests.Session()
-        self.session.headers.update({
+        # SearchArchive keeping every results page for later re-extraction
+        self.archive = archive
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        }
+        # Searches are paced by the exits' rate budgets; without a pool, one
+        # direct exit sends a search every search_delay seconds. A
+        # SharedRateLimiter makes those budgets hold across processes
+        if egress_pool is None:
+            egress_pool = EgressPool.direct(self.headers, rate=1 / search_delay if search_delay else 0)
+        elif not egress_pool.default_headers:
+            egress_pool.default_headers = self.headers
+        if shared_limiter is not None:
+            egress_pool.shared_limiter = shared_limiter
+        self.egress = egress_pool
+        # Company rows are updated from several workers
+        self.write_lock = threading.Lock()
         
         # Spanish phone number patterns
         self.phone_patterns = [
@@ -36,8 +61,9 @@ class EnhancedPhoneSearchAgent:
             r'(7\d{8})',  # Mobile numbers starting with 7
         ]
         
-        logging.basicConfig(level=logging.INFO)
+        # Logging is configured by the caller (main() below, run_pipeline.py, Scrapy)
         self.logger = logging.getLogger(__name__)
+        self.events = EventLog(self.logger)
         
     def clean_phone_number(self, phone: str) -> str:
         """Clean and standardize phone number format"""
@@ -65,112 +91,129 @@ class EnhancedPhoneSearchAgent:
         
         return list(set(phones))  # Remove duplicates
     
-    def search_duckduckgo(self, query: str) -> List[SearchResult]:
+    def search_url(self, query: str) -> str:
+        """Build the DuckDuckGo HTML search URL for a query"""
+        return f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
+    
+    def parse_search_results(self, text_content: str) -> List[SearchResult]:
+        """Parse a DuckDuckGo HTML results page into search results"""
+        # Parse search results (simplified - you might want more robust parsing)
+        results = []
+        
+        # Extract snippets that might contain phone numbers
+        snippet_pattern = r'<a class="result__snippet"[^>]*>(.*?)</a>'
+        snippets = re.findall(snippet_pattern, text_content, re.DOTALL)
+        
+        for snippet in snippets[:5]:  # Take first 5 results
+            # Clean HTML tags
+            clean_snippet = re.sub(r'<[^>]+>', '', snippet)
+            phones = self.extract_phones(clean_snippet)
+            
+            result = SearchResult(
+                title="DuckDuckGo Result",
+                snippet=clean_snippet[:200],
+                url="",
+                phone_found=phones[0] if phones else None
+            )
+            results.append(result)
+        
+        return results
+    
+    def search_duckduckgo(self, query: str, company_data: Optional[Dict] = None,
+                          strategy: Optional[int] = None) -> List[SearchResult]:
         """Search using DuckDuckGo (free alternative to Google)"""
         try:
-            url = f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
-            response = self.session.get(url, timeout=10)
+            url = self.search_url(query)
+            response = self.egress.get(url, timeout=10)
             
             if response.status_code == 200:
-                # Parse search results (simplified - you might want more robust parsing)
-                results = []
-                # This is a simplified parser - you'd want more robust HTML parsing
-                text_content = response.text
-                
-                # Extract snippets that might contain phone numbers
-                snippet_pattern = r'<a class="result__snippet"[^>]*>(.*?)</a>'
-                snippets = re.findall(snippet_pattern, text_content, re.DOTALL)
-                
-                for snippet in snippets[:5]:  # Take first 5 results
-                    # Clean HTML tags
-                    clean_snippet = re.sub(r'<[^>]+>', '', snippet)
-                    phones = self.extract_phones(clean_snippet)
-                    
-                    result = SearchResult(
-                        title="DuckDuckGo Result",
-                        snippet=clean_snippet[:200],
-                        url="",
-                        phone_found=phones[0] if phones else None
-                    )
-                    results.append(result)
-                
-                return results
+                if self.archive is not None and company_data is not None:
+                    self.archive.add(company_data, strategy, query, url, response.content, response.encoding)
+                return self.parse_search_results(response.text)
         except Exception as e:
-            self.logger.error(f"DuckDuckGo search error: {e}")
+            self.events.warning('search.error', query=query, error=str(e))
         
         return []
     
-    def search_company_multiple_strategies(self, company_data: Dict) -> Tuple[Optional[str], str]:
-        """Try multiple search strategies to find phone number"""
+    def build_search_queries(self, company_data: Dict) -> List[str]:
+        """Search queries to try for a company, most specific first"""
         company_name = company_data['company_name']
         municipality = company_data.get('municipality', '')
         province = company_data.get('province', '')
         
-        search_queries = [
+        return [
             f'"{company_name}" {municipality} teléfono contacto',
             f'"{company_name}" {municipality} {province} teléfono',
             f'{company_name} {municipality} contacto phone',
             f'"{company_name}" Spain contact phone',
             f'{company_name} {municipality} {province} empresa'
         ]
+    
+    def search_company_multiple_strategies(self, company_data: Dict) -> Tuple[Optional[str], str]:
+        """Try multiple search strategies to find phone number"""
+        search_queries = self.build_search_queries(company_data)
         
         for i, query in enumerate(search_queries):
-            self.logger.info(f"Strategy {i+1}: {query}")
+            self.events.debug('search.query', company=company_data['company_name'], strategy=i + 1, query=query)
             
-            results = self.search_duckduckgo(query)
+            results = self.search_duckduckgo(query, company_data, i + 1)
             
             # Look for phone numbers in results
             for result in results:
                 if result.phone_found:
                     return result.phone_found, f"Found via search strategy {i+1}"
-            
-            time.sleep(self.search_delay)
         
         return None, "No phone found after all strategies"
     
-    def process_companies_batch(self, companies_data: List[Dict], start_idx: int = 0, batch_size: int = 50) -> List[Dict]:
-        """Process companies in batches to handle large datasets"""
-        results = []
+    def process_companies_batch(self, companies_data: List[Dict], start_idx: int = 0, batch_size: int = 50,
+                                workers: int = 1) -> List[Dict]:
+        """Process companies in batches to handle large datasets
+        
+        The phone fields are written into the companies in place (dicts or
+        CompanyStore rows), so no per-company copy is made. With several
+        workers, companies are searched concurrently across the egress pool.
+        """
         end_idx = min(start_idx + batch_size, len(companies_data))
         
-        self.logger.info(f"Processing companies {start_idx} to {end_idx}")
+        self.events.info('batch.started', start=start_idx, end=end_idx, workers=workers)
         
-        for i in range(start_idx, end_idx):
-            company_data = companies_data[i]
-            company_name = company_data['company_name']
+        indices = range(start_idx, end_idx)
+        if workers <= 1:
+            return [self.process_company(companies_data, i) for i in indices]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda i: self.process_company(companies_data, i), indices))
+    
+    def process_company(self, companies_data: List[Dict], i: int) -> Dict:
+        company_data = companies_data[i]
+        company_name = company_data['company_name']
+        started = time.perf_counter()
+        
+        try:
+            phone, search_info = self.search_company_multiple_strategies(company_data)
             
-            self.logger.info(f"Processing {i+1}/{len(companies_data)}: {company_name}")
+            # Update company data
+            with self.write_lock:
+                company_data['phone'] = phone
+                company_data['phone_search_info'] = search_info
+                company_data['search_timestamp'] = time.time()
             
-            try:
-                phone, search_info = self.search_company_multiple_strategies(company_data)
-                
-                # Update company data
-                updated_company = company_data.copy()
-                updated_company['phone'] = phone
-                updated_company['phone_search_info'] = search_info
-                updated_company['search_timestamp'] = time.time()
+            # One event per company: found or not, how, and how long it took
+            self.events.info('company.searched', index=i, company=company_name, phone=phone,
+                             search_info=search_info, seconds=round(time.perf_counter() - started, 3))
                 
-                results.append(updated_company)
-                
-                if phone:
-                    self.logger.info(f"✓ Found phone for {company_name}: {phone}")
-                else:
-                    self.logger.info(f"✗ No phone found for {company_name}")
-                    
-            except Exception as e:
-                self.logger.error(f"Error processing {company_name}: {e}")
-                updated_company = company_data.copy()
-                updated_company['phone'] = None
-                updated_company['phone_search_info'] = f"Error: {str(e)}"
-                results.append(updated_company)
+        except Exception as e:
+            self.events.warning('company.error', index=i, company=company_name, error=str(e))
+            with self.write_lock:
+                company_data['phone'] = None
+                company_data['phone_search_info'] = f"Error: {str(e)}"
         
-        return results
+        return company_data
     
     def save_progress(self, results: List[Dict], output_file: str, stats: Dict):
         """Save results and statistics"""
-        # Save results
+        # Save results (CompanyStore rows are converted to plain dicts)
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+            json.dump([dict(r) if isinstance(r, Mapping) else r for r in results], f, indent=2, ensure_ascii=False)
         
         # Save statistics
         stats_file = output_file.replace('.json', '_stats.json')
@@ -180,26 +223,54 @@ class EnhancedPhoneSearchAgent:
         self.logger.info(f"Progress saved to {output_file}")
         self.logger.info(f"Statistics saved to {stats_file}")
 
-def main():
-    input_file = 'infobelscrapping/datoscif_companies_final.json'
-    output_file = 'companies_with_phones_enhanced.json'
-    
-    # Load data
-    with open(input_file, 'r', encoding='utf-8') as f:
-        companies_data = json.load(f)
+def load_companies(input_file: str):
+    """Indexed JSON Lines datasets are opened in place, other files loaded into the column store"""
+    if has_index(input_file):
+        return IndexedJsonl(input_file)
+    return CompanyStore.from_records(iter_records(input_file))
+
+def part_output(output_file: str, start: int, stop: Optional[int], split: Optional[str]) -> str:
+    """Output path of a slice run, so parallel agents never write the same file
+
+    companies.json -> companies_split3of8.json for --split 3/8,
+    companies_1000-2000.json for --start 1000 --stop 2000.
+    """
+    if split:
+        part, parts = parse_split(split)
+        suffix = f'split{part}of{parts}'
+    elif start or stop is not None:
+        suffix = f'{start}-{"end" if stop is None else stop}'
+    else:
+        return output_file
+    base, ext = os.path.splitext(output_file)
+    return f'{base}_{suffix}{ext}'
+
+def run(input_file: str, output_file: str, egress_pool: Optional[EgressPool] = None, workers: int = 1,
+        shared_limiter=None, archive=None, start: int = 0, stop: Optional[int] = None, split: Optional[str] = None):
+    output_file = part_output(output_file, start, stop, split)
+    companies_data = load_companies(input_file)
+    if split:
+        # K/N: the K-th of N slices of about equal bytes, for parallel agents
+        if not isinstance(companies_data, IndexedJsonl):
+            raise ValueError(f"--split needs an indexed dataset: python record_index.py convert {input_file} ...")
+        part, parts = parse_split(split)
+        start, stop = companies_data.splits(parts)[part]
+    stop = len(companies_data) if stop is None else min(stop, len(companies_data))
     
-    print(f"Loaded {len(companies_data)} companies")
+    print(f"Loaded {len(companies_data)} companies, processing {start} to {stop} into {output_file}")
     
     # Initialize agent
-    agent = EnhancedPhoneSearchAgent(search_delay=2.0)  # 2 second delay between searches
+    agent = EnhancedPhoneSearchAgent(search_delay=2.0, egress_pool=egress_pool,  # 2 second delay between searches
+                                     shared_limiter=shared_limiter, archive=archive)
     
     # Process in batches
     batch_size = 20  # Process 20 companies at a time
     all_results = []
     
-    for start_idx in range(0, len(companies_data), batch_size):
+    stats = {'total_processed': 0, 'phones_found': 0, 'success_rate': 0}
+    for start_idx in range(start, stop, batch_size):
         batch_results = agent.process_companies_batch(
-            companies_data, start_idx, batch_size
+            companies_data, start_idx, min(batch_size, stop - start_idx), workers=workers
         )
         all_results.extend(batch_results)
         
@@ -222,6 +293,89 @@ def main():
     
     print(f"Final results: Found {stats['phones_found']}/{stats['total_processed']} phone numbers")
     print(f"Success rate: {stats['success_rate']:.2%}")
+    print(f"Egress exits: {agent.egress.summary()}")
+    if archive is not None:
+        print(f"Search archive: {archive.summary()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Find phone numbers for the scraped companies")
+    parser.add_argument('--input', default='infobelscrapping/datoscif_companies_final.json')
+    parser.add_argument('--output', default='companies_with_phones_enhanced.json')
+    parser.add_argument('--start', type=int, default=0,
+                        help="First company to process (instant on an indexed dataset, see record_index.py)")
+    parser.add_argument('--stop', type=int,
+                        help="Stop before this company (with --start, results go to OUTPUT with a _START-STOP suffix)")
+    parser.add_argument('--split', metavar='K/N',
+                        help="Process the K-th (from 0) of N byte-balanced slices of an indexed dataset "
+                             "(results go to OUTPUT with a _splitKofN suffix)")
+    parser.add_argument('--egress-pool', help="JSON file of exits (proxies / source addresses) to spread searches over")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Companies searched concurrently (about one per exit keeps every exit busy)")
+    parser.add_argument('--shared-rate-limit', nargs='?', const='', metavar='DIR',
+                        help="Share the search rate with other agents and crawls on this machine "
+                             "(token buckets in DIR, default: the system temp directory)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Sample the run and write per-stage CPU profiles (fetch, extraction, ...)")
+    parser.add_argument('--profile-output',
+                        help="Prefix of the .folded and .json profile files (default: next to --output)")
+    parser.add_argument('--profile-memory-interval', type=float, default=0,
+                        help="Also take tracemalloc snapshots every this many seconds")
+    parser.add_argument('--archive', metavar='DIR',
+                        help="Keep every search results page (compressed, content-addressed) in DIR")
+    parser.add_argument('--reextract', action='store_true',
+                        help="Rerun phone extraction over the pages in --archive for the companies in --input, "
+                             "without searching, and write --output")
+    parser.add_argument('--processes', type=int, help="Re-extraction worker processes (default: one per CPU)")
+    parser.add_argument('--log-level', default='INFO', help="Console log level (DEBUG also shows every search query)")
+    parser.add_argument('--event-log', metavar='PATH',
+                        help="Write the search events (one per company, query and error) to PATH as JSON Lines")
+    parser.add_argument('--event-sample', action='append', default=[], metavar='EVENT=RATE',
+                        help="Keep only this share of an event in the logs, e.g. search.query=0.1; repeatable")
+    args = parser.parse_args()
+    if args.reextract and not args.archive:
+        parser.error("--reextract needs --archive")
+
+    logging.basicConfig(level=args.log_level.upper())
+
+    if args.reextract:
+        counts = reextract(args.archive, args.input, args.output, args.processes)
+        print(f"Re-extracted {counts['with_archive']}/{counts['companies']} companies in {counts['seconds']}s: "
+              f"{counts['found']} with a phone ({counts['new']} new, {counts['changed']} changed), "
+              f"{counts['kept']} kept their previous result")
+        print(f"Results saved to {args.output}")
+        return
+    event_log = None
+    if args.event_log:
+        sample_rates = {name: float(rate) for name, rate in (item.split('=', 1) for item in args.event_sample)}
+        event_log = setup_event_log(args.event_log, loggers=(__name__,), level=logging.DEBUG,
+                                    sample_rates=sample_rates)
+
+    egress_pool = EgressPool.from_file(args.egress_pool) if args.egress_pool else None
+    shared_limiter = None
+    if args.shared_rate_limit is not None:
+        from infobelscrapping.infobelscrapping.shared_limiter import DEFAULT_DIRECTORY, SharedRateLimiter
+        shared_limiter = SharedRateLimiter(args.shared_rate_limit or DEFAULT_DIRECTORY)
+    
+    profiler = contextlib.nullcontext()
+    if args.profile:
+        # Imported here: the Scrapy pipeline loads this module, and inside the
+        # Scrapy project the package path differs
+        from infobelscrapping.infobelscrapping.profiling import StageProfiler
+        profile_output = args.profile_output or \
+            f'{os.path.splitext(part_output(args.output, args.start, args.stop, args.split))[0]}_profile'
+        profiler = StageProfiler(profile_output, memory_interval=args.profile_memory_interval)
+
+    try:
+        with profiler:
+            run(args.input, args.output, egress_pool, args.workers, shared_limiter,
+                SearchArchive(args.archive) if args.archive else None,
+                start=args.start, stop=args.stop, split=args.split)
+    finally:
+        if event_log is not None:
+            event_log.stop()
+        if args.profile:
+            print(profiler.format_summary())
+            print(f"Profile written to {profiler.output_prefix}.folded and {profiler.output_prefix}.json")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Streaming exporter for company records
+
+Reads records one at a time (JSON array, JSON Lines or stdin), filters them
+and writes CSV, JSON Lines and XLSX outputs in a single pass, so memory use
+does not grow with the size of the dataset. CSV and JSON Lines outputs can
+be appended to, which lets daily deltas be added without rewriting the full
+export.
+
+Examples:
+    python export_companies.py companies_with_phones_enhanced.json -o companies_with_phones.csv --has-phone
+    python export_companies.py delta.jl -o all_companies.csv -o all_companies.jl --append
+    python export_companies.py companies_with_phones_enhanced.json -o madrid_hosteleria.xlsx \\
+        --province Madrid --cnae 56 --from 2025-05-01 --to 2025-05-31
+"""
+
+import argparse
+import csv
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+from infobelscrapping.infobelscrapping.normalization import TYPED_FIELDS, normalize_company
+from record_io import iter_records
+
+# Default CSV/XLSX columns, in output order (the companies_with_phones.csv layout)
+CSV_COLUMNS = [
+    'company_name',
+    'phone',
+    'address',
+    'postal_code',
+    'municipality',
+    'province',
+    'business_purpose',
+    'social_capital',
+    'start_date',
+    'coordinates',
+    'url'
+]
+
+
+def has_phone(company: Dict) -> bool:
+    """True when the phone agent found a usable phone number"""
+    phone = company.get('phone')
+    return bool(phone and phone.strip() and phone != 'Not found')
+
+
+class RecordFilter:
+    """Filter records by phone, province, CNAE code prefix and start date range"""
+
+    def __init__(self, has_phone: bool = False, provinces: Optional[List[str]] = None,
+                 cnae: Optional[List[str]] = None, date_from: Optional[str] = None,
+                 date_to: Optional[str] = None):
+        self.has_phone = has_phone
+        self.provinces = {p.strip().lower() for p in provinces} if provinces else None
+        self.cnae = tuple(cnae) if cnae else None
+        # ISO dates compare correctly as strings
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def __call__(self, record: Dict) -> bool:
+        if self.has_phone and not has_phone(record):
+            return False
+        if self.provinces is not None and (record.get('province') or '').strip().lower() not in self.provinces:
+            return False
+        if self.cnae is None and self.date_from is None and self.date_to is None:
+            return True
+
+        # Exports of the Scrapy crawl already carry the typed columns
+        typed = record if 'start_date_iso' in record else normalize_company(record)
+        if self.cnae is not None:
+            codes = [typed['cnae_primary']] + typed['cnae_secondary'] if typed['cnae_primary'] else []
+            if not any(code.startswith(self.cnae) for code in codes):
+                return False
+        start_date = typed['start_date_iso']
+        if self.date_from is not None and (start_date is None or start_date < self.date_from):
+            return False
+        if self.date_to is not None and (start_date is None or start_date > self.date_to):
+            return False
+        return True
+
+
+class Exporter:
+    """Base class: writes records that pass the optional filter"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None, append: bool = False,
+                 record_filter: Optional[RecordFilter] = None):
+        self.path = path
+        self.columns = columns or CSV_COLUMNS
+        self.append = append
+        self.record_filter = record_filter
+        self.written = 0
+
+    @classmethod
+    def check(cls, path: str, append: bool = False):
+        """Raise if path cannot be exported to, before any output file is opened"""
+
+    def write(self, record: Dict) -> bool:
+        if self.record_filter is not None and not self.record_filter(record):
+            return False
+        self.write_record(record)
+        self.written += 1
+        return True
+
+    def write_record(self, record: Dict):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class CsvExporter(Exporter):
+    """Writes the selected columns; appending keeps the existing file's header"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None, append: bool = False,
+                 record_filter: Optional[RecordFilter] = None):
+        super().__init__(path, columns, append, record_filter)
+        existing = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if existing:
+            # Keep the column layout of the file being appended to
+            with open(path, 'r', newline='', encoding='utf-8') as f:
+                self.columns = next(csv.reader(f))
+        self.file = open(path, 'a' if existing else 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns)
+        if not existing:
+            self.writer.writeheader()
+
+    def write_record(self, record: Dict):
+        row = {}
+        for col in self.columns:
+            value = record.get(col, '')
+            row[col] = ';'.join(value) if isinstance(value, list) else value
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlExporter(Exporter):
+    """Writes whole records; columns only apply to the tabular formats"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None, append: bool = False,
+                 record_filter: Optional[RecordFilter] = None):
+        super().__init__(path, columns, append, record_filter)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write_record(self, record: Dict):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class XlsxExporter(Exporter):
+    """Writes rows through openpyxl's write-only mode (rows are not kept in memory)"""
+
+    def __init__(self, path: str, columns: Optional[List[str]] = None, append: bool = False,
+                 record_filter: Optional[RecordFilter] = None):
+        super().__init__(path, columns, append, record_filter)
+        self.check(path, append)
+        from openpyxl import Workbook
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet('companies')
+        self.sheet.append(self.columns)
+
+    @classmethod
+    def check(cls, path: str, append: bool = False):
+        if append:
+            raise ValueError(
+                f"Cannot append to {path}: XLSX files have to be rewritten; export the delta to its own file"
+            )
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise ImportError("XLSX export needs openpyxl: pip install -r requirements.txt")
+
+    def write_record(self, record: Dict):
+        row = []
+        for col in self.columns:
+            value = record.get(col)
+            row.append(';'.join(value) if isinstance(value, list) else value)
+        self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+EXPORTERS = {
+    '.csv': CsvExporter,
+    '.jsonl': JsonlExporter,
+    '.jl': JsonlExporter,
+    '.xlsx': XlsxExporter,
+}
+
+
+def exporter_class(path: str, append: bool = False):
+    """The exporter for the file extension of path, checked but not opened"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORTERS:
+        raise ValueError(f"Unsupported export format '{extension}', expected one of {sorted(EXPORTERS)}")
+    exporter = EXPORTERS[extension]
+    exporter.check(path, append)
+    return exporter
+
+
+def open_exporter(path: str, columns: Optional[List[str]] = None, append: bool = False,
+                  record_filter: Optional[RecordFilter] = None) -> Exporter:
+    """Open the exporter matching the file extension of path"""
+    return exporter_class(path, append)(path, columns=columns, append=append, record_filter=record_filter)
+
+
+def open_exporters(paths: List[str], columns: Optional[List[str]] = None, append: bool = False,
+                   record_filter: Optional[RecordFilter] = None) -> List[Exporter]:
+    """Open several exporters, all checked first so a bad one leaves the others' files untouched"""
+    classes = [exporter_class(path, append) for path in paths]
+    return [exporter(path, columns=columns, append=append, record_filter=record_filter)
+            for exporter, path in zip(classes, paths)]
+
+
+def with_typed_fields(records: Iterable[Dict]) -> Iterable[Dict]:
+    """Add the typed columns to records exported before TypedFieldsPipeline existed"""
+    for record in records:
+        if 'start_date_iso' not in record:
+            record.update(normalize_company(record))
+        yield record
+
+
+def export_records(records: Iterable[Dict], exporters: List[Exporter],
+                   record_filter: Optional[RecordFilter] = None) -> Dict:
+    """Write records to every exporter in one pass and return counts"""
+    seen = 0
+    matched = 0
+    try:
+        for record in records:
+            seen += 1
+            if record_filter is not None and not record_filter(record):
+                continue
+            matched += 1
+            for exporter in exporters:
+                exporter.write(record)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    return {'seen': seen, 'matched': matched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream company records into CSV, JSONL and XLSX exports")
+    parser.add_argument('input', help="JSON array or JSON Lines file ('-' for JSON Lines on stdin)")
+    parser.add_argument('-o', '--output', action='append', required=True,
+                        help="Output file (.csv, .jsonl/.jl or .xlsx); repeatable")
+    parser.add_argument('--append', action='store_true', help="Append to existing CSV/JSONL outputs")
+    parser.add_argument('--columns', help="Comma-separated columns for CSV/XLSX (default: the phone CSV layout)")
+    parser.add_argument('--typed', action='store_true', help="Add the typed columns to CSV/XLSX")
+    parser.add_argument('--has-phone', action='store_true', help="Only companies with a phone number")
+    parser.add_argument('--province', action='append', help="Only these provinces; repeatable")
+    parser.add_argument('--cnae', action='append', help="Only companies with a CNAE code starting with this; repeatable")
+    parser.add_argument('--from', dest='date_from', help="Only companies started on or after this ISO date")
+    parser.add_argument('--to', dest='date_to', help="Only companies started on or before this ISO date")
+    args = parser.parse_args()
+
+    columns = args.columns.split(',') if args.columns else list(CSV_COLUMNS)
+    if args.typed:
+        columns += list(TYPED_FIELDS)
+
+    record_filter = RecordFilter(
+        has_phone=args.has_phone,
+        provinces=args.province,
+        cnae=args.cnae,
+        date_from=args.date_from,
+        date_to=args.date_to,
+    )
+    exporters = open_exporters(args.output, columns=columns, append=args.append)
+
+    records = iter_records(args.input)
+    if args.typed:
+        records = with_typed_fields(records)
+    counts = export_records(records, exporters, record_filter)
+
+    print(f"✓ Read {counts['seen']} companies, exported {counts['matched']}")
+    for exporter in exporters:
+        print(f"✓ {exporter.path}: {exporter.written} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Structured, sampled event logging for the hot loops
+#
+# The spiders and the phone agents emit one event per page or company
+# (EventLog.info('page.parsed', url=..., items=...)) instead of several
+# formatted lines. An event costs one isEnabledFor() check when its level is
+# off and one random() call when it is sampled out; nothing is formatted in
+# the calling thread. Enabled events go through a QueueHandler to a listener
+# thread that writes them as JSON Lines, so slow disks never stall a crawl.
+# Console handlers still see a readable "event key=value ..." message, built
+# only if they actually format the record.
+#
+# Kept free of Scrapy imports so the agents and the EventLogWriter extension
+# share it.
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+
+# Share of events kept per event name (1 when absent), set by setup_event_log
+SAMPLE_RATES = {}
+
+
+class EventFields:
+    """The event's fields, rendered as key=value only when a handler formats the message"""
+
+    __slots__ = ('fields',)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in self.fields.items())
+
+
+class EventLog:
+    """Emit named events with fields through a standard logger"""
+
+    def __init__(self, logger):
+        # Spiders pass Scrapy's LoggerAdapter; events go to the logger behind it
+        self.logger = getattr(logger, 'logger', logger)
+
+    def event(self, level, name, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = SAMPLE_RATES.get(name)
+        if rate is not None:
+            if random.random() >= rate:
+                return
+            fields['sample_rate'] = rate
+        self.logger.log(level, '%s %s', name, EventFields(fields),
+                        extra={'event': name, 'fields': fields})
+
+    # The level check is repeated here so a disabled event costs one call
+    def debug(self, name, **fields):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.event(logging.DEBUG, name, **fields)
+
+    def info(self, name, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.event(logging.INFO, name, **fields)
+
+    def warning(self, name, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.event(logging.WARNING, name, **fields)
+
+
+class EventFilter(logging.Filter):
+    """Only let EventLog records through"""
+
+    def filter(self, record):
+        return hasattr(record, 'event')
+
+
+class JsonlEventFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.event,
+            **record.fields,
+        }, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock prepare() formats the message in the emitting thread so the
+    record can be pickled; records here stay in-process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_event_log(path, loggers=('',), level=logging.INFO, sample_rates=None):
+    """Write the events of ``loggers`` to ``path`` as JSON Lines; returns the started QueueListener
+
+    Call ``stop()`` on the listener (it also removes the handlers) to flush
+    the queue before exit.
+    """
+    SAMPLE_RATES.clear()
+    SAMPLE_RATES.update(sample_rates or {})
+
+    file_handler = logging.FileHandler(path, encoding='utf-8')
+    file_handler.setFormatter(JsonlEventFormatter())
+    records = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.setLevel(level)
+    queue_handler.addFilter(EventFilter())
+
+    targets = [logging.getLogger(name) for name in loggers]
+    for logger in targets:
+        logger.addHandler(queue_handler)
+        if logger.getEffectiveLevel() > level:
+            logger.setLevel(level)
+
+    listener = EventLogListener(records, file_handler, targets, queue_handler)
+    listener.start()
+    return listener
+
+
+class EventLogListener(logging.handlers.QueueListener):
+    def __init__(self, records, file_handler, loggers, queue_handler):
+        super().__init__(records, file_handler)
+        self.loggers = loggers
+        self.queue_handler = queue_handler
+
+    def stop(self):
+        for logger in self.loggers:
+            logger.removeHandler(self.queue_handler)
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
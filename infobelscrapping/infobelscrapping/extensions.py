@@ -0,0 +1,289 @@
+# Scrapy extensions of the project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import json
+import logging
+import os
+import pickle
+import resource
+import sys
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from infobelscrapping.event_log import SAMPLE_RATES, setup_event_log
+from infobelscrapping.profiling import StageProfiler
+
+
+class CrawlBenchmark:
+    """Report pages/sec, items/sec, pipeline time and peak memory of a crawl
+
+    Enabled with ``BENCHMARK_ENABLED``, usually together with
+    ``RESPONSE_ARCHIVE_MODE = 'replay'`` so the numbers measure the spider
+    and pipelines rather than the network. The report is logged when the
+    spider closes and written as JSON to ``BENCHMARK_FILE`` if set.
+    """
+
+    def __init__(self, crawler, output_file=None):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.output_file = output_file
+        self.start_time = None
+        self.start_cpu = None
+        self.pages = 0
+        self.items = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BENCHMARK_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler, crawler.settings.get('BENCHMARK_FILE'))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.start_time = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def response_received(self, response, request, spider):
+        self.pages += 1
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+
+    def peak_rss_mb(self):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+    def report(self, spider):
+        elapsed = time.perf_counter() - self.start_time
+        cpu_seconds = time.process_time() - self.start_cpu
+        pipeline_seconds = self.stats.get_value('benchmark/pipeline_seconds', 0.0)
+        pipeline_items = self.stats.get_value('benchmark/pipeline_items', 0)
+        return {
+            'spider': spider.name,
+            'elapsed_seconds': round(elapsed, 3),
+            'cpu_seconds': round(cpu_seconds, 3),
+            'pages': self.pages,
+            # Parsing, pipelines and Scrapy's own work per page, without the waits
+            'cpu_ms_per_page': round(cpu_seconds / self.pages * 1000, 3) if self.pages else 0,
+            'items': self.items,
+            'pages_per_sec': round(self.pages / elapsed, 2) if elapsed else 0,
+            'items_per_sec': round(self.items / elapsed, 2) if elapsed else 0,
+            'pipeline_seconds': round(pipeline_seconds, 4),
+            'pipeline_ms_per_item': round(pipeline_seconds / pipeline_items * 1000, 4) if pipeline_items else 0,
+            'peak_rss_mb': round(self.peak_rss_mb(), 1),
+            'archive_misses': self.stats.get_value('archive/miss', 0),
+        }
+
+    def spider_closed(self, spider, reason):
+        report = self.report(spider)
+        spider.logger.info(f"Benchmark: {report}")
+        if self.output_file:
+            tmp_file = f'{self.output_file}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_file, self.output_file)
+
+
+class CrawlProfiler:
+    """Sample the reactor thread and write per-stage CPU profiles of a crawl
+
+    Enabled with ``PROFILE_ENABLED``. Samples are attributed to fetch, parse,
+    pipelines and extraction from the frames on the stack. When the spider
+    closes, ``<prefix>.folded`` (flamegraph input) and ``<prefix>.json``
+    (top-N summary) are written next to ``STATS_FILE`` unless
+    ``PROFILE_OUTPUT`` sets the prefix. ``PROFILE_MEMORY_INTERVAL`` adds
+    tracemalloc snapshots every that many seconds.
+    """
+
+    def __init__(self, output_prefix, interval, memory_interval, top_n):
+        self.output_prefix = output_prefix
+        self.interval = interval
+        self.memory_interval = memory_interval
+        self.top_n = top_n
+        self.profiler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        output_prefix = settings.get('PROFILE_OUTPUT')
+        if not output_prefix:
+            stats_file = settings.get('STATS_FILE', 'scraping_stats.json')
+            output_prefix = f'{os.path.splitext(stats_file)[0]}_profile'
+        ext = cls(
+            output_prefix,
+            settings.getfloat('PROFILE_INTERVAL', 0.005),
+            settings.getfloat('PROFILE_MEMORY_INTERVAL', 0),
+            settings.getint('PROFILE_TOP_N', 25),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        # Signals fire on the reactor thread, which runs the spider and pipelines
+        self.profiler = StageProfiler(self.output_prefix, interval=self.interval,
+                                      memory_interval=self.memory_interval, top_n=self.top_n)
+        self.profiler.start()
+
+    def spider_closed(self, spider, reason):
+        self.profiler.stop()
+        summary = self.profiler.write()
+        spider.logger.info(self.profiler.format_summary(summary))
+        spider.logger.info(f"Profile written to {self.output_prefix}.folded and {self.output_prefix}.json")
+
+
+def checkpoint_components(crawler, spider):
+    """Spider and item pipelines that save state, keyed by a stable name"""
+    components = {'spider': spider}
+    for pipeline in crawler.engine.scraper.itemproc.middlewares:
+        components[f'{type(pipeline).__module__}.{type(pipeline).__qualname__}'] = pipeline
+    return {
+        name: component for name, component in components.items()
+        if hasattr(component, 'checkpoint_state') and hasattr(component, 'restore_checkpoint')
+    }
+
+
+class CrawlCheckpoint:
+    """Save spider and pipeline state in JOBDIR so paused crawls resume consistently
+
+    Scrapy's JOBDIR keeps the request queue, the request fingerprints and
+    ``spider.state`` across a pause (Ctrl-C once) and resume, but not the
+    in-memory state of the item pipelines: a resumed crawl would start with
+    an empty duplicate set and zeroed counters. Components that define
+    ``checkpoint_state()`` and ``restore_checkpoint(state)`` (the spider and
+    any item pipeline) are saved to ``JOBDIR/checkpoint.pickle`` when the
+    spider closes, right after Scrapy has persisted its queue, and restored
+    when it opens again.
+
+    The checkpoint also records the queue's ``active.json``. If the crawl was
+    killed rather than paused, the queue on disk no longer matches the
+    checkpoint and a warning is logged.
+    """
+
+    def __init__(self, crawler, jobdir):
+        self.crawler = crawler
+        self.path = os.path.join(jobdir, 'checkpoint.pickle')
+        self.queue_state_file = os.path.join(jobdir, 'requests.queue', 'active.json')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        jobdir = crawler.settings.get('JOBDIR')
+        if not jobdir or not crawler.settings.getbool('CHECKPOINT_ENABLED', True):
+            raise NotConfigured
+        ext = cls(crawler, jobdir)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def queue_state(self):
+        if not os.path.exists(self.queue_state_file):
+            return None
+        with open(self.queue_state_file, 'rb') as f:
+            return f.read()
+
+    def spider_opened(self, spider):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['queue_state'] != self.queue_state():
+            spider.logger.warning(
+                "Request queue in JOBDIR does not match the checkpoint (crawl killed instead of paused?); "
+                "restoring pipeline state anyway"
+            )
+            self.crawler.stats.set_value('checkpoint/queue_mismatch', True)
+
+        components = checkpoint_components(self.crawler, spider)
+        for name, state in checkpoint['components'].items():
+            if name in components:
+                components[name].restore_checkpoint(state)
+            else:
+                spider.logger.warning(f"Checkpoint has state for {name}, which is not enabled in this run")
+        self.crawler.stats.set_value('checkpoint/restored', len(checkpoint['components']))
+        spider.logger.info(f"Resumed from checkpoint saved at {time.ctime(checkpoint['saved_at'])}")
+
+    def spider_closed(self, spider, reason):
+        components = checkpoint_components(self.crawler, spider)
+        checkpoint = {
+            'saved_at': time.time(),
+            'reason': reason,
+            'queue_state': self.queue_state(),
+            'components': {name: component.checkpoint_state() for name, component in components.items()},
+        }
+        tmp_file = f'{self.path}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.path)
+        spider.logger.info(f"Checkpoint of {', '.join(components)} saved to {self.path}")
+
+
+def log_level_number(level):
+    """Numeric level of a LOG_LEVEL-style setting ("INFO" or 20)"""
+    if isinstance(level, str) and not level.isdigit():
+        return logging.getLevelName(level.upper())
+    return int(level)
+
+
+class EventLogWriter:
+    """Gate the crawl's events by level and write them to ``EVENT_LOG_FILE`` as JSON Lines
+
+    The spiders, middlewares and phone enrichment emit one event per page,
+    block and company through ``infobelscrapping.event_log.EventLog``.
+    Scrapy leaves the root logger at NOTSET, so without explicit levels every
+    disabled event would still build a log record; this sets the level of
+    the loggers that emit events to the lower of ``LOG_LEVEL`` and
+    ``EVENT_LOG_LEVEL``. With ``EVENT_LOG_FILE`` set, events at or above
+    ``EVENT_LOG_LEVEL`` are queued to a writer thread, and
+    ``EVENT_LOG_SAMPLE_RATES`` (event name -> share kept) thins out the
+    chatty ones in both the console and the file.
+    """
+
+    def __init__(self, path, level, log_level, sample_rates):
+        self.path = path
+        self.level = level
+        self.log_level = log_level
+        self.sample_rates = sample_rates
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('EVENT_LOG_ENABLED', True):
+            raise NotConfigured
+        ext = cls(
+            settings.get('EVENT_LOG_FILE'),
+            log_level_number(settings.get('EVENT_LOG_LEVEL', 'INFO')),
+            log_level_number(settings.get('LOG_LEVEL', 'DEBUG')),
+            settings.getdict('EVENT_LOG_SAMPLE_RATES'),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        # The spider's own logger, this project's modules and the phone agent
+        loggers = (spider.name, 'infobelscrapping', 'enhanced_phone_agent')
+        level = min(self.level, self.log_level) if self.path else self.log_level
+        for name in loggers:
+            logging.getLogger(name).setLevel(level)
+        if self.path:
+            self.listener = setup_event_log(self.path, loggers, self.level, self.sample_rates)
+            spider.logger.info(f"Writing events to {self.path}")
+        else:
+            SAMPLE_RATES.clear()
+            SAMPLE_RATES.update(self.sample_rates)
+
+    def spider_closed(self, spider, reason):
+        if self.listener is not None:
+            self.listener.stop()
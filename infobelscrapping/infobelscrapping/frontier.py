@@ -0,0 +1,115 @@
+# Category frontier for the infobel spider
+#
+# infobel lists businesses under a category tree (/business/<id>/<slug>).
+# CategoryFrontier decides which category the next request goes to, so one
+# crawl with one polite request rate covers many categories instead of one
+# run per category.
+#
+# It is a stride scheduler layered on Scrapy's priority queue: every request
+# a category sends advances that category's "pass" by a stride inversely
+# proportional to its weight, and the request's Scrapy priority is minus the
+# pass counted in whole rounds (one request of every weight-1 category).
+# Scrapy pops the highest priority first, so categories interleave in
+# proportion to their weights (or evenly in round-robin mode), while the
+# requests of a round share one priority: Scrapy keeps a queue (a directory
+# with JOBDIR) per distinct priority, which must not mean one per request. Each category
+# can also have a request budget; once spent, its requests are refused.
+
+import re
+
+# Integer strides keep Scrapy's priority queues keyed by ints
+STRIDE_BASE = 1000
+# Pass per priority level: one round of every weight-1 category
+PRIORITY_QUANTUM = STRIDE_BASE
+
+CATEGORY_URL_RE = re.compile(r'/business/(\d+)/([\w-]+)')
+
+
+def category_from_url(url):
+    """(id, slug) of an infobel category URL, or None"""
+    match = CATEGORY_URL_RE.search(url or '')
+    return (match.group(1), match.group(2)) if match else None
+
+
+class CategoryFrontier:
+    """Weighted or round-robin request scheduling across categories, with budgets"""
+
+    MODES = ('weighted', 'round_robin')
+
+    def __init__(self, categories=None, mode='weighted', default_weight=1, default_budget=None,
+                 total_budget=None, stats=None):
+        """``categories`` maps a slug to ``{'weight': w, 'budget': n}`` (both optional)
+
+        When ``categories`` is empty every discovered category is crawled
+        with the defaults; otherwise only the listed ones are.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown frontier mode {mode!r}, expected one of {self.MODES}")
+        self.config = dict(categories or {})
+        self.mode = mode
+        self.default_weight = default_weight
+        self.default_budget = default_budget
+        self.total_budget = total_budget
+        self.stats = stats
+        # Per category: weight, budget, pass, requests sent
+        self.categories = {}
+        self.sent = 0
+
+    def accepts(self, slug):
+        """Whether a discovered category is part of this crawl"""
+        return not self.config or slug in self.config
+
+    def add(self, slug):
+        """Register a category; late arrivals start at the current minimum pass"""
+        if slug in self.categories:
+            return self.categories[slug]
+        options = self.config.get(slug) or {}
+        weight = 1 if self.mode == 'round_robin' else options.get('weight', self.default_weight)
+        if weight <= 0:
+            raise ValueError(f"Category {slug!r} needs a positive weight, got {weight}")
+        state = {
+            'weight': weight,
+            'budget': options.get('budget', self.default_budget),
+            # Otherwise a new category would be served exclusively until it
+            # caught up with the ones that started earlier
+            'pass': min((c['pass'] for c in self.categories.values()), default=0),
+            'sent': 0,
+        }
+        self.categories[slug] = state
+        return state
+
+    def next_priority(self, slug, boost=0):
+        """Charge one request to ``slug`` and return its Scrapy priority
+
+        Returns None when the category or the crawl has spent its budget.
+        ``boost`` moves the request that many turns ahead within the category
+        (detail pages ahead of the next listing page).
+        """
+        state = self.add(slug)
+        if self.total_budget is not None and self.sent >= self.total_budget:
+            self.inc_stat('frontier/refused/total_budget')
+            return None
+        if state['budget'] is not None and state['sent'] >= state['budget']:
+            self.inc_stat(f'frontier/refused/{slug}')
+            return None
+        stride = max(int(STRIDE_BASE / state['weight']), 1)
+        state['pass'] += stride
+        state['sent'] += 1
+        self.sent += 1
+        self.inc_stat(f'frontier/requests/{slug}')
+        return -int((state['pass'] - boost * stride) // PRIORITY_QUANTUM)
+
+    def summary(self):
+        return {slug: {'weight': state['weight'], 'budget': state['budget'], 'sent': state['sent']}
+                for slug, state in self.categories.items()}
+
+    def state(self):
+        return {'sent': self.sent, 'categories': {slug: dict(state) for slug, state in self.categories.items()}}
+
+    def restore(self, state):
+        self.sent = state['sent']
+        self.categories = {slug: dict(category) for slug, category in state['categories'].items()}
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
@@ -17,3 +17,44 @@ class DatoscifscrappingItem(scrapy.Item):
     province = scrapy.Field()
     business_purpose = scrapy.Field()
     url = scrapy.Field()
+
+    # Filled by PhoneEnrichmentPipeline while the crawl runs
+    phone = scrapy.Field()
+    phone_search_info = scrapy.Field()
+    search_timestamp = scrapy.Field()
+
+    # Typed columns derived by TypedFieldsPipeline
+    social_capital_eur = scrapy.Field()
+    start_date_iso = scrapy.Field()
+    latitude = scrapy.Field()
+    longitude = scrapy.Field()
+    cnae_primary = scrapy.Field()
+    cnae_secondary = scrapy.Field()
+
+
+class CompanyRecord(dict):
+    """A datoscif company as a plain dict, the lightweight twin of DatoscifscrappingItem
+
+    Same fields (the raw ones are set on creation, the rest by the
+    pipelines) without scrapy.Item's per-field checks and wrapper, so
+    CompanyItemPipeline can work on it directly.
+    """
+
+    __slots__ = ()
+
+    raw_fields = ('company_name', 'start_date', 'social_capital', 'coordinates', 'address',
+                  'postal_code', 'municipality', 'province', 'business_purpose')
+
+    @classmethod
+    def from_company_data(cls, company_data, source_url):
+        record = cls({field: company_data.get(field, '') for field in cls.raw_fields})
+        record['url'] = company_data.get('url', source_url)
+        return record
+
+
+class InfobelItem(scrapy.Item):
+    name = scrapy.Field()
+    category = scrapy.Field()
+    address = scrapy.Field()
+    phone = scrapy.Field()
+    link = scrapy.Field()
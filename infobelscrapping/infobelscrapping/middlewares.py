@@ -3,7 +3,19 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import asyncio
+import json
+import logging
+import os
+import zipfile
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+
+from infobelscrapping.event_log import EventLog
+from infobelscrapping.shared_limiter import DEFAULT_DIRECTORY, SharedRateLimiter
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -57,47 +69,289 @@ class InfobelscrappingSpiderMiddleware:
 
 
 class InfobelscrappingDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Detect blocking before parsing and adapt per-domain delay and concurrency
+    
+    A response counts as blocked when it is a 403/429, when the request was
+    redirected to an ``Abuse`` page, or when the body contains a captcha
+    marker. Blocked requests are retried (up to ``BLOCK_THROTTLE_MAX_RETRIES``)
+    after the slot delay has been multiplied by ``BLOCK_THROTTLE_BACKOFF`` and
+    its concurrency halved. After ``BLOCK_THROTTLE_RECOVERY_AFTER`` clean
+    responses in a row the slot speeds up again, so a crawl can start
+    aggressive and settle at the fastest rate the site accepts.
+    """
+
+    block_statuses = (403, 429)
+    # Redirect bookkeeping added by RedirectMiddleware, dropped when retrying the original URL
+    redirect_meta_keys = ('redirect_urls', 'redirect_times', 'redirect_ttl', 'redirect_reasons')
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.enabled = settings.getbool('BLOCK_THROTTLE_ENABLED', False)
+        self.start_delay = settings.getfloat('BLOCK_THROTTLE_START_DELAY', settings.getfloat('DOWNLOAD_DELAY'))
+        self.min_delay = settings.getfloat('BLOCK_THROTTLE_MIN_DELAY', 0.5)
+        self.max_delay = settings.getfloat('BLOCK_THROTTLE_MAX_DELAY', 120)
+        self.backoff = settings.getfloat('BLOCK_THROTTLE_BACKOFF', 2.0)
+        self.recovery = settings.getfloat('BLOCK_THROTTLE_RECOVERY', 0.9)
+        self.recovery_after = settings.getint('BLOCK_THROTTLE_RECOVERY_AFTER', 10)
+        self.max_concurrency = settings.getint(
+            'BLOCK_THROTTLE_MAX_CONCURRENCY', settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        )
+        self.max_retries = settings.getint('BLOCK_THROTTLE_MAX_RETRIES', 3)
+        self.captcha_markers = [
+            marker.lower().encode() for marker in settings.getlist(
+                'BLOCK_THROTTLE_CAPTCHA_MARKERS', ['captcha', 'cf-challenge', 'are you a robot']
+            )
+        ]
+        # Consecutive clean responses per download slot
+        self.clean_streaks = {}
+        self.events = EventLog(logging.getLogger(__name__))
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        if not self.enabled:
+            return response
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
-        return response
+        slot_key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(slot_key)
+        if slot is not None and slot_key not in self.clean_streaks:
+            # First response from this slot: start from the configured (aggressive) delay
+            self.clean_streaks[slot_key] = 0
+            slot.delay = self.start_delay
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        block_signal = self.block_signal(request, response)
+        if block_signal is None:
+            if slot is not None:
+                self.recover(slot_key, slot)
+            return response
+
+        self.stats.inc_value(f'throttle/blocked/{block_signal}')
+        self.events.warning('request.blocked', url=request.url, signal=block_signal, slot=slot_key,
+                            status=response.status)
+        if slot is not None:
+            self.back_off(slot_key, slot, response)
+
+        return self.retry(request, spider, block_signal)
+
+    def block_signal(self, request, response):
+        """Return a short name for the block signal on this response, or None"""
+        if response.status in self.block_statuses:
+            return str(response.status)
+        redirect_urls = request.meta.get('redirect_urls', [])
+        if 'Abuse' in response.url or any('Abuse' in url for url in redirect_urls):
+            return 'abuse_redirect'
+        content_type = response.headers.get(b'Content-Type', b'').lower()
+        if b'html' in content_type:
+            body = response.body.lower()
+            for marker in self.captcha_markers:
+                if marker in body:
+                    return 'captcha'
+        return None
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
+    def back_off(self, slot_key, slot, response):
+        delay = max(slot.delay * self.backoff, self.start_delay, self.min_delay)
+        retry_after = response.headers.get(b'Retry-After')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        slot.delay = min(delay, self.max_delay)
+        slot.concurrency = max(1, slot.concurrency // 2)
+        self.clean_streaks[slot_key] = 0
+        self.record_slot(slot_key, slot)
+
+    def recover(self, slot_key, slot):
+        self.clean_streaks[slot_key] += 1
+        if self.clean_streaks[slot_key] < self.recovery_after:
+            return
+        self.clean_streaks[slot_key] = 0
+        slot.delay = max(self.min_delay, slot.delay * self.recovery)
+        slot.concurrency = min(self.max_concurrency, slot.concurrency + 1)
+        self.record_slot(slot_key, slot)
+
+    def record_slot(self, slot_key, slot):
+        self.stats.set_value(f'throttle/delay/{slot_key}', round(slot.delay, 2))
+        self.stats.set_value(f'throttle/concurrency/{slot_key}', slot.concurrency)
+
+    def retry(self, request, spider, block_signal):
+        retries = request.meta.get('block_retry_times', 0) + 1
+        if retries > self.max_retries:
+            self.stats.inc_value('throttle/gave_up')
+            raise IgnoreRequest(f"Blocked ({block_signal}) after {self.max_retries} retries: {request.url}")
+
+        # Retry the URL that was originally asked for, not the Abuse page we were sent to
+        redirect_urls = request.meta.get('redirect_urls')
+        url = redirect_urls[0] if redirect_urls else request.url
+        meta = {k: v for k, v in request.meta.items() if k not in self.redirect_meta_keys}
+        meta['block_retry_times'] = retries
+
+        self.stats.inc_value('throttle/retries')
+        # The slot delay has just been raised, so the retry waits out the backoff
+        return request.replace(url=url, meta=meta, dont_filter=True)
+
+    def process_exception(self, request, exception, spider):
         pass
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ResponseArchiveMiddleware:
+    """Record raw responses to a zip archive, or replay a crawl from one
+
+    ``RESPONSE_ARCHIVE_MODE = 'record'`` stores every downloaded response under
+    its request fingerprint in ``RESPONSE_ARCHIVE_FILE`` (deflated, one
+    ``.json`` member with status/headers and one ``.body`` member per response).
+    ``'replay'`` answers requests from the archive without touching the network
+    or the download slots, so a spider and its pipelines run at full speed on
+    the same pages every time. Requests missing from the archive are ignored
+    and counted in ``archive/miss``.
+
+    It sits next to the downloader (950), so it records responses before
+    decompression and redirects, and the replayed ones go through the same
+    middlewares as live ones.
+    """
+
+    def __init__(self, crawler, mode, path):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.mode = mode
+        self.path = path
+        self.archive = None
+        self.archived = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mode = crawler.settings.get('RESPONSE_ARCHIVE_MODE')
+        if not mode:
+            raise NotConfigured
+        if mode not in ('record', 'replay'):
+            raise NotConfigured(f"RESPONSE_ARCHIVE_MODE must be 'record' or 'replay', not {mode!r}")
+        path = crawler.settings.get('RESPONSE_ARCHIVE_FILE') or f'archives/{crawler.spidercls.name}.zip'
+        s = cls(crawler, mode, path)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        if self.mode == 'replay':
+            self.archive = zipfile.ZipFile(self.path, 'r')
+        else:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.archive = zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED)
+        self.archived = {name[:-5] for name in self.archive.namelist() if name.endswith('.json')}
+        spider.logger.info(f"Response archive {self.path} opened for {self.mode} ({len(self.archived)} responses)")
+
+    def spider_closed(self, spider):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def fingerprint(self, request):
+        return self.crawler.request_fingerprinter.fingerprint(request).hex()
+
+    def process_request(self, request, spider):
+        if self.mode != 'replay':
+            return None
+        key = self.fingerprint(request)
+        if key not in self.archived:
+            self.stats.inc_value('archive/miss', spider=spider)
+            raise IgnoreRequest(f"Not in response archive: {request.url}")
+
+        meta = json.loads(self.archive.read(f'{key}.json'))
+        body = self.archive.read(f'{key}.body')
+        headers = Headers({
+            name.encode('latin-1'): [value.encode('latin-1') for value in values]
+            for name, values in meta['headers'].items()
+        })
+        response_cls = responsetypes.from_args(headers=headers, url=meta['url'], body=body)
+        self.stats.inc_value('archive/replayed', spider=spider)
+        return response_cls(
+            url=meta['url'], status=meta['status'], headers=headers, body=body,
+            request=request, flags=['replayed']
+        )
+
+    def process_response(self, request, response, spider):
+        if self.mode != 'record' or 'replayed' in response.flags:
+            return response
+        key = self.fingerprint(request)
+        if key in self.archived:
+            return response
+        meta = {
+            'url': response.url,
+            'status': response.status,
+            'headers': {
+                name.decode('latin-1'): [value.decode('latin-1') for value in values]
+                for name, values in response.headers.items()
+            },
+            'request_url': request.url,
+            'method': request.method,
+        }
+        self.archive.writestr(f'{key}.json', json.dumps(meta))
+        self.archive.writestr(f'{key}.body', response.body)
+        self.archived.add(key)
+        self.stats.inc_value('archive/recorded', spider=spider)
+        return response
+
+
+class SharedRateLimitMiddleware:
+    """Pace requests per host across every crawl and agent on the machine
+
+    DOWNLOAD_DELAY only paces this process. With ``SHARED_RATE_LIMIT_ENABLED``
+    each request first books a slot in the host's token bucket in
+    ``SHARED_RATE_LIMIT_DIR``, which other crawls and the phone agents share,
+    and waits for it. ``SHARED_RATE_LIMITS`` sets requests/second per host;
+    other hosts get ``SHARED_RATE_LIMIT_DEFAULT_RATE`` (default
+    1 / DOWNLOAD_DELAY). Requests sent through an egress exit
+    (``meta['egress_exit']``) use a bucket per exit and host, at the exit's
+    rate when ``meta['shared_rate_limit']`` gives one.
+
+    It sits after ResponseArchiveMiddleware (960), so replayed requests are
+    never delayed.
+    """
+
+    def __init__(self, crawler, limiter, rates, default_rate, burst=1):
+        self.stats = crawler.stats
+        self.limiter = limiter
+        self.rates = rates
+        self.default_rate = default_rate
+        self.burst = burst
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('SHARED_RATE_LIMIT_ENABLED'):
+            raise NotConfigured
+        delay = settings.getfloat('DOWNLOAD_DELAY')
+        default_rate = settings.getfloat('SHARED_RATE_LIMIT_DEFAULT_RATE') or (1 / delay if delay else 0)
+        s = cls(
+            crawler,
+            SharedRateLimiter(settings.get('SHARED_RATE_LIMIT_DIR') or DEFAULT_DIRECTORY),
+            {host: float(rate) for host, rate in settings.getdict('SHARED_RATE_LIMITS').items()},
+            default_rate,
+            burst=settings.getint('SHARED_RATE_LIMIT_BURST', 1),
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    async def process_request(self, request, spider):
+        key = self.limiter.key(request.url, request.meta.get('egress_exit'))
+        host = key.split('@', 1)[0]
+        rate = request.meta.get('shared_rate_limit', self.rates.get(host, self.default_rate))
+        wait = self.limiter.reserve(key, rate, self.burst)
+        if wait > 0:
+            self.stats.inc_value('shared_rate_limit/delayed', spider=spider)
+            self.stats.inc_value('shared_rate_limit/wait_seconds', wait, spider=spider)
+            await asyncio.sleep(wait)
+        return None
+
+    def spider_closed(self, spider):
+        self.limiter.close()
@@ -0,0 +1,135 @@
+# Typed parsers for the raw text fields scraped from DatosCif
+#
+# Kept free of Scrapy imports so the stand-alone scripts at the repository
+# root can reuse them on exported JSON files.
+
+import re
+import unicodedata
+from datetime import date
+
+
+CAPITAL_RE = re.compile(r'(\d[\d.]*(?:,\d+)?)')
+# dd/mm/yyyy, as strptime('%d/%m/%Y') reads it, without strptime's per-call overhead
+DATE_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})', re.ASCII)
+COORDINATES_RE = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+# "CNAE-2025", "Actividades Económicas 2025" and friends name the classification
+# edition, not an activity
+CNAE_EDITION_RE = re.compile(r'(?:CNAE|Econ[oó]micas)[\s\-(]*20\d\d\)?', re.IGNORECASE)
+CNAE_CODE_RE = re.compile(r'(?<![\w./,])(\d{2})\.?(\d{2})(?![\w/]|[.,]\d)')
+POSTAL_CODE_RE = re.compile(r'(?<!\d)(\d{5})(?!\d)')
+# Legal forms at the end of a company name, after dots have been removed
+# ("S.L.U." -> "slu"), so "ACME SL" and "Acme, S.L." compare equal
+LEGAL_SUFFIXES = {
+    'sl', 'slu', 'sll', 'slne', 'sa', 'sau', 'sal', 'scp', 'sc', 'scoop', 'coop', 'cb',
+    'sociedad limitada', 'sociedad limitada unipersonal', 'sociedad anonima',
+}
+
+TYPED_FIELDS = (
+    'social_capital_eur',
+    'start_date_iso',
+    'latitude',
+    'longitude',
+    'cnae_primary',
+    'cnae_secondary',
+)
+
+
+def parse_social_capital(value):
+    """Parse '3.000,00 Euros' into 3000.0 (None when missing)"""
+    if not value:
+        return None
+    match = CAPITAL_RE.search(value)
+    if not match:
+        return None
+    number = match.group(1).replace('.', '').replace(',', '.')
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+
+def parse_start_date(value):
+    """Parse '29/05/2025' into the ISO date '2025-05-29' (None when missing)"""
+    if not value:
+        return None
+    match = DATE_RE.fullmatch(value.strip())
+    if not match:
+        return None
+    day, month, year = match.groups()
+    try:
+        return date(int(year), int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def parse_coordinates(value):
+    """Parse '41.40,2.19' into a (lat, lon) float pair, or (None, None)"""
+    if not value:
+        return None, None
+    match = COORDINATES_RE.match(value)
+    if not match:
+        return None, None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None, None
+    return lat, lon
+
+
+def parse_cnae_codes(value):
+    """Extract CNAE codes from a business purpose as (primary, [secondary, ...])"""
+    if not value:
+        return None, []
+    text = CNAE_EDITION_RE.sub(' ', value)
+    codes = []
+    for division, group in CNAE_CODE_RE.findall(text):
+        code = division + group
+        if code not in codes:
+            codes.append(code)
+    if not codes:
+        return None, []
+    return codes[0], codes[1:]
+
+
+def normalize_company(company):
+    """Return the typed columns derived from a company's raw text fields"""
+    latitude, longitude = parse_coordinates(company.get('coordinates'))
+    cnae_primary, cnae_secondary = parse_cnae_codes(company.get('business_purpose'))
+    return {
+        'social_capital_eur': parse_social_capital(company.get('social_capital')),
+        'start_date_iso': parse_start_date(company.get('start_date')),
+        'latitude': latitude,
+        'longitude': longitude,
+        'cnae_primary': cnae_primary,
+        'cnae_secondary': cnae_secondary,
+    }
+
+
+def normalize_company_name(name):
+    """Lowercase, strip accents, punctuation and trailing legal forms
+
+    'Hostelería Pérez, S.L.U.' -> 'hosteleria perez'
+    """
+    if not name:
+        return ''
+    folded = name.lower()
+    # Plain ASCII names have no accents to strip
+    if not folded.isascii():
+        decomposed = unicodedata.normalize('NFKD', folded)
+        folded = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    tokens = re.sub(r'[^\w\s]', ' ', folded.replace('.', '')).split()
+    while tokens:
+        for size in (3, 2, 1):
+            if len(tokens) > size and ' '.join(tokens[-size:]) in LEGAL_SUFFIXES:
+                del tokens[-size:]
+                break
+        else:
+            break
+    return ' '.join(tokens)
+
+
+def parse_postal_code(address):
+    """The five-digit postal code inside a free-text address (None when absent)"""
+    if not address:
+        return None
+    match = POSTAL_CODE_RE.search(address)
+    return match.group(1) if match else None
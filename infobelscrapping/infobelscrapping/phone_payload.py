@@ -0,0 +1,172 @@
+# Infobel's click-to-reveal phone numbers
+#
+# Listing and detail pages hide the number behind a "show phone" button whose
+# onclick calls displayPhone(...) (or whose data-* attributes carry it), so
+# the spider used to record 'Phone available (encrypted)' and leave the
+# company to the much slower web search. The number is usually in the page
+# already, only obfuscated: decode_phone_payload() tries the arguments and
+# attributes of the button as plain, URL/entity-escaped, base64, hex and
+# reversed text and accepts the first result that is a valid Spanish number.
+#
+# Payloads that do not decode locally can be resolved by one lightweight
+# request for many companies at once: PhoneResolveBatch collects their tokens
+# (deduplicated, with the items waiting on each) until a batch is full or the
+# crawl goes idle. Kept free of Scrapy imports, like the selector cache.
+
+import base64
+import binascii
+import html
+import re
+from urllib.parse import unquote
+
+# Spanish numbers: 9 digits starting with 6-9, optionally prefixed by 34
+SPANISH_PHONE_RE = re.compile(r'^(?:0034|34)?([6789]\d{8})$')
+# String literals passed to displayPhone(...) and similar handlers
+JS_STRING_RE = re.compile(r'''(['"])((?:\\.|(?!\1).)*)\1''')
+# Bare numeric arguments, e.g. displayPhone(this, 912345678)
+JS_NUMBER_RE = re.compile(r'[(,]\s*(\d{6,})\s*(?=[,)])')
+# data-* attributes that may hold the (encoded) number, and ones that only
+# identify the listing; ids are never decoded, a numeric id could pass for a phone
+PHONE_ATTRIBUTE_RE = re.compile(r'^data-.*(phone|tel|number|payload)', re.IGNORECASE)
+ID_ATTRIBUTE_RE = re.compile(r'^data-.*(id|key|token)$', re.IGNORECASE)
+
+ENCRYPTED_PHONE = 'Phone available (encrypted)'
+
+
+def normalize_phone(text):
+    """+34XXXXXXXXX if text is a Spanish phone number (separators allowed), else None"""
+    if not text or len(text) > 32:
+        return None
+    if re.search(r'[^\d\s+().\-/]', text):
+        return None
+    digits = re.sub(r'\D', '', text)
+    match = SPANISH_PHONE_RE.match(digits)
+    return f'+34{match.group(1)}' if match else None
+
+
+def decoded_variants(value):
+    """The payload as is and under each decoding that applies"""
+    value = value.strip()
+    yield value
+    unescaped = html.unescape(unquote(value))
+    if unescaped != value:
+        yield unescaped
+    compact = re.sub(r'\s', '', value)
+    if len(compact) >= 8 and re.fullmatch(r'[A-Za-z0-9+/_-]+=*', compact):
+        padded = compact + '=' * (-len(compact) % 4)
+        for decode in (base64.b64decode, base64.urlsafe_b64decode):
+            try:
+                yield decode(padded).decode('utf-8')
+            except (binascii.Error, ValueError):
+                pass
+    if len(compact) % 2 == 0 and re.fullmatch(r'[0-9a-fA-F]{16,}', compact):
+        try:
+            yield bytes.fromhex(compact).decode('utf-8')
+        except ValueError:
+            pass
+
+
+def decode_phone_payload(value):
+    """Phone number hidden in one payload string, or None"""
+    for variant in decoded_variants(value):
+        for candidate in (variant, variant[::-1]):
+            phone = normalize_phone(candidate)
+            if phone:
+                return phone
+    return None
+
+
+def payload_values(onclick, attributes):
+    """Candidate payloads of a reveal button: onclick arguments, then phone-like data-* attributes"""
+    values = []
+    if onclick:
+        values.extend(match.group(2) for match in JS_STRING_RE.finditer(onclick))
+        values.extend(JS_NUMBER_RE.findall(onclick))
+    for name, value in attributes.items():
+        if value and PHONE_ATTRIBUTE_RE.match(name):
+            values.append(value)
+    return values
+
+
+def id_values(attributes):
+    return [value for name, value in attributes.items() if value and ID_ATTRIBUTE_RE.match(name)]
+
+
+def decode_reveal_button(onclick, attributes):
+    """Return (phone, token) for a reveal button
+
+    ``phone`` is the locally decoded number or None. ``token`` is the
+    payload to resolve remotely when decoding failed: the longest candidate,
+    which is the encoded number or the listing id the button would send.
+    """
+    values = payload_values(onclick, attributes)
+    for value in values:
+        phone = decode_phone_payload(value)
+        if phone:
+            return phone, None
+    values += id_values(attributes)
+    return None, max(values, key=len) if values else None
+
+
+class PhoneResolveBatch:
+    """Tokens waiting for a batched phone lookup, with the items waiting on each"""
+
+    def __init__(self, batch_size=20, stats=None):
+        self.batch_size = batch_size
+        self.stats = stats
+        # token -> items; insertion order is the order tokens are sent in
+        self.pending = {}
+        # token -> phone (None when the lookup did not know it)
+        self.resolved = {}
+        self.in_flight = set()
+
+    def add(self, token, item):
+        """Queue an item on a token; returns False if the token is already resolved"""
+        if token in self.resolved:
+            self.inc_stat('phone_payload/resolve_cached')
+            return False
+        waiting = self.pending.get(token)
+        if waiting is None:
+            self.pending[token] = [item]
+            self.inc_stat('phone_payload/resolve_queued')
+        else:
+            waiting.append(item)
+            self.inc_stat('phone_payload/resolve_deduplicated')
+        return True
+
+    def ready(self):
+        return len(self.unsent()) >= self.batch_size
+
+    def unsent(self):
+        return [token for token in self.pending if token not in self.in_flight]
+
+    def take(self):
+        """Tokens of the next lookup, at most batch_size, marked in flight"""
+        tokens = self.unsent()[:self.batch_size]
+        self.in_flight.update(tokens)
+        return tokens
+
+    def resolve(self, tokens, phones):
+        """Record a lookup's answers ({token: phone}); returns [(item, phone or None)]"""
+        done = []
+        for token in tokens:
+            phone = normalize_phone(phones.get(token)) if phones.get(token) else None
+            self.resolved[token] = phone
+            self.in_flight.discard(token)
+            self.inc_stat(f'phone_payload/{"resolved" if phone else "unresolved"}')
+            for item in self.pending.pop(token, ()):
+                done.append((item, phone))
+        return done
+
+    def state(self):
+        return {'pending': self.pending, 'resolved': self.resolved}
+
+    def restore(self, state):
+        # Lookups in flight when the crawl stopped are sent again
+        self.pending = state['pending']
+        self.resolved = state['resolved']
+        self.in_flight = set()
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
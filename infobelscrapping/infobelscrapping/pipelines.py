@@ -3,10 +3,22 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import asyncio
+import os
 import re
+import sys
 import json
+import time
+from collections.abc import Mapping, MutableMapping
+import scrapy
 from itemadapter import ItemAdapter
-from scrapy.exceptions import DropItem
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import task
+
+from infobelscrapping.frontier import category_from_url
+from infobelscrapping.normalization import normalize_company, normalize_company_name
 
 
 class DataCleaningPipeline:
@@ -15,9 +27,10 @@ class DataCleaningPipeline:
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
         
-        # Clean company name
-        if adapter.get('company_name'):
-            adapter['company_name'] = adapter['company_name'].strip()
+        # Clean company name (infobel items keep it in 'name')
+        name_field = 'company_name' if adapter.get('company_name') else 'name'
+        if adapter.get(name_field):
+            adapter[name_field] = adapter[name_field].strip()
         else:
             raise DropItem(f"Missing company name: {item}")
         
@@ -55,15 +68,32 @@ class DataCleaningPipeline:
             if not adapter.get('url'):
                 adapter['url'] = 'Not available'
         
-        # Only set category for old-style items (backwards compatibility)
+        # The spider sets the listing's category; fall back to the one in the link
         if 'category' in adapter.keys() and not adapter.get('category'):
-            adapter['category'] = 'alimentacion_hosteleria'
+            category = category_from_url(adapter.get('link'))
+            adapter['category'] = category[1] if category else 'unknown'
+        
+        return item
+
+
+class TypedFieldsPipeline:
+    """Derive typed columns (capital, ISO date, lat/lon, CNAE codes) from the raw text fields"""
+    
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        
+        # Only datoscif-style items carry the raw fields we know how to parse
+        if 'social_capital' not in adapter.keys():
+            return item
+        
+        for field, value in normalize_company(adapter).items():
+            adapter[field] = value
         
         return item
 
 
 class DuplicatesPipeline:
-    """Remove duplicate companies based on name and link"""
+    """Remove duplicate companies based on normalized name and link"""
     
     def __init__(self):
         self.seen_items = set()
@@ -74,48 +104,463 @@ class DuplicatesPipeline:
         # Create unique identifier - handle both old and new field names
         company_name = adapter.get('company_name') or adapter.get('name', '')
         url = adapter.get('url') or adapter.get('link', '')
-        identifier = (company_name.lower(), url)
+        # "Acme, S.L." and "ACME SL" are the same company
+        identifier = (normalize_company_name(company_name), url)
         
         if identifier in self.seen_items:
             raise DropItem(f"Duplicate item: {company_name}")
         else:
             self.seen_items.add(identifier)
             return item
+    
+    def checkpoint_state(self):
+        return {'seen_items': self.seen_items}
+    
+    def restore_checkpoint(self, state):
+        self.seen_items = set(state['seen_items'])
+
+
+def load_phone_agent_class():
+    """Import EnhancedPhoneSearchAgent from the repository root, next to the Scrapy project
+
+    The root scripts import this package as `infobelscrapping.infobelscrapping`.
+    Under Scrapy it is the top-level `infobelscrapping`, so that name is
+    pointed at the modules already loaded here before the agent imports it.
+    """
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    if root not in sys.path:
+        sys.path.append(root)
+    if __package__ == 'infobelscrapping':
+        from . import event_log
+        sys.modules.setdefault('infobelscrapping.infobelscrapping', sys.modules[__package__])
+        sys.modules.setdefault('infobelscrapping.infobelscrapping.event_log', event_log)
+    from enhanced_phone_agent import EnhancedPhoneSearchAgent
+    return EnhancedPhoneSearchAgent
+
+
+def load_egress_pool(path):
+    """EgressPool from the repository root (importable once the agent class is loaded)"""
+    from egress_pool import EgressPool
+    return EgressPool.from_file(path)
+
+
+def load_search_archive(path):
+    """SearchArchive from the repository root (importable once the agent class is loaded)"""
+    from search_archive import SearchArchive
+    return SearchArchive(path)
+
+
+class PhoneEnrichmentPipeline:
+    """Search each company's phone while the crawl is still running
+    
+    Search pages are fetched through Scrapy's own downloader on a dedicated
+    download slot, so searches run on the reactor's asyncio loop alongside
+    the crawl instead of in a separate batch afterwards. At most
+    ``PHONE_ENRICHMENT_CONCURRENCY`` companies are searched at once; items
+    waiting for a search stay in the scraper, which makes Scrapy stop
+    downloading new pages once ``SCRAPER_SLOT_MAX_ACTIVE_SIZE`` is reached.
+    Parsing and phone extraction are shared with ``enhanced_phone_agent.py``,
+    and so is the egress pool: each search goes out through the exit the pool
+    picks (``PHONE_ENRICHMENT_EGRESS_POOL``), on a download slot of its own.
+    With ``PHONE_ENRICHMENT_ARCHIVE`` set, results pages are kept in the same
+    search archive the agent uses, for later re-extraction.
+    """
+    
+    download_slot = 'phone-search'
+    
+    def __init__(self, crawler, agent, concurrency=4, max_queries=5):
+        self.crawler = crawler
+        self.agent = agent
+        self.concurrency = concurrency
+        self.max_queries = max_queries
+        self.semaphore = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PHONE_ENRICHMENT_ENABLED'):
+            raise NotConfigured
+        agent_class = load_phone_agent_class()
+        pool_file = settings.get('PHONE_ENRICHMENT_EGRESS_POOL')
+        archive_dir = settings.get('PHONE_ENRICHMENT_ARCHIVE')
+        agent = agent_class(
+            egress_pool=load_egress_pool(pool_file) if pool_file else None,
+            archive=load_search_archive(archive_dir) if archive_dir else None,
+        )
+        return cls(
+            crawler,
+            agent,
+            concurrency=settings.getint('PHONE_ENRICHMENT_CONCURRENCY', 4),
+            max_queries=settings.getint('PHONE_ENRICHMENT_MAX_QUERIES', 5),
+        )
+    
+    def open_spider(self, spider):
+        # Created here so it binds to the reactor's running asyncio loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+    
+    async def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        
+        # Datoscif companies only; infobel listings come with their phone
+        if not adapter.get('company_name') or adapter.get('phone'):
+            return item
+        
+        async with self.semaphore:
+            phone, search_info = await self.search_phone(adapter, spider)
+        
+        adapter['phone'] = phone
+        adapter['phone_search_info'] = search_info
+        adapter['search_timestamp'] = time.time()
+        self.crawler.stats.inc_value(f'phone_enrichment/{"found" if phone else "not_found"}')
+        self.agent.events.info('company.searched', company=adapter.get('company_name'), phone=phone,
+                               search_info=search_info)
+        return item
+    
+    async def search_phone(self, company, spider):
+        queries = self.agent.build_search_queries(company)[:self.max_queries]
+        
+        for i, query in enumerate(queries):
+            # Wait on the loop, not in the pool, for the exit's next slot
+            exit, wait = self.agent.egress.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            meta = {
+                'download_slot': f'{self.download_slot}/{exit.name}',
+                # Same as the standalone agent: search pages are not part of the crawl
+                'dont_obey_robotstxt': True,
+                # Shared with the agents' buckets for this exit (SharedRateLimitMiddleware)
+                'egress_exit': exit.name,
+                'shared_rate_limit': exit.rate,
+            }
+            if exit.proxy:
+                meta['proxy'] = exit.proxy
+            if exit.source_address:
+                meta['bindaddress'] = (exit.source_address, 0)
+            request = scrapy.Request(
+                self.agent.search_url(query),
+                headers=self.agent.egress.headers_for(exit),
+                meta=meta,
+                dont_filter=True,
+            )
+            try:
+                response = await maybe_deferred_to_future(self.crawler.engine.download(request))
+            except Exception as e:
+                self.agent.egress.release(exit, False)
+                self.agent.events.warning('search.error', company=company.get('company_name'),
+                                          exit=exit.name, error=str(e))
+                continue
+            self.agent.egress.release(exit, response.status not in self.agent.egress.failure_statuses)
+            
+            self.crawler.stats.inc_value('phone_enrichment/searches')
+            if response.status != 200:
+                continue
+            if self.agent.archive is not None:
+                self.agent.archive.add(company, i + 1, query, request.url, response.body, response.encoding)
+            
+            for result in self.agent.parse_search_results(response.text):
+                if result.phone_found:
+                    return result.phone_found, f"Found via search strategy {i+1}"
+        
+        return None, "No phone found after all strategies"
 
 
 class StatsPipeline:
-    """Collect statistics about scraped data"""
+    """Collect statistics about scraped data through Scrapy's stats collector
     
-    def __init__(self):
-        self.stats = {
-            'total_items': 0,
-            'items_with_phone': 0,
-            'items_with_address': 0,
-            'categories': {}
-        }
+    Counters live under the ``pipeline/`` prefix so they show up in the
+    end-of-crawl stats dump. A summary is flushed to ``STATS_FILE`` every
+    ``STATS_FLUSH_INTERVAL`` seconds (and on close), and each flush also
+    appends a line to ``STATS_TIMELINE_FILE`` so throughput can be tracked
+    while a long crawl is running.
+    """
+    
+    prefix = 'pipeline/'
+    missing_values = ('Not available', 'Invalid format', 'No address found', 'No phone found')
+    # Upper bounds (seconds) of the page latency histogram buckets
+    latency_buckets = (0.5, 1, 2, 5, 10, 30)
+    
+    def __init__(self, stats, stats_file='scraping_stats.json',
+                 timeline_file='scraping_stats_timeline.jsonl', flush_interval=60):
+        self.stats = stats
+        self.stats_file = stats_file
+        self.timeline_file = timeline_file
+        self.flush_interval = flush_interval
+        self.flush_task = None
+        self.start_time = None
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        s = cls(
+            crawler.stats,
+            stats_file=settings.get('STATS_FILE', 'scraping_stats.json'),
+            timeline_file=settings.get('STATS_TIMELINE_FILE', 'scraping_stats_timeline.jsonl'),
+            flush_interval=settings.getfloat('STATS_FLUSH_INTERVAL', 60),
+        )
+        crawler.signals.connect(s.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        return s
+    
+    def open_spider(self, spider):
+        self.start_time = time.time()
+        if self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(self.flush, spider)
+            self.flush_task.start(self.flush_interval, now=False)
     
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
         
-        self.stats['total_items'] += 1
-        
-        if adapter.get('phone') and adapter['phone'] not in ['Not available', 'Invalid format']:
-            self.stats['items_with_phone'] += 1
+        self.stats.inc_value(f'{self.prefix}items')
         
-        if adapter.get('address') and adapter['address'] != 'Not available':
-            self.stats['items_with_address'] += 1
+        for field, value in adapter.items():
+            if self.is_filled(value):
+                self.stats.inc_value(f'{self.prefix}field_filled/{field}')
         
-        category = adapter.get('category', 'unknown')
-        self.stats['categories'][category] = self.stats['categories'].get(category, 0) + 1
+        category = adapter.get('category') or 'unknown'
+        self.stats.inc_value(f'{self.prefix}category/{category}')
         
         return item
     
+    def is_filled(self, value):
+        if value is None:
+            return False
+        if isinstance(value, str):
+            return bool(value.strip()) and value not in self.missing_values
+        if isinstance(value, (list, tuple, dict)):
+            return bool(value)
+        return True
+    
+    def item_dropped(self, item, response, exception, spider):
+        # "Duplicate item: ACME SL" -> "Duplicate item"
+        reason = str(exception).split(':', 1)[0].strip() or type(exception).__name__
+        self.stats.inc_value(f'{self.prefix}dropped/{reason}')
+    
+    def response_received(self, response, request, spider):
+        self.stats.inc_value(f'{self.prefix}pages')
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return
+        for bound in self.latency_buckets:
+            if latency < bound:
+                bucket = f'<{bound}s'
+                break
+        else:
+            bucket = f'>={self.latency_buckets[-1]}s'
+        self.stats.inc_value(f'{self.prefix}latency/{bucket}')
+    
+    def collect(self, name):
+        """Return the ``pipeline/<name>/*`` counters as a plain dict"""
+        key_prefix = f'{self.prefix}{name}/'
+        return {
+            key[len(key_prefix):]: value
+            for key, value in self.stats.get_stats().items()
+            if key.startswith(key_prefix)
+        }
+    
+    def summary(self):
+        total = self.stats.get_value(f'{self.prefix}items', 0)
+        filled = self.collect('field_filled')
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return {
+            'timestamp': time.time(),
+            'elapsed_seconds': round(elapsed, 1),
+            'total_items': total,
+            'items_with_phone': filled.get('phone', 0),
+            'items_with_address': filled.get('address', 0),
+            'items_per_minute': round(total / elapsed * 60, 2) if elapsed else 0,
+            'pages_crawled': self.stats.get_value(f'{self.prefix}pages', 0),
+            'field_fill_rates': {
+                field: round(count / total, 4) for field, count in sorted(filled.items())
+            } if total else {},
+            'categories': self.collect('category'),
+            'page_latency_histogram': self.collect('latency'),
+            'drop_reasons': self.collect('dropped'),
+        }
+    
+    def flush(self, spider):
+        summary = self.summary()
+        
+        # Write to a temp file first so a reader never sees a half-written snapshot
+        tmp_file = f'{self.stats_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_file, self.stats_file)
+        
+        if self.timeline_file:
+            with open(self.timeline_file, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        
+        spider.logger.info(
+            f"Stats: {summary['total_items']} items, {summary['items_per_minute']} items/min, "
+            f"{summary['pages_crawled']} pages"
+        )
+        return summary
+    
+    def checkpoint_state(self):
+        # The counters live in the crawler stats, which start empty on resume
+        counters = {
+            key: value for key, value in self.stats.get_stats().items()
+            if key.startswith(self.prefix)
+        }
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return {'counters': counters, 'elapsed_seconds': elapsed}
+    
+    def restore_checkpoint(self, state):
+        for key, value in state['counters'].items():
+            self.stats.set_value(key, value)
+        # Throughput keeps counting the time of the earlier runs
+        self.start_time = time.time() - state['elapsed_seconds']
+    
     def close_spider(self, spider):
-        # Save stats to file
-        with open('scraping_stats.json', 'w') as f:
-            json.dump(self.stats, f, indent=2)
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        
+        summary = self.flush(spider)
+        spider.logger.info(f"Scraping completed. Stats: {summary}")
+
+
+class CompanyItemPipeline(StatsPipeline):
+    """Cleaning, duplicate filter, typed fields and stats of each item in one stage
+    
+    Does what ``DataCleaningPipeline``, ``DuplicatesPipeline``,
+    ``TypedFieldsPipeline`` and ``StatsPipeline`` do in turn, with the same
+    results and ``pipeline/`` counters, but reads and writes dicts and
+    ``scrapy.Item``s directly instead of through an ``ItemAdapter`` per stage,
+    and skips the typed fields of duplicates. Field counters are gathered
+    from the ``item_scraped`` signal, once phone enrichment has run, as one
+    count per (filled fields, category) combination; they are added to the
+    crawler stats on every flush, checkpoint and at the end of the crawl.
+    """
+    
+    phone_re = re.compile(r'(\+34\s?\d{9}|\d{9})')
+    missing_set = frozenset(StatsPipeline.missing_values)
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.seen_items = set()
+        # (filled fields, category) -> items not yet in the crawler stats
+        self.fill_patterns = {}
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = super().from_crawler(crawler)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        return s
+    
+    def process_item(self, item, spider):
+        record = item if isinstance(item, MutableMapping) else ItemAdapter(item)
+        
+        # Infobel items keep the company name in 'name'
+        name_field = 'company_name' if record.get('company_name') else 'name'
+        company_name = record.get(name_field)
+        if not company_name:
+            raise DropItem(f"Missing company name: {item}")
+        record[name_field] = company_name = company_name.strip()
+        
+        phone = record.get('phone')
+        if phone:
+            phone = ' '.join(phone.split())
+            record['phone'] = phone if self.phone_re.search(phone) else 'Invalid format'
         
-        spider.logger.info(f"Scraping completed. Stats: {self.stats}")
+        address = record.get('address')
+        record['address'] = ' '.join(address.split()) if address else 'Not available'
+        
+        url = record.get('url')
+        if url:
+            url = url.strip()
+            if url and not url.startswith('http'):
+                record['url'] = f"https://www.datoscif.es{url}"
+        else:
+            link = record.get('link')
+            if link:
+                link = link.strip()
+                if not link.startswith('http'):
+                    record['link'] = f"https://www.infobel.com{link}"
+            else:
+                record['url'] = 'Not available'
+        
+        if 'category' in record and not record.get('category'):
+            category = category_from_url(record.get('link'))
+            record['category'] = category[1] if category else 'unknown'
+        
+        name = company_name or record.get('name', '')
+        identifier = (normalize_company_name(name), record.get('url') or record.get('link', ''))
+        if identifier in self.seen_items:
+            raise DropItem(f"Duplicate item: {name}")
+        self.seen_items.add(identifier)
+        
+        if 'social_capital' in record:
+            record.update(normalize_company(record))
+        
+        return item
+    
+    def item_scraped(self, item, response, spider):
+        record = item if isinstance(item, Mapping) else ItemAdapter(item)
+        missing = self.missing_set
+        is_filled = self.is_filled
+        filled = tuple([
+            field for field, value in record.items()
+            if (value.strip() and value not in missing if type(value) is str else is_filled(value))
+        ])
+        key = (filled, record.get('category') or 'unknown')
+        self.fill_patterns[key] = self.fill_patterns.get(key, 0) + 1
+    
+    def count_fill_patterns(self):
+        """Add the items gathered since the last call to the crawler stats"""
+        patterns, self.fill_patterns = self.fill_patterns, {}
+        prefix = self.prefix
+        for (fields, category), count in patterns.items():
+            self.stats.inc_value(f'{prefix}items', count)
+            for field in fields:
+                self.stats.inc_value(f'{prefix}field_filled/{field}', count)
+            self.stats.inc_value(f'{prefix}category/{category}', count)
+    
+    def summary(self):
+        self.count_fill_patterns()
+        return super().summary()
+    
+    def checkpoint_state(self):
+        self.count_fill_patterns()
+        return dict(super().checkpoint_state(), seen_items=self.seen_items)
+    
+    def restore_checkpoint(self, state):
+        super().restore_checkpoint(state)
+        self.seen_items = set(state['seen_items'])
+
+
+class PipelineTimerPipeline:
+    """Measure the time items spend in the item pipelines (benchmark runs only)
+    
+    Registered first in ``ITEM_PIPELINES``, it stamps each item on entry; the
+    ``item_scraped``/``item_dropped``/``item_error`` signals fire once the last
+    pipeline is done with it. The totals go to ``benchmark/pipeline_seconds``
+    and ``benchmark/pipeline_items`` for the ``CrawlBenchmark`` extension.
+    """
+    
+    def __init__(self, stats):
+        self.stats = stats
+        self.started = {}
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BENCHMARK_ENABLED'):
+            raise NotConfigured
+        s = cls(crawler.stats)
+        crawler.signals.connect(s.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(s.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(s.item_done, signal=signals.item_error)
+        return s
+    
+    def process_item(self, item, spider):
+        self.started[id(item)] = time.perf_counter()
+        return item
+    
+    def item_done(self, item, spider, **kwargs):
+        started = self.started.pop(id(item), None)
+        if started is None:
+            return
+        self.stats.inc_value('benchmark/pipeline_seconds', time.perf_counter() - started)
+        self.stats.inc_value('benchmark/pipeline_items')
 
 
 class InfobelscrappingPipeline:
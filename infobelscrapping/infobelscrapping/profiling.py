@@ -0,0 +1,244 @@
+# Sampling profiler with per-stage attribution
+#
+# Kept free of Scrapy imports so enhanced_phone_agent.py --profile and the
+# CrawlProfiler extension share it.
+#
+# A background thread samples the profiled thread's stack every few
+# milliseconds. Each sample is attributed to a stage (fetch, parse, pipelines,
+# extraction, idle) from the frames on the stack, so no code has to be
+# instrumented. Where the OS exposes per-thread CPU clocks, samples taken
+# while the thread was off the CPU (sleeping, waiting on a socket) are marked
+# "[wait]", so the CPU profile of each stage is separate from its waiting
+# time. Samples are written as folded stacks ("stage;a;b;c count"), the input
+# format of flamegraph.pl, speedscope and inferno, plus a top-N summary.
+# Optionally tracemalloc snapshots are taken at intervals to show which lines
+# keep allocating during long runs.
+
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+
+# Stage rules as (stage, path fragments, function names). The innermost frame
+# matching a rule decides the stage of a sample
+STAGE_RULES = (
+    ('pipelines', ('pipelines.py', '/itemadapter/'), ()),
+    ('parse', ('/spiders/', '/parsel/', '/scrapy/selector/', '/w3lib/'), ()),
+    ('extraction', (), ('parse_search_results', 'extract_phones', 'clean_phone_number', 'extract_phone')),
+    ('fetch', ('/scrapy/core/downloader/', '/twisted/web/', '/requests/', '/urllib3/',
+               '/http/client.py', 'socket.py', 'ssl.py'), ()),
+    ('idle', ('selectors.py', '/asyncio/base_events.py'), ('sleep',)),
+)
+
+
+# A sample is on-CPU when the thread used at least this share of the interval
+ON_CPU_SHARE = 0.5
+
+
+def frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def classify(codes):
+    """Stage of a sample, from the innermost frame matching a rule"""
+    for code in reversed(codes):
+        filename = code.co_filename.replace('\\', '/')
+        for stage, fragments, functions in STAGE_RULES:
+            if code.co_name in functions or any(fragment in filename for fragment in fragments):
+                return stage
+    return 'other'
+
+
+class StageProfiler:
+    """Sample one thread's stacks in the background and summarize them per stage"""
+
+    def __init__(self, output_prefix, interval=0.005, memory_interval=0, top_n=25, thread_id=None):
+        self.output_prefix = output_prefix
+        self.interval = interval
+        self.memory_interval = memory_interval
+        self.top_n = top_n
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.stages = Counter()
+        self.self_samples = Counter()
+        self.total_samples = Counter()
+        self.cpu_samples = Counter()
+        self.cpu_seconds = Counter()
+        self.memory_timeline = []
+        self.first_snapshot = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.started_at = None
+        try:
+            self.cpu_clock = time.pthread_getcpuclockid(self.thread_id)
+        except (AttributeError, OSError):
+            # No per-thread CPU clock (Windows, macOS): every sample counts as on-CPU
+            self.cpu_clock = None
+        self.last_cpu_time = None
+        self.pending = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.write()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        if self.memory_interval:
+            tracemalloc.start()
+            self.first_snapshot = self.take_snapshot()
+        self.thread = threading.Thread(target=self.run, name='stage-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.pending is not None:
+            pending_codes, before = self.pending
+            self.record(pending_codes, before, self.cpu_delta())
+            self.pending = None
+        if self.memory_interval:
+            self.snapshot_memory()
+            tracemalloc.stop()
+
+    def run(self):
+        next_memory = time.perf_counter() + self.memory_interval
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+            if self.memory_interval and time.perf_counter() >= next_memory:
+                self.snapshot_memory()
+                next_memory += self.memory_interval
+
+    def cpu_delta(self):
+        """CPU time the profiled thread used since the previous sample (None if unknown)"""
+        if self.cpu_clock is None:
+            return None
+        cpu_time = time.clock_gettime(self.cpu_clock)
+        last, self.last_cpu_time = self.last_cpu_time, cpu_time
+        return None if last is None else cpu_time - last
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        # The sampler tends to get the GIL right as the thread starts or stops
+        # waiting, so a sample is only on-CPU when the thread was busy both
+        # before and after it
+        cpu_delta = self.cpu_delta()
+        if self.pending is not None:
+            pending_codes, before = self.pending
+            self.record(pending_codes, before, cpu_delta)
+        self.pending = (codes, cpu_delta) if codes else None
+
+    def record(self, codes, before, after):
+        if before is None or after is None:
+            on_cpu = self.cpu_clock is None or (before or after or 0) >= self.interval * ON_CPU_SHARE
+        else:
+            on_cpu = min(before, after) >= self.interval * ON_CPU_SHARE
+        stage = classify(codes)
+        labels = [frame_label(code) for code in codes]
+        root = stage if on_cpu else f'{stage} [wait]'
+        self.stacks[';'.join([root] + labels)] += 1
+        self.stages[stage] += 1
+        # Each interval's CPU time is shared by the samples at both ends
+        self.cpu_seconds[stage] += ((before or 0) + (after or 0)) / 2
+        if not on_cpu:
+            return
+        self.cpu_samples[stage] += 1
+        self.self_samples[(stage, labels[-1])] += 1
+        # Count each function once per sample even when it recurses
+        for label in set(labels):
+            self.total_samples[(stage, label)] += 1
+
+    def take_snapshot(self):
+        # Leave out the profiler's own allocations
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def snapshot_memory(self):
+        snapshot = self.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        growth = snapshot.compare_to(self.first_snapshot, 'lineno')[:self.top_n]
+        self.memory_timeline.append({
+            'elapsed_seconds': round(time.perf_counter() - self.started_at, 1),
+            'traced_mb': round(current / 1e6, 2),
+            'peak_mb': round(peak / 1e6, 2),
+            'top_growth': [
+                {'line': str(stat.traceback[0]), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                 'count_diff': stat.count_diff}
+                for stat in growth if stat.size_diff > 0
+            ],
+        })
+
+    def summary(self):
+        total = sum(self.stages.values())
+        cpu_total = sum(self.cpu_samples.values())
+        elapsed = time.perf_counter() - self.started_at
+
+        def top(counter, stage=None):
+            items = [(key, count) for key, count in counter.items() if stage is None or key[0] == stage]
+            items.sort(key=lambda item: item[1], reverse=True)
+            return [
+                {'function': label, 'stage': item_stage, 'samples': count,
+                 'cpu_share': round(count / cpu_total, 4) if cpu_total else 0}
+                for (item_stage, label), count in items[:self.top_n]
+            ]
+
+        return {
+            'elapsed_seconds': round(elapsed, 2),
+            'interval_seconds': self.interval,
+            'samples': total,
+            'cpu_samples': cpu_total,
+            'stages': {
+                stage: {
+                    'wall_share': round(count / total, 4),
+                    'wall_seconds': round(count / total * elapsed, 2),
+                    # Measured per-thread CPU time, or estimated from on-CPU samples
+                    'cpu_seconds': round(self.cpu_seconds[stage] if self.cpu_clock is not None
+                                         else self.cpu_samples[stage] * self.interval, 2),
+                }
+                for stage, count in self.stages.most_common()
+            },
+            'top_self': top(self.self_samples),
+            'top_total_by_stage': {stage: top(self.total_samples, stage) for stage in self.cpu_samples},
+            'memory': self.memory_timeline,
+        }
+
+    def write(self):
+        """Write <prefix>.folded and <prefix>.json; returns the summary"""
+        folded_file = f'{self.output_prefix}.folded'
+        with open(folded_file, 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write(f'{stack} {count}\n')
+
+        summary = self.summary()
+        tmp_file = f'{self.output_prefix}.json.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+        os.replace(tmp_file, f'{self.output_prefix}.json')
+        return summary
+
+    def format_summary(self, summary=None, limit=10):
+        summary = summary or self.summary()
+        lines = [f"Profile: {summary['samples']} samples over {summary['elapsed_seconds']}s "
+                 f"({summary['cpu_samples']} on CPU)"]
+        for stage, info in summary['stages'].items():
+            lines.append(f"  {stage:<11} {info['wall_share']:>6.1%} of wall time, "
+                         f"~{info['cpu_seconds']}s CPU of ~{info['wall_seconds']}s")
+        lines.append("Top functions (CPU self time):")
+        for entry in summary['top_self'][:limit]:
+            lines.append(f"  {entry['cpu_share']:>6.1%}  [{entry['stage']}] {entry['function']}")
+        return '\n'.join(lines)
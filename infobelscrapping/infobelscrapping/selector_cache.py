@@ -0,0 +1,92 @@
+# Selector profile cache
+#
+# The infobel pages are parsed by trying several candidate selectors in turn.
+# SelectorProfileCache remembers which candidate matched for each domain and
+# page role, tries that one first on later pages and only falls back to the
+# full candidate list on a miss. Profiles are persisted as JSON between runs.
+# Catch-all fallbacks (e.g. 'a::text') match on almost any page, so they are
+# never remembered: tried first, they would shadow the specific selectors.
+
+import json
+import os
+
+
+class SelectorProfileCache:
+    """Remember the winning selector per (domain, role) and try it first"""
+
+    def __init__(self, path=None, stats=None, catch_all=(), enabled=True):
+        self.path = path
+        self.stats = stats
+        self.catch_all = frozenset(catch_all)
+        # Disabled, every lookup scans the full candidate list (for benchmarks)
+        self.enabled = enabled
+        self.profiles = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.profiles = json.load(f)
+
+    def first_match(self, domain, role, selectors, query):
+        """Return (selector, result) for the first selector whose query result is truthy
+
+        ``role`` names the page type and element, e.g. ``'listing/name'``.
+        ``query`` is called with a selector string and returns the extracted
+        value (a SelectorList, a string, ...). Returns (None, None) when no
+        selector matches.
+        """
+        if not self.enabled:
+            for selector in selectors:
+                result = query(selector)
+                if result:
+                    return selector, result
+            return None, None
+
+        domain_profile = self.profiles.setdefault(domain, {})
+        cached = domain_profile.get(role)
+        if cached in self.catch_all:
+            # Remembered by an earlier version of the cache
+            del domain_profile[role]
+            cached = None
+
+        if cached is not None:
+            result = query(cached)
+            if result:
+                self.inc_stat(f'selectors/{role}/hit')
+                return cached, result
+
+        self.inc_stat(f'selectors/{role}/miss')
+        for selector in selectors:
+            if selector == cached:
+                continue
+            result = query(selector)
+            if result:
+                if selector not in self.catch_all:
+                    domain_profile[role] = selector
+                return selector, result
+
+        return None, None
+
+    def inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+    def hit_rates(self):
+        """Return {role: hit rate} from the recorded hit/miss counters"""
+        if self.stats is None:
+            return {}
+        counts = {}
+        for key, value in self.stats.get_stats().items():
+            if key.startswith('selectors/') and key.endswith(('/hit', '/miss')):
+                role, outcome = key[len('selectors/'):].rsplit('/', 1)
+                counts.setdefault(role, {'hit': 0, 'miss': 0})[outcome] = value
+        return {
+            role: round(c['hit'] / (c['hit'] + c['miss']), 4)
+            for role, c in counts.items()
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.profiles, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
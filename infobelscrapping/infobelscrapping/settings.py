@@ -61,23 +61,160 @@ RANDOMIZE_DOWNLOAD_DELAY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "infobelscrapping.middlewares.InfobelscrappingDownloaderMiddleware": 543,
-#}
+# The block-aware throttle sits at 585 so it sees responses after redirects and
+# decompression have been applied, but before RetryMiddleware (550). The
+# response archive sits next to the downloader (950) so it stores and replays
+# raw responses
+DOWNLOADER_MIDDLEWARES = {
+    "infobelscrapping.middlewares.InfobelscrappingDownloaderMiddleware": 585,
+    "infobelscrapping.middlewares.ResponseArchiveMiddleware": 950,
+    "infobelscrapping.middlewares.SharedRateLimitMiddleware": 960,
+}
+
+# Per-host rate shared with other crawls and the phone agents on this machine
+# (SharedRateLimitMiddleware), through token buckets in SHARED_RATE_LIMIT_DIR.
+# Hosts not in SHARED_RATE_LIMITS get SHARED_RATE_LIMIT_DEFAULT_RATE requests
+# per second, or 1 / DOWNLOAD_DELAY when that is 0
+SHARED_RATE_LIMIT_ENABLED = False
+SHARED_RATE_LIMITS = {
+    # "datoscif.es": 0.5,
+    # "infobel.com": 0.125,
+}
+SHARED_RATE_LIMIT_DEFAULT_RATE = 0
+SHARED_RATE_LIMIT_BURST = 1
+#SHARED_RATE_LIMIT_DIR = "/tmp/infobel-rate-limits"
+
+# Record/replay of raw responses (ResponseArchiveMiddleware): 'record' archives
+# every response of a live crawl, 'replay' serves the crawl from the archive
+# without network access. Off by default; see replay_bench.py
+RESPONSE_ARCHIVE_MODE = None
+#RESPONSE_ARCHIVE_FILE = "archives/datoscif.zip"  # defaults to archives/<spider>.zip
+
+# Block-aware throttling (InfobelscrappingDownloaderMiddleware). On a block
+# signal (403/429, Abuse redirect, captcha marker) the per-domain delay is
+# multiplied by BLOCK_THROTTLE_BACKOFF, concurrency is halved and the request
+# is retried; every BLOCK_THROTTLE_RECOVERY_AFTER clean responses the delay is
+# multiplied by BLOCK_THROTTLE_RECOVERY and concurrency grows by one.
+# Off by default: it can speed a crawl up towards BLOCK_THROTTLE_MIN_DELAY,
+# so it is only enabled for the infobel spider (see its custom_settings),
+# whose blocking it was built for; datoscif keeps its fixed DOWNLOAD_DELAY
+BLOCK_THROTTLE_ENABLED = False
+#BLOCK_THROTTLE_START_DELAY = 2  # defaults to DOWNLOAD_DELAY
+BLOCK_THROTTLE_MIN_DELAY = 0.5
+BLOCK_THROTTLE_MAX_DELAY = 120
+BLOCK_THROTTLE_BACKOFF = 2.0
+BLOCK_THROTTLE_RECOVERY = 0.9
+BLOCK_THROTTLE_RECOVERY_AFTER = 10
+BLOCK_THROTTLE_MAX_RETRIES = 3
+#BLOCK_THROTTLE_MAX_CONCURRENCY = 4  # defaults to CONCURRENT_REQUESTS_PER_DOMAIN
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "infobelscrapping.extensions.CrawlBenchmark": 500,
+    "infobelscrapping.extensions.CrawlProfiler": 510,
+    "infobelscrapping.extensions.CrawlCheckpoint": 520,
+    "infobelscrapping.extensions.EventLogWriter": 530,
+}
+
+# Throughput report (CrawlBenchmark extension and PipelineTimerPipeline):
+# pages/sec, items/sec, pipeline time and peak memory, written to BENCHMARK_FILE
+BENCHMARK_ENABLED = False
+#BENCHMARK_FILE = "benchmark.json"
+
+# Sampling profiler of the crawl: per-stage (fetch, parse, pipelines,
+# extraction) CPU samples written as <prefix>.folded (flamegraph.pl,
+# speedscope) and a top-N summary <prefix>.json, next to STATS_FILE unless
+# PROFILE_OUTPUT is set. PROFILE_MEMORY_INTERVAL > 0 adds tracemalloc
+# snapshots every that many seconds (slows the crawl down noticeably)
+PROFILE_ENABLED = False
+PROFILE_INTERVAL = 0.005
+PROFILE_MEMORY_INTERVAL = 0
+PROFILE_TOP_N = 25
+#PROFILE_OUTPUT = "scraping_stats_profile"
+
+# Pause/resume: with -s JOBDIR=crawls/<name>, CrawlCheckpoint saves the
+# spider and pipeline state (duplicate set, stats counters, current page,
+# category budgets) next to Scrapy's persisted request queue when the crawl
+# is stopped, and restores it on the next run with the same JOBDIR
+CHECKPOINT_ENABLED = True
+
+# Structured events (one per parsed page, block signal and phone search):
+# EventLogWriter sets the level of the loggers that emit them so disabled
+# events cost one level check, and with EVENT_LOG_FILE writes events at or
+# above EVENT_LOG_LEVEL as JSON Lines from a background thread.
+# EVENT_LOG_SAMPLE_RATES keeps only a share of the named events
+EVENT_LOG_ENABLED = True
+EVENT_LOG_LEVEL = "INFO"
+#EVENT_LOG_FILE = "events.jsonl"
+EVENT_LOG_SAMPLE_RATES = {
+    # "page.parsed": 0.1,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# CompanyItemPipeline cleans, deduplicates, derives the typed fields and
+# counts the stats in one stage; it replaces DataCleaningPipeline (300),
+# TypedFieldsPipeline (350), DuplicatesPipeline (400) and StatsPipeline (500),
+# which still work as separate stages. Compare with: python pipeline_bench.py
 ITEM_PIPELINES = {
-    "infobelscrapping.pipelines.DataCleaningPipeline": 300,
-    "infobelscrapping.pipelines.DuplicatesPipeline": 400,
-    "infobelscrapping.pipelines.StatsPipeline": 500,
+    "infobelscrapping.pipelines.PipelineTimerPipeline": 10,
+    "infobelscrapping.pipelines.CompanyItemPipeline": 300,
+    "infobelscrapping.pipelines.PhoneEnrichmentPipeline": 450,
+}
+
+# Phone enrichment during the crawl (PhoneEnrichmentPipeline). Disabled by
+# default; enable with -s PHONE_ENRICHMENT_ENABLED=1. Searches run on their own
+# download slot, PHONE_ENRICHMENT_CONCURRENCY companies at a time. Searches in
+# flight count against CONCURRENT_REQUESTS, so with datoscif (1) the crawl
+# waits for them; to overlap both, raise it for that run:
+#   scrapy crawl datoscif -s PHONE_ENRICHMENT_ENABLED=1 -s CONCURRENT_REQUESTS=5
+PHONE_ENRICHMENT_ENABLED = False
+PHONE_ENRICHMENT_CONCURRENCY = 4
+PHONE_ENRICHMENT_MAX_QUERIES = 5
+# JSON file of exits (proxies / source addresses, header profiles, rates) the
+# searches are spread over; see egress_pool.py. Unset: one direct exit
+#PHONE_ENRICHMENT_EGRESS_POOL = "../egress_pool.json"
+# Directory of the search page archive shared with enhanced_phone_agent.py
+# --archive, so extraction improvements can be re-applied with --reextract
+#PHONE_ENRICHMENT_ARCHIVE = "../search_archive"
+
+# Scraping statistics written by CompanyItemPipeline (or StatsPipeline). The
+# summary file is rewritten every STATS_FLUSH_INTERVAL seconds (0 disables
+# periodic flushing) and each flush appends a line to the timeline file
+STATS_FILE = "scraping_stats.json"
+STATS_TIMELINE_FILE = "scraping_stats_timeline.jsonl"
+STATS_FLUSH_INTERVAL = 60
+
+# Where the infobel spider persists the winning selector per domain and page role.
+# SELECTOR_CACHE_ENABLED = False scans every candidate list on every page
+# (for comparing parse times with replay_bench.py)
+SELECTOR_PROFILE_FILE = "selector_profiles.json"
+SELECTOR_CACHE_ENABLED = True
+
+# infobel category frontier: one crawl covers many categories under the
+# spider's single polite request rate. Categories are discovered from the
+# category index; INFOBEL_CATEGORIES restricts the crawl to the listed ones
+# and sets their weight (share of requests) and budget (max requests, detail
+# pages and subcategories included). Empty means every category with the
+# defaults below. INFOBEL_FRONTIER_MODE is "weighted" or "round_robin".
+# Override per run with -a categories=a,b and -a mode=round_robin
+INFOBEL_CATEGORIES = {
+    # "alimentacion_hosteleria": {"weight": 3, "budget": 2000},
+    # "construccion": {"weight": 1, "budget": 500},
 }
+INFOBEL_FRONTIER_MODE = "weighted"
+INFOBEL_CATEGORY_WEIGHT = 1
+INFOBEL_CATEGORY_BUDGET = 0  # 0 = unlimited
+INFOBEL_REQUEST_BUDGET = 0  # whole crawl, 0 = unlimited
+
+# infobel click-to-reveal phones are decoded from the page itself. Payloads
+# that do not decode can be looked up INFOBEL_PHONE_RESOLVE_BATCH at a time
+# (deduplicated) through INFOBEL_PHONE_RESOLVE_URL, whose {tokens} is replaced
+# by the comma-separated payloads and which must answer {token: phone} JSON.
+# Unset: such companies keep "Phone available (encrypted)"
+#INFOBEL_PHONE_RESOLVE_URL = "https://www.infobel.com/.../phones?ids={tokens}"
+INFOBEL_PHONE_RESOLVE_BATCH = 20
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -0,0 +1,100 @@
+# Rate limiter shared by every process on the machine
+#
+# DOWNLOAD_DELAY and the agents' search_delay pace one process; two crawls or
+# agents against the same host together send twice the rate the host
+# tolerates. SharedRateLimiter keeps one token bucket per key (a target host,
+# optionally per egress exit) in a small file under a common directory.
+# Processes take an exclusive flock on the file, read the bucket, book the
+# next slot and write it back, so the host sees one combined rate however
+# many processes run.
+#
+# The bucket is stored as a GCRA "theoretical arrival time" (a single double),
+# which behaves like a token bucket of `burst` tokens refilled at `rate` per
+# second. Kept free of Scrapy imports so the agents and the
+# SharedRateLimitMiddleware use the same buckets.
+
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): buckets are still honoured within this process
+    fcntl = None
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), 'infobel-rate-limits')
+
+BUCKET_FORMAT = struct.Struct('d')
+
+
+def host_key(url, exit_name=None):
+    """Bucket key of a URL: its host without "www.", plus the egress exit if any"""
+    host = (urlsplit(url).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return f'{host}@{exit_name}' if exit_name else host
+
+
+class SharedRateLimiter:
+    """Token buckets per key, shared between processes through locked files"""
+
+    key = staticmethod(host_key)
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.files = {}
+        # flock does not exclude threads sharing a file descriptor
+        self.lock = threading.Lock()
+
+    def bucket_fd(self, key):
+        fd = self.files.get(key)
+        if fd is None:
+            filename = re.sub(r'[^\w.@-]', '_', key) + '.bucket'
+            fd = os.open(os.path.join(self.directory, filename), os.O_RDWR | os.O_CREAT, 0o666)
+            self.files[key] = fd
+        return fd
+
+    def reserve(self, key, rate, burst=1):
+        """Book the next slot of key's bucket; returns the seconds to wait before sending
+
+        ``rate`` is in requests per second, shared by all processes using
+        the same key. A rate of 0 means unlimited.
+        """
+        if not rate:
+            return 0.0
+        with self.lock:
+            fd = self.bucket_fd(key)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                data = os.read(fd, BUCKET_FORMAT.size)
+                tat = BUCKET_FORMAT.unpack(data)[0] if len(data) == BUCKET_FORMAT.size else 0.0
+                # Wall clock, the only clock every process agrees on
+                now = time.time()
+                start = max(now, tat - (burst - 1) / rate)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, BUCKET_FORMAT.pack(max(tat, now) + 1 / rate))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        return start - now
+
+    def wait(self, key, rate, burst=1):
+        """reserve() and sleep until the booked slot"""
+        delay = self.reserve(key, rate, burst)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def close(self):
+        with self.lock:
+            for fd in self.files.values():
+                os.close(fd)
+            self.files = {}
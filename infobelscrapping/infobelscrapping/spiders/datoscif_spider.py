@@ -1,5 +1,7 @@
 import scrapy
-from infobelscrapping.items import DatoscifscrappingItem
+from functools import cached_property
+from infobelscrapping.event_log import EventLog
+from infobelscrapping.items import CompanyRecord
 import re
 
 
@@ -16,13 +18,36 @@ class DatoscifSpider(scrapy.Spider):
         'ROBOTSTXT_OBEY': True,
         'COOKIES_ENABLED': True,
     }
+    
+    # Highest listing page parsed so far, saved by CrawlCheckpoint under JOBDIR
+    last_page = 0
+    pages_parsed = 0
+
+    @cached_property
+    def events(self):
+        return EventLog(self.logger)
+
+    def start_requests(self):
+        if not self.last_page:
+            yield from super().start_requests()
+            return
+        # Resumed: page 1 was already parsed. Re-request the page after the
+        # last one parsed, in case the queued request was lost with the
+        # in-flight ones; a duplicate download only costs dropped duplicates
+        self.logger.info(f"Resuming after page {self.last_page} ({self.pages_parsed} pages parsed)")
+        yield scrapy.Request(f'{self.start_urls[0]}{self.last_page + 1}', self.parse, dont_filter=True)
+
+    def checkpoint_state(self):
+        return {'last_page': self.last_page, 'pages_parsed': self.pages_parsed}
+
+    def restore_checkpoint(self, state):
+        self.last_page = state['last_page']
+        self.pages_parsed = state['pages_parsed']
 
     def parse(self, response):
-        self.logger.info(f"Processing page: {response.url}")
-        
         # Extract company blocks using the correct selector
         company_blocks = response.css('div.bloq-empr-nueva')
-        self.logger.info(f"Found {len(company_blocks)} company blocks")
+        items = 0
         
         for block in company_blocks:
             company_data = {}
@@ -68,11 +93,15 @@ class DatoscifSpider(scrapy.Spider):
             # Yield the item if we have a company name
             if company_data.get('company_name'):
                 item = self.create_company_item(company_data, response.url)
+                items += 1
                 yield item
         
         # Handle pagination - follow all pagination links systematically
         current_page_num = self.extract_page_number(response.url)
-        self.logger.info(f"Current page: {current_page_num}")
+        self.events.info('page.parsed', url=response.url, page=current_page_num,
+                         blocks=len(company_blocks), items=items)
+        self.last_page = max(self.last_page, current_page_num)
+        self.pages_parsed += 1
         
         # Find all pagination links on the page
         pagination_links = response.css('a[href*="empresas-creadas-hoy-en-espana"]')
@@ -90,7 +119,7 @@ class DatoscifSpider(scrapy.Spider):
                 
                 # Follow next sequential page (current + 1)
                 if target_page == current_page_num + 1:
-                    self.logger.info(f"Following next page {target_page}: {href}")
+                    self.events.debug('page.followed', page=target_page, url=href)
                     yield response.follow(href, self.parse)
                     break
                 
@@ -104,7 +133,7 @@ class DatoscifSpider(scrapy.Spider):
                 # Sort by page number and take the lowest
                 next_pages_found.sort(key=lambda x: x[0])
                 target_page, href = next_pages_found[0]
-                self.logger.info(f"Following available page {target_page}: {href}")
+                self.events.debug('page.followed', page=target_page, url=href, skipped=True)
                 yield response.follow(href, self.parse)
 
     def parse_text_patterns(self, response):
@@ -202,15 +231,4 @@ class DatoscifSpider(scrapy.Spider):
         return 1
 
     def create_company_item(self, company_data, source_url):
-        item = DatoscifscrappingItem()
-        item['company_name'] = company_data.get('company_name', '')
-        item['start_date'] = company_data.get('start_date', '')
-        item['social_capital'] = company_data.get('social_capital', '')
-        item['coordinates'] = company_data.get('coordinates', '')
-        item['address'] = company_data.get('address', '')
-        item['postal_code'] = company_data.get('postal_code', '')
-        item['municipality'] = company_data.get('municipality', '')
-        item['province'] = company_data.get('province', '')
-        item['business_purpose'] = company_data.get('business_purpose', '')
-        item['url'] = company_data.get('url', source_url)
-        return item
\ No newline at end of file
+        return CompanyRecord.from_company_data(company_data, source_url)
@@ -1,12 +1,173 @@
+import json
 import scrapy
-from infobelscrapping.items import DatoscifscrappingItem
+from functools import cached_property
+from infobelscrapping.event_log import EventLog
+from infobelscrapping.frontier import CategoryFrontier, category_from_url
+from infobelscrapping.items import InfobelItem
+from infobelscrapping.phone_payload import ENCRYPTED_PHONE, PhoneResolveBatch, decode_reveal_button
+from infobelscrapping.selector_cache import SelectorProfileCache
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from urllib.parse import quote, urlparse
+from w3lib.url import canonicalize_url
 import re
 
 
+PHONE_RE = re.compile(r'(\+34\s?\d{9}|\d{9})')
+
+CATEGORY_INDEX_URL = 'https://www.infobel.com/es/spain/business'
+# Seed used when the category index yields nothing (layout change, block)
+DEFAULT_CATEGORY_URL = 'https://www.infobel.com/es/spain/business/10000/alimentacion_hosteleria'
+# Click-to-reveal phone buttons, whose payload phone_payload decodes
+REVEAL_PHONE_SELECTOR = '[onclick*="phone"], [onclick*="Phone"], [data-phone]'
+# Phone lookups go ahead of every frontier request: finished items wait on them
+PHONE_LOOKUP_PRIORITY = 10 ** 9
+
+
 class InfobelSpider(scrapy.Spider):
     name = 'infobel'
     allowed_domains = ['infobel.com']
     
+    # Detail pages are only worth a request when the listing had no phone;
+    # those jump this many turns ahead of their category's pagination so the
+    # small request budget goes to pages that add data
+    DETAIL_PRIORITY = 10
+    
+    # Candidate selectors, tried in order; the winner per domain is remembered
+    # by the selector profile cache and tried first on later pages
+    container_selectors = [
+        'div.listing-item',
+        'div[class*="company"]',
+        'div[class*="business"]', 
+        'div[class*="result"]',
+        'div[id*="listing"]',
+        '.search-result',
+        'tr[class*="result"]'
+    ]
+    name_selectors = ['h3 a::text', 'h2 a::text', 'a.title::text', '.name::text', 'a::text']
+    # Last-resort candidates that match on almost any page; never remembered
+    catch_all_selectors = ('a::text',)
+    next_page_selectors = [
+        'a[rel="next"]::attr(href)',
+        'a.next::attr(href)',
+        'a[class*="next"]::attr(href)',
+        'a[href*="page"]:contains("Next")::attr(href)',
+        'a[href*="/business/"]:contains("›")::attr(href)'
+    ]
+    address_selectors = [
+        'span[itemprop="streetAddress"]::text',
+        'div[class*="address"]::text',
+        'span[class*="address"]::text',
+        'div[class*="location"]::text',
+        'div[class*="addr"]::text'
+    ]
+    phone_selectors = [
+        'span[itemprop="telephone"]::text',
+        'div[class*="phone"]::text',
+        'span[class*="phone"]::text',
+        'div[class*="tel"]::text',
+        'a[href^="tel:"]::text'
+    ]
+    
+    def __init__(self, categories=None, mode=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # -a categories=alimentacion_hosteleria,construccion narrows the crawl
+        # to those categories; -a mode=round_robin ignores the weights
+        self.category_args = [c.strip() for c in categories.split(',') if c.strip()] if categories else []
+        self.mode_arg = mode
+    
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        # Stats are bound in spider_opened: Scrapy creates the collector after the spider
+        spider.selector_cache = SelectorProfileCache(
+            settings.get('SELECTOR_PROFILE_FILE', 'selector_profiles.json'),
+            catch_all=cls.catch_all_selectors,
+            enabled=settings.getbool('SELECTOR_CACHE_ENABLED', True),
+        )
+        categories = settings.getdict('INFOBEL_CATEGORIES')
+        if spider.category_args:
+            categories = {slug: categories.get(slug, {}) for slug in spider.category_args}
+        default_budget = settings.getint('INFOBEL_CATEGORY_BUDGET') or None
+        total_budget = settings.getint('INFOBEL_REQUEST_BUDGET') or None
+        spider.frontier = CategoryFrontier(
+            categories,
+            mode=spider.mode_arg or settings.get('INFOBEL_FRONTIER_MODE', 'weighted'),
+            default_weight=settings.getfloat('INFOBEL_CATEGORY_WEIGHT', 1),
+            default_budget=default_budget,
+            total_budget=total_budget,
+        )
+        spider.scheduled_urls = set()
+        # Ids of the top-level categories, so the category menu repeated on
+        # listing pages is not mistaken for subcategories
+        spider.top_level_ids = set()
+        # Reveal-button payloads that do not decode in the page are looked up
+        # INFOBEL_PHONE_RESOLVE_BATCH at a time when a lookup URL is configured
+        spider.phone_resolve_url = settings.get('INFOBEL_PHONE_RESOLVE_URL')
+        spider.phone_batch = None
+        if spider.phone_resolve_url:
+            spider.phone_batch = PhoneResolveBatch(settings.getint('INFOBEL_PHONE_RESOLVE_BATCH', 20))
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.spider_opened, signal=signals.spider_opened)
+        return spider
+    
+    def spider_opened(self, spider):
+        # crawler.stats is still None in from_crawler (Scrapy 2.13 creates the
+        # collector after the spider), so the components get it here
+        for component in (self.selector_cache, self.frontier, self.phone_batch):
+            if component is not None:
+                component.stats = self.crawler.stats
+    
+    def schedule(self, response, url, callback, group, boost=0, **kwargs):
+        """Follow url once per crawl, keyed by its canonical form, charged to a category
+
+        Returns None for URLs already scheduled and when the frontier refuses
+        the request because ``group`` or the crawl spent its budget.
+        """
+        canonical = canonicalize_url(response.urljoin(url))
+        if canonical in self.scheduled_urls:
+            self.crawler.stats.inc_value('scheduler/canonical_duplicates')
+            return None
+        priority = self.frontier.next_priority(group, boost)
+        if priority is None:
+            return None
+        self.scheduled_urls.add(canonical)
+        return response.follow(canonical, callback, priority=priority, **kwargs)
+    
+    def is_scheduled(self, response, url):
+        return canonicalize_url(response.urljoin(url)) in self.scheduled_urls
+    
+    def schedule_category(self, response, url, slug, group):
+        meta = {'category': slug, 'group': group}
+        return self.schedule(response, url, self.parse, group, meta=meta, headers={'Referer': response.url})
+    
+    def checkpoint_state(self):
+        return {
+            'frontier': self.frontier.state(),
+            'scheduled_urls': self.scheduled_urls,
+            'top_level_ids': self.top_level_ids,
+            'phone_batch': self.phone_batch.state() if self.phone_batch is not None else None,
+        }
+    
+    def restore_checkpoint(self, state):
+        # Pending requests come back from the JOBDIR queue; this keeps budgets
+        # and the canonical-URL filter where the paused crawl left them
+        self.frontier.restore(state['frontier'])
+        self.scheduled_urls = set(state['scheduled_urls'])
+        self.top_level_ids = set(state['top_level_ids'])
+        if self.phone_batch is not None and state.get('phone_batch'):
+            self.phone_batch.restore(state['phone_batch'])
+    
+    @cached_property
+    def events(self):
+        return EventLog(self.logger)
+    
+    def closed(self, reason):
+        self.selector_cache.save()
+        self.logger.info(f"Selector hit rates: {self.selector_cache.hit_rates()}")
+        self.logger.info(f"Requests per category: {self.frontier.summary()}")
+    
     def start_requests(self):
         # Try starting with the home page first
         yield scrapy.Request(
@@ -18,93 +179,116 @@ class InfobelSpider(scrapy.Spider):
         )
     
     def parse_home(self, response):
-        # Wait a bit then go to the category page
+        # Then the category index, the root of the category tree
         yield scrapy.Request(
-            url='https://www.infobel.com/es/spain/business/10000/alimentacion_hosteleria',
-            callback=self.parse,
+            url=CATEGORY_INDEX_URL,
+            callback=self.parse_categories,
             headers={
                 'Referer': response.url
             },
             dont_filter=True
         )
     
+    def parse_categories(self, response):
+        """Queue the listing of every top-level category the frontier accepts"""
+        found = {}
+        for href in response.css('a[href*="/business/"]::attr(href)').getall():
+            category = category_from_url(href)
+            if category and category[1] not in found:
+                found[category[1]] = (category[0], href)
+        if not found:
+            self.logger.warning(f"No categories found on {response.url}, falling back to the default category")
+            category_id, slug = category_from_url(DEFAULT_CATEGORY_URL)
+            found[slug] = (category_id, DEFAULT_CATEGORY_URL)
+        self.logger.info(f"Found {len(found)} top-level categories")
+        
+        for slug, (category_id, href) in found.items():
+            self.top_level_ids.add(category_id)
+            if not self.frontier.accepts(slug):
+                continue
+            request = self.schedule_category(response, href, slug, slug)
+            if request:
+                yield request
+    
     custom_settings = {
         'DOWNLOAD_DELAY': 8,
         'RANDOMIZE_DOWNLOAD_DELAY': True,
-        'CONCURRENT_REQUESTS': 1,
+        'CONCURRENT_REQUESTS': 4,
         'CONCURRENT_REQUESTS_PER_DOMAIN': 1,
         'ROBOTSTXT_OBEY': False,
         'COOKIES_ENABLED': True,
+        # Start faster than DOWNLOAD_DELAY and let the block-aware throttle
+        # back off towards it (and beyond) when infobel starts blocking
+        'BLOCK_THROTTLE_ENABLED': True,
+        'BLOCK_THROTTLE_START_DELAY': 2,
+        'BLOCK_THROTTLE_MIN_DELAY': 1,
+        'BLOCK_THROTTLE_MAX_CONCURRENCY': 4,
     }
 
     def parse(self, response):
         # Check if we got redirected to abuse page
         if 'Abuse' in response.url:
-            self.logger.error("Got redirected to abuse page - anti-bot protection detected")
+            self.events.warning('page.blocked', url=response.url, status=response.status)
             return
         
-        self.logger.info(f"Processing page: {response.url}")
-        self.logger.info(f"Page title: {response.css('title::text').get()}")
-        
-        # Extract category from URL
-        category = 'alimentacion_hosteleria'  # Default for this spider
-        
-        # Look for different types of company listings
-        company_containers = []
-        
-        # Try various selectors for company listings
-        selectors_to_try = [
-            'div.listing-item',
-            'div[class*="company"]',
-            'div[class*="business"]', 
-            'div[class*="result"]',
-            'div[id*="listing"]',
-            '.search-result',
-            'tr[class*="result"]'
-        ]
-        
-        for selector in selectors_to_try:
-            containers = response.css(selector)
-            if containers:
-                company_containers = containers
-                self.logger.info(f"Found {len(containers)} companies using selector: {selector}")
-                break
+        # The listing's own category; budgets are charged to its top-level group
+        category = response.meta.get('category')
+        if not category:
+            parsed = category_from_url(response.url)
+            category = parsed[1] if parsed else 'unknown'
+        group = response.meta.get('group', category)
+        
+        domain = urlparse(response.url).netloc
+        
+        # Subcategories share their top-level category's weight and budget
+        for href in response.css('a[href*="/business/"]::attr(href)').getall():
+            subcategory = category_from_url(href)
+            if subcategory and subcategory[0] not in self.top_level_ids and subcategory[1] != category:
+                request = self.schedule_category(response, href, subcategory[1], group)
+                if request:
+                    yield request
+        
+        # Look for company listings, trying the remembered container selector first
+        selector, company_containers = self.selector_cache.first_match(
+            domain, 'listing/container', self.container_selectors, response.css
+        )
         
         if not company_containers:
-            # Fallback: look for any links that might be companies
-            all_links = response.css('a')
-            self.logger.info(f"No company containers found. Total links on page: {len(all_links)}")
-            
-            # Look for business-related links
+            # Fallback: look for business-related links that might be companies
             business_links = response.css('a[href*="/business/"], a[href*="/company/"], a[href*="/empresas/"]')
-            self.logger.info(f"Found {len(business_links)} potential business links")
+            self.events.info('page.parsed', url=response.url, category=category, group=group,
+                             containers=0, business_links=len(business_links))
             
             for link in business_links[:5]:  # Limit to first 5 for testing
                 name = link.css('::text').get()
                 href = link.css('::attr(href)').get()
                 
                 if name and name.strip() and href:
-                    item = DatoscifscrappingItem()
+                    item = InfobelItem()
                     item['name'] = name.strip()
                     item['category'] = category
-                    item['address'] = 'Address to be extracted'
-                    item['phone'] = 'Phone to be extracted'
                     item['link'] = response.urljoin(href)
                     
-                    # Follow the link to get details
-                    yield response.follow(href, self.parse_company_detail, meta={'item': item})
+                    # The listing has no phone for these, so follow the link to get details
+                    request = self.schedule(
+                        response, href, self.parse_company_detail, group,
+                        boost=self.DETAIL_PRIORITY, meta={'item': item}
+                    )
+                    if request:
+                        yield request
         else:
+            self.events.info('page.parsed', url=response.url, category=category, group=group,
+                             containers=len(company_containers), selector=selector)
+            
             # Process company containers
             for container in company_containers:
-                item = DatoscifscrappingItem()
+                item = InfobelItem()
                 
                 # Extract name
-                name_selectors = ['h3 a::text', 'h2 a::text', 'a.title::text', '.name::text', 'a::text']
-                name = None
-                for name_sel in name_selectors:
-                    name = container.css(name_sel).get()
-                    if name:
-                        break
+                _, name = self.selector_cache.first_match(
+                    domain, 'listing/name', self.name_selectors,
+                    lambda sel: container.css(sel).get()
+                )
                 
                 if name:
                     item['name'] = name.strip()
@@ -114,50 +298,56 @@ class InfobelSpider(scrapy.Spider):
                     address_text = ' '.join(container.css('::text').getall())
                     item['address'] = ' '.join(address_text.split())
                     
-                    # Extract phone if available
+                    # Extract phone if available, decoding a reveal button before paying for the detail page
                     phone = container.css('*[class*="phone"]::text, *[class*="tel"]::text').get()
+                    if not phone:
+                        phone, _ = self.reveal_phone(container.css(REVEAL_PHONE_SELECTOR))
                     item['phone'] = phone.strip() if phone else 'Not available'
                     
                     # Get link
                     link_elem = container.css('a::attr(href)').get()
                     item['link'] = response.urljoin(link_elem) if link_elem else response.url
                     
+                    # Only spend a detail request when the listing lacked a phone
+                    if not phone and link_elem:
+                        request = self.schedule(
+                            response, link_elem, self.parse_company_detail, group,
+                            boost=self.DETAIL_PRIORITY, meta={'item': item}
+                        )
+                        if request:
+                            yield request
+                            continue
+                        # Already queued from another listing: that detail page yields the company
+                        if self.is_scheduled(response, link_elem):
+                            continue
+                    
+                    # No detail page (or no budget left for one): keep what the listing has
                     yield item
         
         # Look for pagination
-        next_page_selectors = [
-            'a[rel="next"]::attr(href)',
-            'a.next::attr(href)',
-            'a[class*="next"]::attr(href)',
-            'a[href*="page"]:contains("Next")::attr(href)',
-            'a[href*="alimentacion_hosteleria"]:contains("›")::attr(href)'
-        ]
-        
-        for selector in next_page_selectors:
-            next_page = response.css(selector).get()
-            if next_page:
-                yield response.follow(next_page, self.parse)
+        _, next_page = self.selector_cache.first_match(
+            domain, 'listing/next_page', self.next_page_selectors,
+            lambda sel: response.css(sel).get()
+        )
+        if next_page:
+            request = self.schedule(
+                response, next_page, self.parse, group,
+                meta={'category': category, 'group': group}
+            )
+            if request:
+                yield request
     
     def parse_company_detail(self, response):
         item = response.meta['item']
         
-        # Extract address - try multiple selectors
-        address = None
-        
-        # Try different address selectors
-        address_selectors = [
-            'span[itemprop="streetAddress"]::text',
-            'div[class*="address"]::text',
-            'span[class*="address"]::text',
-            'div[class*="location"]::text',
-            'div[class*="addr"]::text'
-        ]
+        domain = urlparse(response.url).netloc
         
-        for selector in address_selectors:
-            address_parts = response.css(selector).getall()
-            if address_parts:
-                address = ' '.join([part.strip() for part in address_parts if part.strip()])
-                break
+        # Extract address - remembered selector first, then the full list
+        _, address_parts = self.selector_cache.first_match(
+            domain, 'detail/address', self.address_selectors,
+            lambda sel: response.css(sel).getall()
+        )
+        address = ' '.join([part.strip() for part in address_parts or [] if part.strip()])
         
         if not address:
             # Fallback: look for text near location icons
@@ -165,25 +355,14 @@ class InfobelSpider(scrapy.Spider):
             if location_text:
                 address = ' '.join([text.strip() for text in location_text if text.strip()])
         
-        item['address'] = address or 'No address found'
-        
-        # Extract phone - try multiple approaches
-        phone = None
-        
-        # Try different phone selectors
-        phone_selectors = [
-            'span[itemprop="telephone"]::text',
-            'div[class*="phone"]::text',
-            'span[class*="phone"]::text',
-            'div[class*="tel"]::text',
-            'a[href^="tel:"]::text'
-        ]
+        item['address'] = address or item.get('address') or 'No address found'
         
-        for selector in phone_selectors:
-            phone_elem = response.css(selector).get()
-            if phone_elem:
-                phone = phone_elem.strip()
-                break
+        # Extract phone - remembered selector first, then the full list
+        _, phone = self.selector_cache.first_match(
+            domain, 'detail/phone', self.phone_selectors,
+            lambda sel: response.css(sel).get()
+        )
+        phone = phone.strip() if phone else None
         
         # Try to find phone in JavaScript or onclick handlers
         if not phone:
@@ -191,18 +370,78 @@ class InfobelSpider(scrapy.Spider):
             for script in phone_scripts:
                 if 'phone' in script.lower() or 'tel' in script.lower():
                     # Extract phone patterns
-                    phone_patterns = re.findall(r'(\+34\s?\d{9}|\d{9})', script)
+                    phone_patterns = PHONE_RE.findall(script)
                     if phone_patterns:
                         phone = phone_patterns[0]
                         break
         
-        # Try onclick handlers for encrypted phones
+        item['link'] = response.url
+        
+        # Click-to-reveal phones: decode the payload in the page, else queue it
+        # for one batched lookup shared with other companies
         if not phone:
-            onclick_elements = response.css('[onclick*="phone"], [onclick*="displayPhone"]')
-            if onclick_elements:
-                phone = 'Phone available (encrypted)'
+            buttons = response.css(REVEAL_PHONE_SELECTOR)
+            if buttons:
+                phone, token = self.reveal_phone(buttons)
+                if not phone and token and self.phone_batch is not None:
+                    if self.phone_batch.add(token, item):
+                        if self.phone_batch.ready():
+                            yield self.phone_batch_request()
+                        return
+                    phone = self.phone_batch.resolved[token]
+                phone = phone or ENCRYPTED_PHONE
         
         item['phone'] = phone or 'No phone found'
-        item['link'] = response.url
         
-        yield item
\ No newline at end of file
+        yield item
+    
+    def reveal_phone(self, buttons):
+        """(phone, token) of the first reveal button that decodes, else the first token found"""
+        if not buttons:
+            return None, None
+        first_token = None
+        for button in buttons:
+            phone, token = decode_reveal_button(button.attrib.get('onclick'), button.attrib)
+            if phone:
+                self.crawler.stats.inc_value('phone_payload/decoded')
+                return phone, None
+            first_token = first_token or token
+        self.crawler.stats.inc_value('phone_payload/undecoded')
+        return None, first_token
+    
+    def phone_batch_request(self):
+        tokens = self.phone_batch.take()
+        return scrapy.Request(
+            self.phone_resolve_url.format(tokens=quote(','.join(tokens))),
+            callback=self.parse_phone_batch,
+            errback=self.phone_batch_failed,
+            cb_kwargs={'tokens': tokens},
+            priority=PHONE_LOOKUP_PRIORITY,
+            dont_filter=True,
+        )
+    
+    def parse_phone_batch(self, response, tokens):
+        """Yield the items waiting on a lookup; the answer is a JSON object {token: phone}"""
+        try:
+            phones = json.loads(response.text)
+        except ValueError:
+            phones = None
+        if not isinstance(phones, dict):
+            self.logger.warning(f"Unexpected phone lookup answer from {response.url}")
+            phones = {}
+        for item, phone in self.phone_batch.resolve(tokens, phones):
+            item['phone'] = phone or ENCRYPTED_PHONE
+            yield item
+    
+    def phone_batch_failed(self, failure):
+        tokens = failure.request.cb_kwargs['tokens']
+        self.logger.warning(f"Phone lookup failed for {len(tokens)} companies: {failure.value}")
+        for item, _ in self.phone_batch.resolve(tokens, {}):
+            item['phone'] = ENCRYPTED_PHONE
+            yield item
+    
+    def spider_idle(self):
+        # Send the last, partial batch before the crawl closes
+        if self.phone_batch.unsent():
+            self.crawler.engine.crawl(self.phone_batch_request())
+            raise DontCloseSpider
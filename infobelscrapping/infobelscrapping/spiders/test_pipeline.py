@@ -1,13 +1,13 @@
 import scrapy
-from infobelscrapping.items import DatoscifscrappingItem
+from infobelscrapping.items import CompanyRecord, InfobelItem
 
 
 class TestPipelineSpider(scrapy.Spider):
     name = 'test_pipeline'
     
     def start_requests(self):
-        # Generate test requests (no actual HTTP calls)
-        yield scrapy.Request('http://example.com', self.parse, dont_filter=True)
+        # A data: URL, answered without any HTTP call
+        yield scrapy.Request('data:,', self.parse, dont_filter=True)
     
     def parse(self, response):
         # Create test data to validate pipeline
@@ -62,8 +62,15 @@ class TestPipelineSpider(scrapy.Spider):
             }
         ]
         
+        # Built like the datoscif spider's items, for CompanyItemPipeline
         for company_data in test_companies:
-            item = DatoscifscrappingItem()
-            for key, value in company_data.items():
-                item[key] = value
-            yield item
\ No newline at end of file
+            yield CompanyRecord.from_company_data(company_data, response.url)
+        
+        # Infobel items keep the company name in 'name', not 'company_name'
+        item = InfobelItem()
+        item['name'] = '  Bar Pepe  '
+        item['category'] = 'alimentacion_hosteleria'
+        item['address'] = 'Calle Mayor 1,  28013 Madrid'
+        item['phone'] = '+34915555123'
+        item['link'] = 'https://www.infobel.com/es/spain/bar_pepe/madrid/ESP123456/businessdetails.aspx'
+        yield item
@@ -2,10 +2,14 @@ import json
 import re
 import time
 import requests
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Union
 from dataclasses import dataclass
 import logging
 
+from company_store import CompanyStore, CompanyView
+from infobelscrapping.infobelscrapping.event_log import EventLog
+from record_io import iter_records
+
 @dataclass
 class Company:
     company_name: str
@@ -26,8 +30,8 @@ class PhoneSearchAgent:
             r'(\d{3}[\s\-]?\d{2}[\s\-]?\d{2}[\s\-]?\d{2})',
         ]
         
-        logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        self.events = EventLog(self.logger)
         
     def extract_phone(self, text: str) -> Optional[str]:
         """Extract phone number from text using regex patterns"""
@@ -41,13 +45,13 @@ class PhoneSearchAgent:
                     return phone
         return None
     
-    def search_company_phone(self, company: Company) -> Optional[str]:
+    def search_company_phone(self, company: Union[Company, CompanyView]) -> Optional[str]:
         """Search for company phone number using web search"""
         search_query = f'"{company.company_name}" {company.municipality} {company.province} teléfono contacto'
         
         try:
             # Using requests to simulate web search (you might want to integrate with actual search APIs)
-            self.logger.info(f"Searching for: {search_query}")
+            self.events.debug('search.query', company=company.company_name, query=search_query)
             
             # Here you would integrate with actual search API like Google Custom Search API
             # For now, this is a placeholder that shows the structure
@@ -62,32 +66,32 @@ class PhoneSearchAgent:
             return None
             
         except Exception as e:
-            self.logger.error(f"Error searching for {company.company_name}: {e}")
+            self.events.warning('search.error', company=company.company_name, error=str(e))
             return None
     
-    def process_companies(self, companies_data: List[Dict]) -> List[Dict]:
-        """Process all companies to find phone numbers"""
+    def process_companies(self, companies_data: Iterable[Dict]) -> List[CompanyView]:
+        """Process all companies to find phone numbers
+        
+        Companies are kept in a CompanyStore and the phone fields are written
+        into its rows, instead of wrapping each one in a Company and copying
+        its dict.
+        """
+        if isinstance(companies_data, CompanyStore):
+            store = companies_data
+        else:
+            store = CompanyStore.from_records(companies_data)
         results = []
         
-        for i, company_data in enumerate(companies_data):
-            company = Company(
-                company_name=company_data['company_name'],
-                address=company_data.get('address', ''),
-                municipality=company_data.get('municipality', ''),
-                province=company_data.get('province', ''),
-                postal_code=company_data.get('postal_code', '')
-            )
-            
-            self.logger.info(f"Processing {i+1}/{len(companies_data)}: {company.company_name}")
-            
+        for i, company in enumerate(store):
+            # Rows expose the same attributes as Company
             phone = self.search_company_phone(company)
             
             # Update company data with phone number
-            updated_company = company_data.copy()
-            updated_company['phone'] = phone
-            updated_company['search_status'] = 'completed' if phone else 'no_phone_found'
+            company['phone'] = phone
+            company['search_status'] = 'completed' if phone else 'no_phone_found'
             
-            results.append(updated_company)
+            results.append(company)
+            self.events.info('company.searched', index=i, company=company.company_name, phone=phone)
             
             # Progress logging
             if (i + 1) % 10 == 0:
@@ -98,16 +102,17 @@ class PhoneSearchAgent:
     def save_results(self, results: List[Dict], output_file: str):
         """Save results to JSON file"""
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+            json.dump([dict(r) for r in results], f, indent=2, ensure_ascii=False)
         self.logger.info(f"Results saved to {output_file}")
 
 def main():
+    logging.basicConfig(level=logging.INFO)
+    
     # Load company data
     input_file = 'infobelscrapping/datoscif_companies_final.json'
     output_file = 'companies_with_phones.json'
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        companies_data = json.load(f)
+    companies_data = CompanyStore.from_records(iter_records(input_file))
     
     # Initialize agent
     agent = PhoneSearchAgent(search_delay=1.0)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Item pipeline micro-benchmark on a synthetic stream of companies
+
+Feeds N synthetic datoscif companies (the real records of
+datoscif_companies_final.json with unique names and urls, plus a share of
+repeats for the duplicate filter) through the item pipelines without a
+crawl, network or reactor, and reports items/sec per chain:
+
+    legacy  DatoscifscrappingItem through DataCleaningPipeline,
+            TypedFieldsPipeline, DuplicatesPipeline and StatsPipeline
+    fused   CompanyRecord through CompanyItemPipeline
+
+Both chains must end with the same items and the same pipeline/ counters;
+the run fails otherwise.
+
+Examples:
+    python pipeline_bench.py                        # both chains, 1,000,000 items
+    python pipeline_bench.py --chain fused --items 200000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from scrapy.exceptions import DropItem
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+SCRAPY_PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'infobelscrapping')
+sys.path.insert(0, SCRAPY_PROJECT_DIR)
+
+from infobelscrapping import pipelines  # noqa: E402
+from infobelscrapping.items import CompanyRecord, DatoscifscrappingItem  # noqa: E402
+
+SOURCE_FILE = os.path.join(SCRAPY_PROJECT_DIR, 'datoscif_companies_final.json')
+SOURCE_URL = 'https://www.datoscif.es/empresas/listado'
+DATOSCIF_FIELDS = ('company_name', 'start_date', 'social_capital', 'coordinates', 'address',
+                   'postal_code', 'municipality', 'province', 'business_purpose')
+
+
+def synthetic_companies(count, duplicate_every=50):
+    """count company dicts as the datoscif spider extracts them; every duplicate_every-th repeats an earlier one"""
+    with open(SOURCE_FILE, encoding='utf-8') as f:
+        base = json.load(f)
+    for i in range(count):
+        if duplicate_every and i and i % duplicate_every == 0:
+            i -= duplicate_every // 2
+        company = dict(base[i % len(base)])
+        company['company_name'] = f"{company['company_name']} {i}"
+        company['address'] = f"  {company['address']}   {i % 97}  "
+        company['url'] = f"{company['url']}-{i}"
+        yield company
+
+
+def legacy_item(company_data, source_url):
+    """The spider's item as built before CompanyRecord: one __setitem__ per field"""
+    item = DatoscifscrappingItem()
+    for field in DATOSCIF_FIELDS:
+        item[field] = company_data.get(field, '')
+    item['url'] = company_data.get('url', source_url)
+    return item
+
+
+def build_chain(name, stats):
+    stats_pipeline = dict(stats_file=os.devnull, timeline_file=None, flush_interval=0)
+    if name == 'legacy':
+        stages = [pipelines.DataCleaningPipeline(), pipelines.TypedFieldsPipeline(),
+                  pipelines.DuplicatesPipeline(), pipelines.StatsPipeline(stats, **stats_pipeline)]
+        return legacy_item, stages
+    return CompanyRecord.from_company_data, [pipelines.CompanyItemPipeline(stats, **stats_pipeline)]
+
+
+def run_chain(name, count):
+    stats = MemoryStatsCollector(SimpleNamespace(settings=Settings()))
+    spider = SimpleNamespace(name='datoscif')
+    make_item, stages = build_chain(name, stats)
+    # Handlers Scrapy would call through the item_scraped / item_dropped signals
+    scraped = [stage.item_scraped for stage in stages if hasattr(stage, 'item_scraped')]
+    dropped = [stage.item_dropped for stage in stages if hasattr(stage, 'item_dropped')]
+    companies = synthetic_companies(count)
+
+    kept = 0
+    elapsed = 0.0
+    perf_counter = time.perf_counter
+    for company in companies:
+        start = perf_counter()
+        item = make_item(company, SOURCE_URL)
+        try:
+            for stage in stages:
+                item = stage.process_item(item, spider)
+        except DropItem as e:
+            for handler in dropped:
+                handler(item, None, e, spider)
+        else:
+            for handler in scraped:
+                handler(item, None, spider)
+            kept += 1
+        elapsed += perf_counter() - start
+    # Counters the fused stage holds back until its next flush
+    start = perf_counter()
+    for stage in stages:
+        if hasattr(stage, 'summary'):
+            stage.summary()
+    elapsed += perf_counter() - start
+
+    counters = {key: value for key, value in stats.get_stats().items() if key.startswith('pipeline/')}
+    return {'chain': name, 'items': count, 'kept': kept, 'seconds': round(elapsed, 3),
+            'items_per_second': round(count / elapsed) if elapsed else 0, 'counters': counters}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Items/sec of the item pipelines on synthetic companies")
+    parser.add_argument('--items', type=int, default=1_000_000)
+    parser.add_argument('--chain', choices=('legacy', 'fused', 'both'), default='both')
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    chains = ('legacy', 'fused') if args.chain == 'both' else (args.chain,)
+    results = []
+    for name in chains:
+        result = run_chain(name, args.items)
+        results.append(result)
+        print(f"{name:7} {result['items']} items, {result['kept']} kept, {result['seconds']}s, "
+              f"{result['items_per_second']} items/sec")
+
+    if len(results) == 2:
+        legacy, fused = results
+        print(f"speedup {fused['items_per_second'] / legacy['items_per_second']:.2f}x")
+        if legacy['counters'] != fused['counters'] or legacy['kept'] != fused['kept']:
+            print("✗ the chains disagree on the pipeline/ counters")
+            sys.exit(1)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump([{key: value for key, value in result.items() if key != 'counters'}
+                       for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+JSON Lines datasets with a memory-mapped offset index
+
+Resuming the phone search at company 300,000 or giving each worker its own
+slice used to mean parsing every record before it. An indexed dataset is a
+plain JSON Lines file (one company per line, readable by every other tool
+here) plus a sidecar `<file>.idx`:
+
+    header   magic, record count, size of the .jsonl it was built from
+    offsets  count + 1 little-endian uint64 byte offsets (the last one is the
+             file size), so record i is the bytes [offsets[i], offsets[i+1])
+    urls     (8-byte hash of the url, ordinal) pairs sorted by hash, for
+             lookups by `url` (infobel `link`) with a binary search
+
+Both files are memory-mapped: opening a dataset reads nothing, record i costs
+one slice and one json.loads, and a url lookup about log2(n) probes.
+`splits(n)` cuts the dataset into n ordinal ranges of about the same number
+of bytes, each with its byte range, for parallel workers.
+
+Examples:
+    python record_index.py convert infobelscrapping/datoscif_companies_final.json companies.jsonl
+    python record_index.py index companies.jsonl            # index an existing JSON Lines file
+    python record_index.py get companies.jsonl 300000
+    python record_index.py get companies.jsonl --url https://www.datoscif.es/empresa/...
+    python record_index.py splits companies.jsonl 8
+    python enhanced_phone_agent.py --input companies.jsonl --start 300000
+    python enhanced_phone_agent.py --input companies.jsonl --split 3/8 --output phones_3.json
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from record_io import iter_records
+
+INDEX_SUFFIX = '.idx'
+MAGIC = b'JLIDX001'
+# magic, record count, url entries, indexed data size
+HEADER = struct.Struct('<8sQQQ')
+OFFSET = struct.Struct('<Q')
+URL_ENTRY = struct.Struct('<QQ')
+
+
+def record_url(record: Dict) -> Optional[str]:
+    """The key records are looked up by: url, or link for infobel records"""
+    return record.get('url') or record.get('link')
+
+
+def url_hash(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def has_index(path: str) -> bool:
+    return os.path.exists(index_path(path))
+
+
+def write_index(path: str, offsets: List[int], url_entries: List[Tuple[int, int]]):
+    url_entries.sort()
+    tmp_file = index_path(path) + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(offsets) - 1, len(url_entries), offsets[-1]))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for entry in url_entries:
+            f.write(URL_ENTRY.pack(*entry))
+    os.replace(tmp_file, index_path(path))
+
+
+def build_index(path: str) -> int:
+    """Index an existing JSON Lines file; returns the record count"""
+    offsets = []
+    url_entries = []
+    with open(path, 'rb') as f:
+        position = 0
+        for line in f:
+            if line.strip():
+                url = record_url(json.loads(line))
+                if url:
+                    url_entries.append((url_hash(url), len(offsets)))
+                offsets.append(position)
+            position += len(line)
+    # Blank lines end up inside the preceding record's range, json.loads ignores them
+    offsets.append(position)
+    write_index(path, offsets, url_entries)
+    return len(offsets) - 1
+
+
+def convert(source: str, path: str) -> int:
+    """Write the records of a JSON array or JSON Lines file as an indexed dataset"""
+    offsets = [0]
+    url_entries = []
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        for record in iter_records(source):
+            url = record_url(record)
+            if url:
+                url_entries.append((url_hash(url), len(offsets) - 1))
+            line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    os.replace(tmp_file, path)
+    write_index(path, offsets, url_entries)
+    return len(offsets) - 1
+
+
+class IndexedJsonl:
+    """Random access to an indexed JSON Lines dataset by ordinal or url
+
+    Supports len() and [ordinal], like the record lists the agents take;
+    every access parses a fresh dict.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_file = open(path, 'rb')
+        self.index_file = open(index_path(path), 'rb')
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.url_count, data_size = HEADER.unpack_from(self.index, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_path(path)} is not a record index")
+        if os.fstat(self.data_file.fileno()).st_size != data_size:
+            raise ValueError(f"{index_path(path)} is stale ({path} changed since it was indexed); "
+                             f"rebuild it with: python record_index.py index {path}")
+        # mmap refuses empty files
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ) if data_size else b''
+        self.urls_start = HEADER.size + (self.count + 1) * OFFSET.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def offset(self, ordinal: int) -> int:
+        return OFFSET.unpack_from(self.index, HEADER.size + ordinal * OFFSET.size)[0]
+
+    def raw(self, ordinal: int) -> bytes:
+        if ordinal < 0:
+            ordinal += self.count
+        if not 0 <= ordinal < self.count:
+            raise IndexError(ordinal)
+        return self.data[self.offset(ordinal):self.offset(ordinal + 1)]
+
+    def __getitem__(self, ordinal: int) -> Dict:
+        return json.loads(self.raw(ordinal))
+
+    def url_entry(self, position: int) -> Tuple[int, int]:
+        return URL_ENTRY.unpack_from(self.index, self.urls_start + position * URL_ENTRY.size)
+
+    def ordinal_of(self, url: str) -> Optional[int]:
+        """Ordinal of the (first indexed) record with this url, or None"""
+        target = url_hash(url)
+        low, high = 0, self.url_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.url_entry(middle)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        # Equal hashes are adjacent; confirm the url to rule out collisions
+        while low < self.url_count:
+            digest, ordinal = self.url_entry(low)
+            if digest != target:
+                break
+            if record_url(self[ordinal]) == url:
+                return ordinal
+            low += 1
+        return None
+
+    def get_by_url(self, url: str) -> Optional[Dict]:
+        ordinal = self.ordinal_of(url)
+        return None if ordinal is None else self[ordinal]
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict]:
+        stop = self.count if stop is None else min(stop, self.count)
+        for ordinal in range(start, stop):
+            yield self[ordinal]
+
+    def byte_range(self, start: int, stop: int) -> Tuple[int, int]:
+        return self.offset(start), self.offset(stop)
+
+    def splits(self, parts: int) -> List[Tuple[int, int]]:
+        """Ordinal ranges (start, stop) of parts slices holding about equal bytes"""
+        total = self.offset(self.count)
+        offsets = OffsetView(self)
+        bounds = [0]
+        for part in range(1, parts):
+            ordinal = bisect.bisect_left(offsets, total * part // parts, lo=bounds[-1])
+            bounds.append(min(ordinal, self.count))
+        bounds.append(self.count)
+        return list(zip(bounds, bounds[1:]))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.index.close()
+        self.data_file.close()
+        self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OffsetView:
+    """The offsets of an index as a read-only sequence, for bisect"""
+
+    def __init__(self, dataset: IndexedJsonl):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return self.dataset.count + 1
+
+    def __getitem__(self, ordinal: int) -> int:
+        return self.dataset.offset(ordinal)
+
+
+def parse_split(spec: str) -> Tuple[int, int]:
+    """'3/8' -> (3, 8): the fourth of eight slices"""
+    part, parts = (int(value) for value in spec.split('/'))
+    if not 0 <= part < parts:
+        raise ValueError(f"Split {spec}: expected K/N with 0 <= K < N")
+    return part, parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed JSON Lines datasets: convert, index, look up, split")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help="JSON array / JSON Lines file to an indexed dataset")
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('output', help="Dataset to write (.jsonl), its index goes next to it")
+    index_parser = subparsers.add_parser('index', help="(Re)build the index of a JSON Lines file")
+    index_parser.add_argument('path')
+    get_parser = subparsers.add_parser('get', help="Print one record")
+    get_parser.add_argument('path')
+    get_parser.add_argument('ordinal', type=int, nargs='?')
+    get_parser.add_argument('--url')
+    splits_parser = subparsers.add_parser('splits', help="Print N balanced ordinal and byte ranges")
+    splits_parser.add_argument('path')
+    splits_parser.add_argument('parts', type=int)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'convert':
+        count = convert(args.source, args.output)
+        print(f"✓ {count} records written to {args.output} ({time.perf_counter() - start:.2f}s), "
+              f"index {index_path(args.output)}")
+    elif args.command == 'index':
+        count = build_index(args.path)
+        print(f"✓ {count} records indexed in {index_path(args.path)} ({time.perf_counter() - start:.2f}s)")
+    elif args.command == 'get':
+        with IndexedJsonl(args.path) as dataset:
+            if args.url:
+                record = dataset.get_by_url(args.url)
+            elif args.ordinal is not None:
+                record = dataset[args.ordinal]
+            else:
+                parser.error("get needs an ordinal or --url")
+            print(json.dumps(record, ensure_ascii=False, indent=2))
+    else:
+        with IndexedJsonl(args.path) as dataset:
+            for part, (first, stop) in enumerate(dataset.splits(args.parts)):
+                begin, end = dataset.byte_range(first, stop)
+                print(f"{part}/{args.parts}: records {first}-{stop} ({stop - first}), bytes {begin}-{end}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Streaming readers for company record files
+
+Records are yielded one at a time from JSON arrays (the format written by
+`scrapy crawl ... -o file.json` and the phone agents) or from JSON Lines, so
+large files never have to be loaded whole.
+"""
+
+import json
+import sys
+from typing import Dict, IO, Iterator
+
+JSONL_EXTENSIONS = ('.jsonl', '.jl')
+
+
+def iter_jsonl(f: IO[str]) -> Iterator[Dict]:
+    """Yield one record per non-empty line"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    """Yield the elements of a top-level JSON array without loading it whole"""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace, the opening bracket and separators
+        while pos < len(buf) and buf[pos] in ' \t\r\n,[':
+            if buf[pos] == '[':
+                if started:
+                    break
+                started = True
+            pos += 1
+
+        if pos < len(buf) and buf[pos] == ']':
+            return
+
+        if pos < len(buf):
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield record
+                pos = end
+                continue
+
+        if eof:
+            return
+
+        # Need more data: drop what has been consumed and read the next chunk
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iter_records(path: str) -> Iterator[Dict]:
+    """Yield records from a JSON array file, a JSON Lines file or stdin ('-')"""
+    if path == '-':
+        yield from iter_jsonl(sys.stdin)
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(JSONL_EXTENSIONS):
+            yield from iter_jsonl(f)
+        else:
+            yield from iter_json_array(f)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Record-and-replay benchmark for the Scrapy spiders
+
+`record` runs a live crawl and archives every raw response to
+infobelscrapping/archives/<spider>.zip. `replay` crawls the same pages from
+the archive at full speed, with no network, delays or throttling, and
+reports pages/sec, items/sec, pipeline time and peak memory per spider.
+Parser and pipeline changes can then be compared on identical input, and
+`--baseline` fails the run when throughput regresses.
+
+Examples:
+    python replay_bench.py record datoscif infobel -s CLOSESPIDER_PAGECOUNT=200
+    python replay_bench.py replay datoscif infobel --runs 3 --save bench_baseline.json
+    python replay_bench.py replay datoscif infobel --baseline bench_baseline.json --max-regression 0.1
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+SCRAPY_PROJECT_DIR = 'infobelscrapping'
+
+# Replay runs measure parsing and pipelines, not politeness
+REPLAY_SETTINGS = [
+    'DOWNLOAD_DELAY=0',
+    'RANDOMIZE_DOWNLOAD_DELAY=0',
+    'AUTOTHROTTLE_ENABLED=0',
+    'BLOCK_THROTTLE_ENABLED=0',
+    'CONCURRENT_REQUESTS=64',
+    'CONCURRENT_REQUESTS_PER_DOMAIN=64',
+    'PHONE_ENRICHMENT_ENABLED=0',
+    'STATS_FLUSH_INTERVAL=0',
+    'STATS_TIMELINE_FILE=',
+]
+
+
+def archive_path(spider: str) -> str:
+    """Archive location, relative to the Scrapy project directory"""
+    return os.path.join('archives', f'{spider}.zip')
+
+
+def scrapy_crawl(spider: str, settings: List[str]):
+    command = ['scrapy', 'crawl', spider, '-L', 'WARNING']
+    for setting in settings:
+        command += ['-s', setting]
+    subprocess.run(command, cwd=SCRAPY_PROJECT_DIR, check=True)
+
+
+def record(spider: str, extra_settings: List[str]):
+    scrapy_crawl(spider, [
+        'RESPONSE_ARCHIVE_MODE=record',
+        f'RESPONSE_ARCHIVE_FILE={archive_path(spider)}',
+    ] + extra_settings)
+
+
+def replay(spider: str, extra_settings: List[str]) -> Dict:
+    """One replay run; returns the CrawlBenchmark report"""
+    with tempfile.TemporaryDirectory() as tmp:
+        report_file = os.path.join(tmp, 'benchmark.json')
+        scrapy_crawl(spider, [
+            'RESPONSE_ARCHIVE_MODE=replay',
+            f'RESPONSE_ARCHIVE_FILE={archive_path(spider)}',
+            'BENCHMARK_ENABLED=1',
+            f'BENCHMARK_FILE={report_file}',
+            # Keep the real stats and selector profiles out of benchmark runs
+            f"STATS_FILE={os.path.join(tmp, 'stats.json')}",
+            f"SELECTOR_PROFILE_FILE={os.path.join(tmp, 'selector_profiles.json')}",
+        ] + REPLAY_SETTINGS + extra_settings)
+        with open(report_file) as f:
+            return json.load(f)
+
+
+def median_report(reports: List[Dict]) -> Dict:
+    """Median of every numeric metric over the runs"""
+    merged = dict(reports[0])
+    for key, value in reports[0].items():
+        if isinstance(value, (int, float)):
+            merged[key] = statistics.median(report[key] for report in reports)
+    merged['runs'] = len(reports)
+    return merged
+
+
+def print_table(results: Dict[str, Dict]):
+    print(f"{'Spider':<12} {'Pages':>7} {'Items':>7} {'Pages/s':>10} {'Items/s':>10} "
+          f"{'CPU ms/page':>12} {'Pipeline ms/item':>17} {'Peak RSS MB':>12}")
+    for spider, result in results.items():
+        print(f"{spider:<12} {result['pages']:>7} {result['items']:>7} {result['pages_per_sec']:>10.1f} "
+              f"{result['items_per_sec']:>10.1f} {result.get('cpu_ms_per_page', 0):>12.2f} "
+              f"{result['pipeline_ms_per_item']:>17.3f} {result['peak_rss_mb']:>12.1f}")
+        if result.get('archive_misses'):
+            print(f"  ⚠️  {result['archive_misses']} requests were not in the archive (re-record it)")
+
+
+def check_baseline(results: Dict[str, Dict], baseline_file: str, max_regression: float) -> bool:
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    ok = True
+    for spider, result in results.items():
+        if spider not in baseline:
+            continue
+        before = baseline[spider]['items_per_sec']
+        after = result['items_per_sec']
+        change = (after - before) / before if before else 0
+        status = 'OK'
+        if change < -max_regression:
+            status = 'REGRESSION'
+            ok = False
+        print(f"{spider}: {before:.1f} -> {after:.1f} items/s ({change:+.1%}) {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record responses of a live crawl and benchmark replays of it")
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('spiders', nargs='+', help="Spider names, e.g. datoscif infobel")
+    parser.add_argument('-s', '--setting', action='append', default=[], metavar='NAME=VALUE',
+                        help="Extra Scrapy setting (repeatable), e.g. CLOSESPIDER_PAGECOUNT=200 when recording")
+    parser.add_argument('--runs', type=int, default=3, help="Replay runs per spider (the median is reported)")
+    parser.add_argument('--save', help="Write the replay results to this JSON file")
+    parser.add_argument('--baseline', help="Compare items/sec with a file written by --save")
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help="Allowed items/sec drop against the baseline (fraction)")
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        for spider in args.spiders:
+            record(spider, args.setting)
+            print(f"✓ {spider}: responses archived to {os.path.join(SCRAPY_PROJECT_DIR, archive_path(spider))}")
+        return
+
+    results = {}
+    for spider in args.spiders:
+        if not os.path.exists(os.path.join(SCRAPY_PROJECT_DIR, archive_path(spider))):
+            sys.exit(f"No archive for {spider}: run 'replay_bench.py record {spider}' first")
+        results[spider] = median_report([replay(spider, args.setting) for _ in range(args.runs)])
+    print_table(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✓ Results saved to {args.save}")
+    if args.baseline and not check_baseline(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
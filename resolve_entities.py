@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Entity resolution between infobel and datoscif records
+
+Both spiders describe the same companies with different schemas (infobel:
+name/link/phone/address, datoscif: company_name/url/postal_code/...). This
+merges records across sources and across runs into one canonical company
+per real-world entity, keeping track of where each phone number came from.
+
+Records are only compared inside blocks: companies sharing a postal code,
+companies with the same normalized name (legal forms such as SL/SA
+stripped) and records of the same company page url (placeholders and the
+listing pages cards without a link fall back to are not blocked on). Inside a block, a trigram index
+finds the records sharing trigrams with the new one, and their Dice
+similarity comes straight from the shared-trigram counts, so the cost grows
+with the number of records rather than with the number of pairs.
+
+Examples:
+    python resolve_entities.py infobel_companies.json infobelscrapping/datoscif_companies_final.json \\
+        -o companies_resolved.jl
+    python resolve_entities.py run1.jl run2.jl -o companies_resolved.jl -o companies_resolved.csv --threshold 0.85
+"""
+
+import argparse
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from export_companies import open_exporters
+from infobelscrapping.infobelscrapping.frontier import category_from_url
+from infobelscrapping.infobelscrapping.normalization import normalize_company_name, parse_postal_code
+from record_io import iter_records
+
+# Canonical fields, filled from the first record of the cluster that has them
+CANONICAL_FIELDS = [
+    'company_name', 'address', 'postal_code', 'municipality', 'province', 'category',
+    'business_purpose', 'social_capital', 'start_date', 'coordinates',
+]
+# The listing phone of a directory beats a phone found by the search agent
+PHONE_SOURCE_PRIORITY = {'infobel': 0, 'datoscif': 1}
+# Spanish numbers have 9 digits; placeholders ('Not available', 'No phone
+# found', 'Phone available (encrypted)', ...) have none
+MIN_PHONE_DIGITS = 9
+# Listing pages (besides infobel's category pages): the category index and
+# datoscif's daily lists
+LISTING_PATH_RE = re.compile(r'/business/?$|/empresas-nuevas/')
+
+
+def trigrams(name: str) -> Counter:
+    """Character trigrams of a normalized name, padded so short names still have some"""
+    padded = f'  {name} '
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def phone_key(phone: str) -> str:
+    """Digits of a phone number without the Spanish country code"""
+    digits = re.sub(r'\D', '', phone)
+    return digits[2:] if len(digits) == 11 and digits.startswith('34') else digits
+
+
+def is_phone(phone) -> bool:
+    """Whether phone is a number rather than one of the spiders' placeholders"""
+    return isinstance(phone, str) and len(phone_key(phone)) >= MIN_PHONE_DIGITS
+
+
+def is_company_page(url) -> bool:
+    """Whether url is a company's own page, the only url two records can be merged on
+
+    Both spiders fall back to the listing page's url for cards without a
+    link, and the cleaning stage fills missing urls with 'Not available'.
+    """
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        return False
+    path = urlparse(url).path
+    return bool(path.strip('/')) and not (category_from_url(path) or LISTING_PATH_RE.search(path))
+
+
+def detect_source(record: Dict) -> str:
+    """'infobel' for InfobelItem exports, 'datoscif' for DatoscifscrappingItem ones"""
+    if 'company_name' in record or 'url' in record:
+        return 'datoscif'
+    return 'infobel'
+
+
+def common_fields(record: Dict, source: str) -> Dict:
+    """Map either schema onto the datoscif field names"""
+    if source == 'infobel':
+        mapped = {
+            'company_name': record.get('name', ''),
+            'url': record.get('link', ''),
+            'address': record.get('address', ''),
+            'postal_code': parse_postal_code(record.get('address')),
+            'category': record.get('category', ''),
+            'phone': record.get('phone'),
+        }
+    else:
+        mapped = dict(record)
+    mapped['source'] = source
+    return mapped
+
+
+class EntityResolver:
+    """Incremental clustering of company records with union-find"""
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self.records: List[Dict] = []
+        self.parent: List[int] = []
+        # Block key -> trigram -> (record id, count of the trigram in its name)
+        self.blocks: Dict[tuple, Dict[str, List[tuple]]] = defaultdict(lambda: defaultdict(list))
+        self.trigram_counts: List[int] = []
+        self.comparisons = 0
+
+    def find(self, rid: int) -> int:
+        while self.parent[rid] != rid:
+            self.parent[rid] = self.parent[self.parent[rid]]
+            rid = self.parent[rid]
+        return rid
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the older record as root so clusters are stable across inputs
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    @staticmethod
+    def conflicting_postal_codes(a: Dict, b: Dict) -> bool:
+        """Same-name companies in different postal codes are different branches"""
+        return bool(a.get('postal_code') and b.get('postal_code') and a['postal_code'] != b['postal_code'])
+
+    def block_keys(self, record: Dict, name: str) -> List[tuple]:
+        keys = []
+        if record.get('postal_code'):
+            keys.append(('postal_code', record['postal_code']))
+        if name:
+            keys.append(('name', name))
+        return keys
+
+    def add(self, record: Dict, source: Optional[str] = None) -> int:
+        record = common_fields(record, source or detect_source(record))
+        name = normalize_company_name(record.get('company_name'))
+        grams = trigrams(name)
+        size = sum(grams.values())
+
+        rid = len(self.records)
+        self.records.append(record)
+        self.parent.append(rid)
+        self.trigram_counts.append(size)
+
+        if is_company_page(record.get('url')):
+            url_block = self.blocks[('url', record['url'])]
+            for other, _ in url_block.get('', ()):
+                self.union(rid, other)
+            url_block[''].append((rid, 0))
+
+        for key in self.block_keys(record, name):
+            block = self.blocks[key]
+            shared = Counter()
+            for gram, count in grams.items():
+                for other, other_count in block.get(gram, ()):
+                    shared[other] += min(count, other_count)
+                block[gram].append((rid, count))
+
+            for other, overlap in shared.items():
+                if self.conflicting_postal_codes(record, self.records[other]):
+                    continue
+                self.comparisons += 1
+                # Dice coefficient over the trigram multisets
+                similarity = 2 * overlap / (size + self.trigram_counts[other])
+                if similarity >= self.threshold:
+                    self.union(rid, other)
+        return rid
+
+    def add_records(self, records: Iterable[Dict], source: Optional[str] = None) -> int:
+        count = 0
+        for record in records:
+            self.add(record, source)
+            count += 1
+        return count
+
+    def clusters(self) -> List[List[int]]:
+        groups = defaultdict(list)
+        for rid in range(len(self.records)):
+            groups[self.find(rid)].append(rid)
+        return list(groups.values())
+
+    def canonical(self, cluster: List[int]) -> Dict:
+        """Merge a cluster into one company, datoscif fields first"""
+        members = sorted(
+            (self.records[rid] for rid in cluster),
+            key=lambda record: record['source'] != 'datoscif'
+        )
+        company = {}
+        for field in CANONICAL_FIELDS:
+            company[field] = next((m[field] for m in members if m.get(field)), '')
+
+        phone_sources = []
+        seen_phones = {}
+        for member in members:
+            phone = member.get('phone')
+            if not is_phone(phone):
+                continue
+            key = phone_key(phone)
+            if key in seen_phones:
+                if member['source'] not in seen_phones[key]['sources']:
+                    seen_phones[key]['sources'].append(member['source'])
+                continue
+            entry = {'phone': phone, 'sources': [member['source']], 'url': member.get('url', '')}
+            if member.get('phone_search_info'):
+                entry['search_info'] = member['phone_search_info']
+            seen_phones[key] = entry
+            phone_sources.append(entry)
+        phone_sources.sort(key=lambda entry: min(PHONE_SOURCE_PRIORITY.get(s, 9) for s in entry['sources']))
+
+        company['phone'] = phone_sources[0]['phone'] if phone_sources else None
+        company['phone_sources'] = phone_sources
+        company['url'] = next((m['url'] for m in members if m['source'] == 'datoscif' and m.get('url')), '')
+        company['sources'] = sorted({m['source'] for m in members})
+        company['source_urls'] = sorted({m['url'] for m in members if m.get('url')})
+        return company
+
+    def companies(self) -> Iterable[Dict]:
+        for cluster in self.clusters():
+            yield self.canonical(cluster)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge infobel and datoscif records into canonical companies")
+    parser.add_argument('inputs', nargs='+', help="JSON/JSONL exports of either spider, from any number of runs")
+    parser.add_argument('-o', '--output', action='append', required=True,
+                        help="Output file (.jsonl/.jl keeps phone provenance, .csv/.xlsx the phone CSV layout); repeatable")
+    parser.add_argument('--threshold', type=float, default=0.8, help="Trigram Dice similarity needed to merge")
+    args = parser.parse_args()
+
+    resolver = EntityResolver(threshold=args.threshold)
+    start = time.perf_counter()
+    for path in args.inputs:
+        count = resolver.add_records(iter_records(path))
+        print(f"{path}: {count} records")
+
+    exporters = open_exporters(args.output)
+    entities = 0
+    cross_source = 0
+    try:
+        for company in resolver.companies():
+            entities += 1
+            if len(company['sources']) > 1:
+                cross_source += 1
+            for exporter in exporters:
+                exporter.write(company)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"✓ {len(resolver.records)} records -> {entities} companies "
+          f"({cross_source} matched across sources, {resolver.comparisons} comparisons, {elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
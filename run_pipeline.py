@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+End-to-end streaming pipeline: crawl -> phone enrichment -> CSV/JSONL
+
+Replaces the three manual steps (scrapy crawl, enhanced_phone_agent.py,
+create_phone_csv.py) with one command. Each stage runs in its own thread and
+hands records to the next one through a bounded queue, so no intermediate
+file is written and the first rows reach the sinks while the crawl is still
+running.
+
+Examples:
+    python run_pipeline.py --source crawl --sink csv:companies_with_phones.csv
+    python run_pipeline.py --source infobelscrapping/datoscif_companies_final.json \\
+        --sink jsonl:companies_with_phones_enhanced.jl --sink csv:companies_with_phones.csv
+"""
+
+import argparse
+import logging
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List
+
+from egress_pool import EgressPool
+from enhanced_phone_agent import EnhancedPhoneSearchAgent
+from export_companies import CsvExporter, JsonlExporter, RecordFilter, XlsxExporter, has_phone
+from infobelscrapping.infobelscrapping.event_log import setup_event_log
+from infobelscrapping.infobelscrapping.shared_limiter import DEFAULT_DIRECTORY, SharedRateLimiter
+from record_io import iter_jsonl, iter_records
+
+# Marks the end of a stream on a queue
+DONE = object()
+
+SCRAPY_PROJECT_DIR = 'infobelscrapping'
+
+
+class StageTimer:
+    """Item count and busy time of one pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.items += 1
+            self.busy += seconds
+
+    def report(self) -> str:
+        rate = self.items / self.busy if self.busy else 0
+        return f"{self.name:<10} {self.items:>8} {self.busy:>12.2f} {rate:>12.1f}"
+
+
+def crawl_source(spider: str, settings: List[str]) -> Iterator[Dict]:
+    """Run a Scrapy spider and yield its items as they are scraped"""
+    command = ['scrapy', 'crawl', spider, '-o', '-:jsonlines', '-L', 'WARNING']
+    for setting in settings:
+        command += ['-s', setting]
+
+    process = subprocess.Popen(
+        command, cwd=SCRAPY_PROJECT_DIR, stdout=subprocess.PIPE, text=True, encoding='utf-8'
+    )
+    try:
+        yield from iter_jsonl(process.stdout)
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        process.stdout.close()
+        if process.wait() not in (0, -15):
+            print(f"scrapy crawl exited with status {process.returncode}", file=sys.stderr)
+
+
+# Sink kinds for --sink KIND:PATH, as (exporter, companies with phone only).
+# The tabular formats keep the companies_with_phones.csv behaviour of only
+# listing companies with a phone
+SINKS = {
+    'csv': (CsvExporter, True),
+    'xlsx': (XlsxExporter, True),
+    'jsonl': (JsonlExporter, False),
+}
+
+
+def parse_sink(spec: str):
+    """(exporter, phone only, path) of a 'kind:path' spec such as 'csv:companies_with_phones.csv'"""
+    kind, _, path = spec.partition(':')
+    if kind not in SINKS or not path:
+        raise argparse.ArgumentTypeError(f"Invalid sink '{spec}', expected one of {sorted(SINKS)} as kind:path")
+    exporter, phone_only = SINKS[kind]
+    return exporter, phone_only, path
+
+
+def open_sinks(specs: List[str]):
+    """Open every sink, after checking all of them so a bad one truncates no output file"""
+    sinks = [parse_sink(spec) for spec in specs]
+    for exporter, _, path in sinks:
+        exporter.check(path)
+    return [
+        exporter(path, record_filter=RecordFilter(has_phone=True) if phone_only else None)
+        for exporter, phone_only, path in sinks
+    ]
+
+
+def drain(inbox: queue.Queue, producers: int = 1):
+    """Discard records until every producer sent DONE, so the stages feeding a failed one never block"""
+    while producers:
+        if inbox.get() is DONE:
+            producers -= 1
+
+
+def run_source(records: Iterable[Dict], outbox: queue.Queue, timer: StageTimer, errors: List, limit: int = 0):
+    records = iter(records)
+    try:
+        while not limit or timer.items < limit:
+            start = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                break
+            timer.record(time.perf_counter() - start)
+            outbox.put(record)
+    except Exception as e:
+        errors.append(('source', e))
+    finally:
+        if hasattr(records, 'close'):
+            records.close()
+        outbox.put(DONE)
+
+
+def run_enricher(agent: EnhancedPhoneSearchAgent, inbox: queue.Queue, outbox: queue.Queue, timer: StageTimer,
+                 errors: List):
+    try:
+        while True:
+            record = inbox.get()
+            if record is DONE:
+                break
+
+            start = time.perf_counter()
+            if not has_phone(record):
+                try:
+                    phone, search_info = agent.search_company_multiple_strategies(record)
+                except Exception as e:
+                    phone, search_info = None, f"Error: {str(e)}"
+                record['phone'] = phone
+                record['phone_search_info'] = search_info
+                record['search_timestamp'] = time.time()
+            timer.record(time.perf_counter() - start)
+            outbox.put(record)
+    except Exception as e:
+        errors.append(('enrich', e))
+        drain(inbox)
+    finally:
+        # Put it back so the sibling workers stop too
+        inbox.put(DONE)
+        outbox.put(DONE)
+
+
+def run_sinks(sinks: List, inbox: queue.Queue, producers: int, timer: StageTimer, errors: List):
+    remaining = producers
+    try:
+        while remaining:
+            record = inbox.get()
+            if record is DONE:
+                remaining -= 1
+                continue
+            start = time.perf_counter()
+            for sink in sinks:
+                sink.write(record)
+            timer.record(time.perf_counter() - start)
+    except Exception as e:
+        errors.append(('sink', e))
+        drain(inbox, remaining)
+    finally:
+        for sink in sinks:
+            sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl, enrich with phones and export in one streaming run")
+    parser.add_argument('--source', default='crawl',
+                        help="'crawl' to run the spider, '-' for JSONL on stdin, or a .json/.jsonl file")
+    parser.add_argument('--spider', default='datoscif', help="Spider to run when --source is 'crawl'")
+    parser.add_argument('-s', '--crawl-setting', action='append', default=[], metavar='NAME=VALUE',
+                        help="Extra Scrapy setting for the crawl (repeatable)")
+    parser.add_argument('--sink', action='append', metavar='KIND:PATH',
+                        help="Output as csv:PATH or xlsx:PATH (companies with phone) or jsonl:PATH (all records); repeatable")
+    parser.add_argument('--workers', type=int, default=1, help="Parallel phone search workers")
+    parser.add_argument('--search-delay', type=float, default=2.0,
+                        help="Seconds between searches per worker (without --egress-pool)")
+    parser.add_argument('--egress-pool', help="JSON file of exits shared by all workers; each exit keeps its own rate")
+    parser.add_argument('--shared-rate-limit', nargs='?', const='', metavar='DIR',
+                        help="Share the search rate with other processes on this machine (token buckets in DIR)")
+    parser.add_argument('--no-enrich', action='store_true', help="Skip the phone search stage")
+    parser.add_argument('--queue-size', type=int, default=100, help="Capacity of the queues between stages")
+    parser.add_argument('--limit', type=int, default=0, help="Stop after this many source records")
+    parser.add_argument('--event-log', metavar='PATH',
+                        help="Write the phone search events to PATH as JSON Lines")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    event_log = setup_event_log(args.event_log, loggers=('enhanced_phone_agent',)) if args.event_log else None
+
+    sinks = open_sinks(args.sink or ['csv:companies_with_phones.csv'])
+
+    if args.source == 'crawl':
+        records = crawl_source(args.spider, args.crawl_setting)
+    else:
+        records = iter_records(args.source)
+
+    source_timer = StageTimer('source')
+    enrich_timer = StageTimer('enrich')
+    sink_timer = StageTimer('sink')
+
+    # (stage, exception) of the stages that failed; they still send DONE downstream
+    errors = []
+    source_queue = queue.Queue(maxsize=args.queue_size)
+    threads = [threading.Thread(target=run_source, args=(records, source_queue, source_timer, errors, args.limit))]
+
+    if args.no_enrich:
+        sink_queue, producers = source_queue, 1
+    else:
+        sink_queue, producers = queue.Queue(maxsize=args.queue_size), args.workers
+        # Shared by the workers; without it each worker paces its own direct exit
+        egress_pool = EgressPool.from_file(args.egress_pool) if args.egress_pool else None
+        shared_limiter = None
+        if args.shared_rate_limit is not None:
+            shared_limiter = SharedRateLimiter(args.shared_rate_limit or DEFAULT_DIRECTORY)
+        for _ in range(args.workers):
+            agent = EnhancedPhoneSearchAgent(search_delay=args.search_delay, egress_pool=egress_pool,
+                                             shared_limiter=shared_limiter)
+            threads.append(threading.Thread(target=run_enricher,
+                                            args=(agent, source_queue, sink_queue, enrich_timer, errors)))
+
+    threads.append(threading.Thread(target=run_sinks, args=(sinks, sink_queue, producers, sink_timer, errors)))
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+    if event_log is not None:
+        event_log.stop()
+
+    print(f"{'Stage':<10} {'Items':>8} {'Busy (s)':>12} {'Items/s':>12}")
+    for timer in (source_timer, enrich_timer, sink_timer):
+        if timer is enrich_timer and args.no_enrich:
+            continue
+        print(timer.report())
+    print(f"Total wall time: {wall_time:.2f}s")
+
+    for stage, error in errors:
+        print(f"✗ {stage} stage failed: {error!r}")
+    if errors:
+        raise errors[0][1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Content-addressed archive of raw phone search pages
+
+Every search results page the agent downloads is stored once, gzip
+compressed, under the SHA-256 of its body (identical pages, such as the
+empty "no results" page, share one file):
+    <archive>/objects/ab/cdef....gz
+and an append-only index links it to the company and query it answered:
+    <archive>/index.jsonl  {"company": <url>, "company_name", "strategy", "query", "url", "sha256", "encoding", ...}
+
+With the archive, a better extract_phones() or snippet parser can be applied
+to the whole history without searching again: re-extraction reparses the
+archived pages of every company in a process pool, in search strategy
+order, exactly as the live search would have, and updates the results file.
+
+    python enhanced_phone_agent.py --archive search_archive                  # archive while searching
+    python enhanced_phone_agent.py --archive search_archive --reextract \\
+        --input companies_with_phones_enhanced.json --output companies_with_phones_reextracted.json
+    python search_archive.py search_archive                                  # archive summary
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from company_store import CompanyStore
+from record_io import iter_records
+
+# (strategy, sha256, encoding) of one archived page
+PageRef = Tuple[int, str, str]
+
+
+def company_key(company) -> Optional[str]:
+    """Archive key of a company: its url (or infobel link, as in snapshot_diff.py), else its name"""
+    return company.get('url') or company.get('link') or company.get('company_name')
+
+
+class SearchArchive:
+    """Raw search pages stored by content hash, indexed by company and query"""
+
+    def __init__(self, directory: str, compress_level: int = 6):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, 'objects')
+        self.index_file = os.path.join(directory, 'index.jsonl')
+        self.compress_level = compress_level
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.pages_stored = 0
+        self.pages_deduplicated = 0
+        self.bytes_raw = 0
+        self.bytes_stored = 0
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f'{digest[2:]}.gz')
+
+    def put(self, body: bytes) -> str:
+        """Store a page body and return its SHA-256; already stored bodies are not rewritten"""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            with self.lock:
+                self.pages_deduplicated += 1
+            return digest
+        compressed = gzip.compress(body, compresslevel=self.compress_level, mtime=0)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique tmp name: several threads or processes may store the same page
+        tmp_file = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_file, path)
+        with self.lock:
+            self.pages_stored += 1
+            self.bytes_raw += len(body)
+            self.bytes_stored += len(compressed)
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        with open(self.object_path(digest), 'rb') as f:
+            return gzip.decompress(f.read())
+
+    def add(self, company, strategy: int, query: str, url: str, body: bytes,
+            encoding: Optional[str] = None, status: int = 200) -> str:
+        """Archive one search results page of a company and index it"""
+        digest = self.put(body)
+        entry = {
+            'company': company_key(company),
+            'company_name': company.get('company_name'),
+            'strategy': strategy,
+            'query': query,
+            'url': url,
+            'status': status,
+            'sha256': digest,
+            'encoding': encoding or 'utf-8',
+            'fetched_at': time.time(),
+        }
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        # One O_APPEND write per line, so agents sharing the archive do not interleave
+        fd = os.open(self.index_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        return digest
+
+    def iter_index(self) -> Iterable[Dict]:
+        if not os.path.exists(self.index_file):
+            return iter(())
+        return iter_records(self.index_file)
+
+    def pages_by_company(self) -> Dict[str, List[PageRef]]:
+        """Archived pages per company key, in strategy order; the latest fetch of a strategy wins"""
+        latest: Dict[str, Dict[int, PageRef]] = defaultdict(dict)
+        for entry in self.iter_index():
+            if entry.get('status', 200) != 200:
+                continue
+            latest[entry['company']][entry['strategy']] = (entry['strategy'], entry['sha256'], entry['encoding'])
+        return {key: [pages[strategy] for strategy in sorted(pages)] for key, pages in latest.items()}
+
+    def summary(self) -> Dict:
+        return {
+            'pages_stored': self.pages_stored,
+            'pages_deduplicated': self.pages_deduplicated,
+            'bytes_raw': self.bytes_raw,
+            'bytes_stored': self.bytes_stored,
+        }
+
+
+# Per-process state of the re-extraction workers
+worker_archive: Optional[SearchArchive] = None
+worker_agent = None
+
+
+def init_worker(directory: str):
+    global worker_archive, worker_agent
+    # Imported here: the agent imports this module to archive its searches
+    from enhanced_phone_agent import EnhancedPhoneSearchAgent
+    worker_archive = SearchArchive(directory)
+    # Only the parsing and extraction of the agent are used, no request is sent
+    worker_agent = EnhancedPhoneSearchAgent()
+
+
+def extract_company(task: Tuple[int, List[PageRef]]) -> Tuple[int, Optional[str], Optional[int]]:
+    """First phone over a company's archived pages, like search_company_multiple_strategies"""
+    index, pages = task
+    for strategy, digest, encoding in pages:
+        text = worker_archive.get(digest).decode(encoding, errors='replace')
+        for result in worker_agent.parse_search_results(text):
+            if result.phone_found:
+                return index, result.phone_found, strategy
+    return index, None, None
+
+
+def reextract(archive_dir: str, input_file: str, output_file: str, processes: Optional[int] = None,
+              chunksize: int = 64) -> Dict:
+    """Rerun phone extraction over the archived pages of every company in input_file
+
+    Companies without archived pages keep their current phone; so do
+    companies whose pages no longer yield one, since their phone may come
+    from a search made before archiving. Writes output_file (and its
+    _stats.json) like the agent does and returns the counts.
+    """
+    from enhanced_phone_agent import EnhancedPhoneSearchAgent
+
+    archive = SearchArchive(archive_dir)
+    pages = archive.pages_by_company()
+    companies = CompanyStore.from_records(iter_records(input_file))
+
+    tasks = []
+    for i in range(len(companies)):
+        refs = pages.get(company_key(companies[i]))
+        if refs:
+            tasks.append((i, refs))
+
+    counts = {'companies': len(companies), 'with_archive': len(tasks), 'found': 0,
+              'new': 0, 'changed': 0, 'unchanged': 0, 'kept': 0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=(archive_dir,)) as executor:
+        for i, phone, strategy in executor.map(extract_company, tasks, chunksize=chunksize):
+            company = companies[i]
+            previous = company.get('phone')
+            if phone is None:
+                counts['kept'] += 1
+                continue
+            counts['found'] += 1
+            if not previous:
+                counts['new'] += 1
+            elif previous != phone:
+                counts['changed'] += 1
+            else:
+                counts['unchanged'] += 1
+            company['phone'] = phone
+            company['phone_search_info'] = f"Found via search strategy {strategy} (re-extracted)"
+    counts['seconds'] = round(time.perf_counter() - start, 2)
+
+    phones_found = sum(1 for company in companies if company.get('phone'))
+    stats = {
+        'total_processed': len(companies),
+        'phones_found': phones_found,
+        'success_rate': phones_found / len(companies) if len(companies) else 0,
+        'reextracted': counts,
+    }
+    EnhancedPhoneSearchAgent().save_progress(list(companies), output_file, stats)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a search page archive")
+    parser.add_argument('archive', help="Archive directory")
+    args = parser.parse_args()
+
+    archive = SearchArchive(args.archive)
+    entries = 0
+    digests = set()
+    for entry in archive.iter_index():
+        entries += 1
+        digests.add(entry['sha256'])
+    raw = stored = 0
+    for digest in digests:
+        stored += os.path.getsize(archive.object_path(digest))
+        raw += len(archive.get(digest))
+    print(f"{args.archive}: {entries} searches, {len(archive.pages_by_company())} companies, "
+          f"{len(digests)} distinct pages")
+    if stored:
+        print(f"  {raw / 1e6:.1f} MB raw, {stored / 1e6:.1f} MB stored ({raw / stored:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Streaming diff between two company snapshots
+
+Every record is keyed by its url (`link` for infobel records) and gets a
+content hash of its fields. Both snapshots are sorted by key with an
+external merge sort (runs of --run-size records spilled to temporary files),
+then walked side by side, so memory stays bounded by the run size whatever
+the snapshot sizes. Only the delta is written: new and changed companies
+with their new content, removed ones with their last known content, each
+tagged with a `change` field (and `changed_fields` for changes).
+
+The delta is a normal record file, so enrichment and exports can run on it
+alone:
+    python snapshot_diff.py infobelscrapping/remaining_companies.json infobelscrapping/datoscif_companies_final.json -o delta.jl
+    python export_companies.py delta.jl -o companies_with_phones.csv --append
+    python snapshot_diff.py yesterday.jl today.jl -o delta.jl --only new,changed --ignore search_timestamp
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from export_companies import open_exporters
+from record_io import iter_records
+
+CHANGE_TYPES = ('new', 'changed', 'removed')
+# Fields that change on every run without the company changing
+DEFAULT_IGNORED_FIELDS = ('search_timestamp',)
+
+# (key, content hash, record as JSON)
+Entry = Tuple[str, str, str]
+
+
+def record_key(record: Dict) -> Optional[str]:
+    return record.get('url') or record.get('link')
+
+
+def content_hash(record: Dict, ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS) -> str:
+    """Hash of the record's fields, independent of key order"""
+    content = {field: value for field, value in record.items() if field not in ignored_fields}
+    canonical = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class SortedSnapshot:
+    """A snapshot's records as entries sorted by key, via external merge sort"""
+
+    def __init__(self, path: str, ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS,
+                 run_size: int = 100_000, tmp_dir: Optional[str] = None):
+        self.path = path
+        self.ignored_fields = tuple(ignored_fields)
+        self.run_size = run_size
+        self.tmp_dir = tmp_dir
+        self.run_files: List[str] = []
+        self.records = 0
+        self.missing_key = 0
+        self.duplicates = 0
+
+    def write_run(self, entries: List[Entry]):
+        entries.sort()
+        fd, path = tempfile.mkstemp(prefix='snapshot_run_', suffix='.tsv', dir=self.tmp_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                # JSON-encoded key and body never contain a raw tab or newline
+                f.write('\t'.join((json.dumps(entry[0], ensure_ascii=False), entry[1], entry[2])) + '\n')
+        self.run_files.append(path)
+
+    def sort(self):
+        entries: List[Entry] = []
+        for record in iter_records(self.path):
+            self.records += 1
+            key = record_key(record)
+            if not key:
+                self.missing_key += 1
+                continue
+            entries.append((key, content_hash(record, self.ignored_fields), json.dumps(record, ensure_ascii=False)))
+            if len(entries) >= self.run_size:
+                self.write_run(entries)
+                entries = []
+        if entries or not self.run_files:
+            self.write_run(entries)
+
+    def read_run(self, path: str) -> Iterator[Entry]:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                key, digest, body = line.rstrip('\n').split('\t', 2)
+                yield json.loads(key), digest, body
+
+    def __iter__(self) -> Iterator[Entry]:
+        """Entries in key order; of several records with the same key, the first sorted one wins"""
+        if not self.run_files:
+            self.sort()
+        previous_key = None
+        for entry in heapq.merge(*(self.read_run(path) for path in self.run_files)):
+            if entry[0] == previous_key:
+                self.duplicates += 1
+                continue
+            previous_key = entry[0]
+            yield entry
+
+    def cleanup(self):
+        for path in self.run_files:
+            os.remove(path)
+        self.run_files = []
+
+
+def changed_fields(old: Dict, new: Dict, ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS) -> List[str]:
+    fields = (set(old) | set(new)) - set(ignored_fields)
+    return sorted(field for field in fields if old.get(field) != new.get(field))
+
+
+def diff_snapshots(old: Iterable[Entry], new: Iterable[Entry],
+                   ignored_fields: Iterable[str] = DEFAULT_IGNORED_FIELDS) -> Iterator[Tuple[str, Optional[Dict]]]:
+    """Sort-merge two key-sorted entry streams
+
+    Yields ('new' | 'changed' | 'removed', record) for every difference and
+    ('unchanged', None) for each matching pair, so callers can count them
+    without materializing the records.
+    """
+    old_iter, new_iter = iter(old), iter(new)
+    old_entry, new_entry = next(old_iter, None), next(new_iter, None)
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry[0] < new_entry[0]):
+            yield 'removed', json.loads(old_entry[2])
+            old_entry = next(old_iter, None)
+        elif old_entry is None or new_entry[0] < old_entry[0]:
+            yield 'new', json.loads(new_entry[2])
+            new_entry = next(new_iter, None)
+        else:
+            if old_entry[1] == new_entry[1]:
+                yield 'unchanged', None
+            else:
+                record = json.loads(new_entry[2])
+                record['changed_fields'] = changed_fields(json.loads(old_entry[2]), record, ignored_fields)
+                yield 'changed', record
+            old_entry, new_entry = next(old_iter, None), next(new_iter, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the new, changed and removed companies between two snapshots")
+    parser.add_argument('old', help="Earlier snapshot (JSON array or JSON Lines)")
+    parser.add_argument('new', help="Later snapshot (JSON array or JSON Lines)")
+    parser.add_argument('-o', '--output', action='append', required=True,
+                        help="Delta file (.jsonl/.jl keeps change tags, .csv/.xlsx the phone CSV layout); repeatable")
+    parser.add_argument('--only', default=','.join(CHANGE_TYPES),
+                        help="Comma-separated change types to write (default: new,changed,removed)")
+    parser.add_argument('--ignore', action='append', default=list(DEFAULT_IGNORED_FIELDS),
+                        help="Field left out of the content hash; repeatable")
+    parser.add_argument('--run-size', type=int, default=100_000, help="Records sorted in memory per spill file")
+    args = parser.parse_args()
+
+    only = set(args.only.split(','))
+    unknown = only - set(CHANGE_TYPES)
+    if unknown:
+        parser.error(f"Unknown change types {sorted(unknown)}, expected some of {list(CHANGE_TYPES)}")
+
+    start = time.perf_counter()
+    old = SortedSnapshot(args.old, args.ignore, args.run_size)
+    new = SortedSnapshot(args.new, args.ignore, args.run_size)
+    exporters = open_exporters(args.output)
+    counts = dict.fromkeys(CHANGE_TYPES + ('unchanged',), 0)
+    try:
+        for change, record in diff_snapshots(old, new, args.ignore):
+            counts[change] += 1
+            if change in only:
+                record['change'] = change
+                for exporter in exporters:
+                    exporter.write(record)
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        old.cleanup()
+        new.cleanup()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.old}: {old.records} records, {args.new}: {new.records} records ({elapsed:.2f}s)")
+    print(f"✓ {counts['new']} new, {counts['changed']} changed, {counts['removed']} removed, "
+          f"{counts['unchanged']} unchanged")
+    for snapshot in (old, new):
+        if snapshot.missing_key or snapshot.duplicates:
+            print(f"  ⚠️  {snapshot.path}: {snapshot.missing_key} records without url skipped, "
+                  f"{snapshot.duplicates} duplicate urls ignored")
+    for exporter in exporters:
+        print(f"✓ {exporter.path}: {exporter.written} rows")
+
+
+if __name__ == "__main__":
+    main()
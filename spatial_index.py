@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Spatial index over company coordinates
+
+Companies are bucketed into a fixed lat/lon grid (0.05 degrees, roughly 5 km
+per cell in Spain), so radius, bounding-box and nearest-neighbour queries only
+look at the handful of cells around the query point instead of scanning and
+re-parsing every record. The index is saved to disk and can be updated with
+new companies without rebuilding it.
+
+Examples:
+    python spatial_index.py build companies_with_phones_enhanced.json
+    python spatial_index.py add daily_delta.jl
+    python spatial_index.py radius 40.4168 -3.7038 5
+    python spatial_index.py bbox 40.3 -3.8 40.5 -3.6
+    python spatial_index.py nearest 41.3874 2.1686 -k 10
+"""
+
+import argparse
+import heapq
+import math
+import os
+import pickle
+import time
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from infobelscrapping.infobelscrapping.normalization import parse_coordinates
+from record_io import iter_records
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of one degree of latitude on the haversine sphere
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+DEFAULT_INDEX_FILE = 'companies.geoidx'
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in km"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """Fixed-size lat/lon grid of points keyed by company url"""
+
+    def __init__(self, cell_size: float = 0.05):
+        self.cell_size = cell_size
+        # Column storage: row i is (lats[i], lons[i], keys[i], labels[i])
+        self.lats = array('d')
+        self.lons = array('d')
+        self.keys: List[str] = []
+        self.labels: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def cell_of(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, key: str, lat: float, lon: float, label: str = '') -> bool:
+        """Insert or move a point; returns True when the key is new"""
+        row = self.rows.get(key)
+        if row is not None:
+            old_cell = self.cell_of(self.lats[row], self.lons[row])
+            new_cell = self.cell_of(lat, lon)
+            if old_cell != new_cell:
+                self.cells[old_cell].remove(row)
+                self.cells[new_cell].append(row)
+            self.lats[row] = lat
+            self.lons[row] = lon
+            self.labels[row] = label
+            return False
+
+        row = len(self.keys)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.keys.append(key)
+        self.labels.append(label)
+        self.rows[key] = row
+        self.cells[self.cell_of(lat, lon)].append(row)
+        return True
+
+    def add_records(self, records: Iterable[Dict]) -> Dict:
+        """Index companies from records; counts added, updated and skipped ones"""
+        counts = {'added': 0, 'updated': 0, 'skipped': 0}
+        for record in records:
+            lat, lon = record.get('latitude'), record.get('longitude')
+            if lat is None or lon is None:
+                lat, lon = parse_coordinates(record.get('coordinates'))
+            key = record.get('url') or record.get('company_name')
+            if lat is None or not key:
+                counts['skipped'] += 1
+                continue
+            label = record.get('company_name', '')
+            if record.get('phone'):
+                label = f"{label} ({record['phone']})"
+            counts['added' if self.add(key, lat, lon, label) else 'updated'] += 1
+        return counts
+
+    def rows_in_cells(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Iterable[int]:
+        min_i, min_j = self.cell_of(min_lat, min_lon)
+        max_i, max_j = self.cell_of(max_lat, max_lon)
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                yield from self.cells.get((i, j), ())
+
+    def bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Tuple[str, str]]:
+        """Points inside the box, as (key, label)"""
+        lats, lons = self.lats, self.lons
+        return [
+            (self.keys[row], self.labels[row])
+            for row in self.rows_in_cells(min_lat, min_lon, max_lat, max_lon)
+            if min_lat <= lats[row] <= max_lat and min_lon <= lons[row] <= max_lon
+        ]
+
+    def radius(self, lat: float, lon: float, km: float) -> List[Tuple[float, str, str]]:
+        """Points within km of (lat, lon), nearest first, as (distance_km, key, label)"""
+        dlat = km / KM_PER_DEGREE
+        # Degrees of longitude shrink towards the poles: size the box for the circle's edge nearest the pole
+        edge_lat = min(89.9, abs(lat) + dlat)
+        dlon = km / (KM_PER_DEGREE * math.cos(math.radians(edge_lat)))
+        min_lat, max_lat, min_lon, max_lon = lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+        results = []
+        lats, lons = self.lats, self.lons
+        for row in self.rows_in_cells(min_lat, min_lon, max_lat, max_lon):
+            # Cheap box check first, exact distance only for the survivors
+            if not (min_lat <= lats[row] <= max_lat and min_lon <= lons[row] <= max_lon):
+                continue
+            distance = haversine_km(lat, lon, lats[row], lons[row])
+            if distance <= km:
+                results.append((distance, self.keys[row], self.labels[row]))
+        results.sort()
+        return results
+
+    def nearest(self, lat: float, lon: float, k: int = 10) -> List[Tuple[float, str, str]]:
+        """The k points closest to (lat, lon), searching outwards ring by ring"""
+        if not self.keys:
+            return []
+        center_i, center_j = self.cell_of(lat, lon)
+        heap: List[Tuple[float, int]] = []  # max-heap of the best k, as (-distance, row)
+        visited = 0
+        ring = 0
+
+        while True:
+            for i in range(center_i - ring, center_i + ring + 1):
+                for j in range(center_j - ring, center_j + ring + 1):
+                    if ring and max(abs(i - center_i), abs(j - center_j)) != ring:
+                        continue
+                    for row in self.cells.get((i, j), ()):
+                        visited += 1
+                        distance = haversine_km(lat, lon, self.lats[row], self.lons[row])
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-distance, row))
+                        elif distance < -heap[0][0]:
+                            heapq.heapreplace(heap, (-distance, row))
+
+            if visited == len(self.keys):
+                break
+            if len(heap) == k:
+                # Anything outside this ring is at least `ring` whole cells away
+                edge_lat = min(89.0, abs(lat) + (ring + 1) * self.cell_size)
+                bound = ring * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+                if -heap[0][0] <= bound:
+                    break
+            ring += 1
+
+        return sorted((-d, self.keys[row], self.labels[row]) for d, row in heap)
+
+    def save(self, path: str):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'cell_size': self.cell_size,
+                'lats': self.lats,
+                'lons': self.lons,
+                'keys': self.keys,
+                'labels': self.labels,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'GridIndex':
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        index = cls(data['cell_size'])
+        index.lats = data['lats']
+        index.lons = data['lons']
+        index.keys = data['keys']
+        index.labels = data['labels']
+        for row, key in enumerate(index.keys):
+            index.rows[key] = row
+            index.cells[index.cell_of(index.lats[row], index.lons[row])].append(row)
+        return index
+
+
+def print_results(results: List[Tuple], elapsed: float, with_distance: bool = True):
+    for result in results:
+        if with_distance:
+            distance, key, label = result
+            print(f"{distance:8.2f} km  {label}  {key}")
+        else:
+            key, label = result
+            print(f"{label}  {key}")
+    print(f"{len(results)} companies in {elapsed * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Radius, bounding-box and nearest queries over company coordinates")
+    parser.add_argument('--index', default=DEFAULT_INDEX_FILE, help="Index file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Build a new index from JSON/JSONL files")
+    build.add_argument('inputs', nargs='+')
+    build.add_argument('--cell-size', type=float, default=0.05, help="Grid cell size in degrees")
+
+    add = subparsers.add_parser('add', help="Add or update companies in an existing index")
+    add.add_argument('inputs', nargs='+')
+
+    radius = subparsers.add_parser('radius', help="Companies within KM of a point")
+    radius.add_argument('lat', type=float)
+    radius.add_argument('lon', type=float)
+    radius.add_argument('km', type=float)
+
+    bbox = subparsers.add_parser('bbox', help="Companies inside a bounding box")
+    bbox.add_argument('min_lat', type=float)
+    bbox.add_argument('min_lon', type=float)
+    bbox.add_argument('max_lat', type=float)
+    bbox.add_argument('max_lon', type=float)
+
+    nearest = subparsers.add_parser('nearest', help="The k companies nearest to a point")
+    nearest.add_argument('lat', type=float)
+    nearest.add_argument('lon', type=float)
+    nearest.add_argument('-k', type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command in ('build', 'add'):
+        index = GridIndex(args.cell_size) if args.command == 'build' else GridIndex.load(args.index)
+        for path in args.inputs:
+            counts = index.add_records(iter_records(path))
+            print(f"{path}: {counts['added']} added, {counts['updated']} updated, "
+                  f"{counts['skipped']} without coordinates")
+        index.save(args.index)
+        print(f"✓ {len(index)} companies indexed in {args.index}")
+        return
+
+    index = GridIndex.load(args.index)
+    start = time.perf_counter()
+    if args.command == 'radius':
+        print_results(index.radius(args.lat, args.lon, args.km), time.perf_counter() - start)
+    elif args.command == 'bbox':
+        results = index.bbox(args.min_lat, args.min_lon, args.max_lat, args.max_lon)
+        print_results(results, time.perf_counter() - start, with_distance=False)
+    elif args.command == 'nearest':
+        print_results(index.nearest(args.lat, args.lon, args.k), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
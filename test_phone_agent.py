@@ -5,6 +5,7 @@ Tests with a small sample of companies first
 """
 
 import json
+import logging
 from enhanced_phone_agent import EnhancedPhoneSearchAgent
 
 def test_with_sample():
@@ -82,6 +83,7 @@ def test_phone_extraction():
         print()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     print("Phone Search Agent Test")
     print("="*30)
     
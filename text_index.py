@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Inverted full-text index over company_name and business_purpose
+
+Text is lowercased and stripped of accents, so "hostelería" and "HOSTELERIA"
+match the same companies. CNAE codes found in the business purpose are
+indexed in their four-digit form as well, so "7020" also finds "70.20".
+The index is saved to disk and updated in place after each crawl.
+
+Query syntax (terms are ANDed by default):
+    consultoria madrid          both terms
+    hosteleria OR restaurante   either term
+    consult* -inmobiliaria      prefix match, excluding a term
+
+Examples:
+    python text_index.py build companies_with_phones_enhanced.json
+    python text_index.py add daily_delta.jl
+    python text_index.py search "hostelería OR restaurante*" -n 20
+"""
+
+import argparse
+import bisect
+import math
+import os
+import pickle
+import re
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from infobelscrapping.infobelscrapping.normalization import parse_cnae_codes
+from record_io import iter_records
+
+DEFAULT_INDEX_FILE = 'companies.textidx'
+TOKEN_RE = re.compile(r'\w+')
+# A CNAE code typed with its dot ('70.20') is looked up as the indexed '7020'
+CNAE_QUERY_RE = re.compile(r'(\d{2})\.(\d{2})')
+# Matches in the company name count more than matches in the business purpose
+NAME_WEIGHT = 2.0
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip accents ('Hostelería' -> 'hosteleria')"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(normalize_text(text or ''))
+
+
+class TextIndex:
+    """Inverted index from normalized tokens to weighted term frequencies per company"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.keys: List[str] = []
+        self.labels: List[str] = []
+        self.lengths: List[float] = []
+        # Forward index, so re-indexing a company can drop its old postings
+        self.doc_terms: List[Tuple[str, ...]] = []
+        self.doc_ids: Dict[str, int] = {}
+        self.total_length = 0.0
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def document_terms(self, record: Dict) -> Counter:
+        terms = Counter()
+        for token in tokenize(record.get('company_name', '')):
+            terms[token] += NAME_WEIGHT
+        purpose = record.get('business_purpose', '')
+        for token in tokenize(purpose):
+            terms[token] += 1
+        cnae_primary, cnae_secondary = parse_cnae_codes(purpose)
+        for code in ([cnae_primary] if cnae_primary else []) + cnae_secondary:
+            terms[code] += 1
+        return terms
+
+    def add(self, record: Dict) -> bool:
+        """Index or re-index one company; returns True when it is new"""
+        key = record.get('url') or record.get('company_name')
+        if not key:
+            return False
+        terms = self.document_terms(record)
+        length = sum(terms.values())
+
+        doc_id = self.doc_ids.get(key)
+        is_new = doc_id is None
+        if is_new:
+            doc_id = len(self.keys)
+            self.keys.append(key)
+            self.labels.append('')
+            self.lengths.append(0.0)
+            self.doc_terms.append(())
+            self.doc_ids[key] = doc_id
+        else:
+            for term in self.doc_terms[doc_id]:
+                postings = self.postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self.postings[term]
+                    self._vocabulary_dirty = True
+            self.total_length -= self.lengths[doc_id]
+
+        label = record.get('company_name', '')
+        if record.get('phone'):
+            label = f"{label} ({record['phone']})"
+        self.labels[doc_id] = label
+        self.lengths[doc_id] = length
+        self.doc_terms[doc_id] = tuple(terms)
+        self.total_length += length
+        for term, weight in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self._vocabulary_dirty = True
+            postings[doc_id] = weight
+        return is_new
+
+    def add_records(self, records: Iterable[Dict]) -> Dict:
+        counts = {'added': 0, 'updated': 0}
+        for record in records:
+            counts['added' if self.add(record) else 'updated'] += 1
+        return counts
+
+    def vocabulary(self) -> List[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        return self._vocabulary
+
+    def expand(self, term: str) -> List[str]:
+        """The indexed terms matching a query term ('consult*' is a prefix lookup)"""
+        if not term.endswith('*'):
+            return [term] if term in self.postings else []
+        prefix = term[:-1]
+        vocabulary = self.vocabulary()
+        start = bisect.bisect_left(vocabulary, prefix)
+        matches = []
+        for candidate in vocabulary[start:]:
+            if not candidate.startswith(prefix):
+                break
+            matches.append(candidate)
+        return matches
+
+    def matching_docs(self, term: str) -> Set[int]:
+        docs = set()
+        for expanded in self.expand(term):
+            docs.update(self.postings[expanded])
+        return docs
+
+    def parse_query(self, query: str) -> List[Tuple[List[str], List[str]]]:
+        """Split a query into OR-ed clauses of (required terms, excluded terms)"""
+        clauses = []
+        for clause in re.split(r'\s+OR\s+', query.strip()):
+            required, excluded = [], []
+            for word in clause.split():
+                target = excluded if word.startswith('-') else required
+                word = CNAE_QUERY_RE.sub(r'\1\2', word.lstrip('-'))
+                prefix = word.endswith('*')
+                for token in tokenize(word):
+                    target.append(token)
+                if prefix and target:
+                    target[-1] += '*'
+            if required:
+                clauses.append((required, excluded))
+        return clauses
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[float, str, str]]:
+        """Ranked matches as (score, key, label), best first"""
+        clauses = self.parse_query(query)
+        matches: Set[int] = set()
+        scored_terms: Set[str] = set()
+        for required, excluded in clauses:
+            # Intersect the rarest terms first
+            term_docs = sorted((self.matching_docs(term) for term in required), key=len)
+            docs = set(term_docs[0]) if term_docs else set()
+            for other in term_docs[1:]:
+                docs &= other
+                if not docs:
+                    break
+            for term in excluded:
+                docs -= self.matching_docs(term)
+            matches |= docs
+            for term in required:
+                scored_terms.update(self.expand(term))
+
+        scores = {}
+        doc_count = len(self.doc_ids)
+        avg_length = self.total_length / doc_count if doc_count else 0
+        for term in scored_terms:
+            postings = self.postings[term]
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                if doc_id not in matches:
+                    continue
+                norm = K1 * (1 - B + B * self.lengths[doc_id] / avg_length) if avg_length else K1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [(score, self.keys[doc_id], self.labels[doc_id]) for doc_id, score in best]
+
+    def save(self, path: str):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'postings': self.postings,
+                'keys': self.keys,
+                'labels': self.labels,
+                'lengths': self.lengths,
+                'doc_terms': self.doc_terms,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TextIndex':
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        index = cls()
+        index.postings = data['postings']
+        index.keys = data['keys']
+        index.labels = data['labels']
+        index.lengths = data['lengths']
+        index.doc_terms = data['doc_terms']
+        index.doc_ids = {key: doc_id for doc_id, key in enumerate(index.keys)}
+        index.total_length = sum(index.lengths)
+        index._vocabulary_dirty = True
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search over company names and business purposes")
+    parser.add_argument('--index', default=DEFAULT_INDEX_FILE, help="Index file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Build a new index from JSON/JSONL files")
+    build.add_argument('inputs', nargs='+')
+
+    add = subparsers.add_parser('add', help="Add or update companies in an existing index")
+    add.add_argument('inputs', nargs='+')
+
+    search = subparsers.add_parser('search', help="Run a query")
+    search.add_argument('query')
+    search.add_argument('-n', '--limit', type=int, default=20)
+
+    args = parser.parse_args()
+
+    if args.command in ('build', 'add'):
+        index = TextIndex() if args.command == 'build' else TextIndex.load(args.index)
+        for path in args.inputs:
+            counts = index.add_records(iter_records(path))
+            print(f"{path}: {counts['added']} added, {counts['updated']} updated")
+        index.save(args.index)
+        print(f"✓ {len(index)} companies indexed in {args.index}")
+        return
+
+    index = TextIndex.load(args.index)
+    start = time.perf_counter()
+    results = index.search(args.query, args.limit)
+    elapsed = time.perf_counter() - start
+    for score, key, label in results:
+        print(f"{score:7.2f}  {label}  {key}")
+    print(f"{len(results)} companies in {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()